@@ -1,32 +1,3249 @@
-from flask import Flask, render_template_string, request, jsonify, session
+from flask import Flask, Response, abort, g, request, jsonify, session
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
 import os
 import hashlib
+import atexit
+import base64
+import bisect
+import csv
+import gc
+import gzip
+import heapq
+import hmac
+import io
+import itertools
+import json
+import math
+import mmap
+import re
 import secrets
+import signal
+import struct
+import sys
+import threading
 import time
+import unicodedata
+import weakref
+import zlib
+from array import array
+from collections import OrderedDict, deque
 from functools import wraps
+from html import unescape
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional; sin él sólo se sirve gzip
+    brotli = None
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'clave-secreta-por-defecto-cambiar-en-produccion')
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SECURE'] = True  # Requiere HTTPS en producción
 app.config['PERMANENT_SESSION_LIFETIME'] = 1800  # 30 minutos
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'memory')  # memory | journal | sqlite
+app.config['SQLITE_PATH'] = os.environ.get('SQLITE_PATH', 'tareas.db')
+app.config['JOURNAL_DIR'] = os.environ.get('JOURNAL_DIR', 'diario')
+app.config['JOURNAL_SNAPSHOT_EVERY'] = int(os.environ.get('JOURNAL_SNAPSHOT_EVERY', 100000))  # registros
+app.config['JOURNAL_FSYNC'] = os.environ.get('JOURNAL_FSYNC', 'true').lower() == 'true'
+app.config['HASH_WORKERS'] = int(os.environ.get('HASH_WORKERS', os.cpu_count() or 2))
+app.config['HASH_QUEUE_DEPTH'] = int(os.environ.get('HASH_QUEUE_DEPTH', 32))
+app.config['HASH_RETRY_AFTER'] = 2  # segundos
+# Control de admisión: (peticiones concurrentes, peticiones en cola) por clase de ruta.
+# Las rutas que no aparecen en ADMISSION_ROUTES (sesión, métricas, estáticos) no esperan nunca.
+app.config['ADMISSION_LIMITS'] = {
+    'auth': (app.config['HASH_WORKERS'], app.config['HASH_QUEUE_DEPTH']),
+    'read': (int(os.environ.get('ADMISSION_READ_LIMIT', 32)), 256),
+    'write': (int(os.environ.get('ADMISSION_WRITE_LIMIT', 16)), 128),
+}
+app.config['ADMISSION_MAX_WAIT'] = float(os.environ.get('ADMISSION_MAX_WAIT', 1.0))  # segundos en cola
+# Token buckets de /api/login: (tokens por segundo, ráfaga). El de IP sólo
+# gasta con los intentos fallidos; el de email, con todos.
+app.config['LOGIN_RATE_LIMIT'] = os.environ.get('LOGIN_RATE_LIMIT', 'true').lower() == 'true'
+app.config['LOGIN_RATE_PER_IP'] = (1.0, 20)
+app.config['LOGIN_RATE_PER_EMAIL'] = (0.2, 5)
+app.config['LOGIN_RATE_MAX_KEYS'] = 100000  # buckets recordados por limitador
+# Proxies de confianza delante de la app. Con N > 0 la IP del cliente sale de
+# X-Forwarded-For (ProxyFix); sin ello, detrás de un proxy todos los clientes
+# tienen su IP y comparten el bucket de login por IP.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+app.config['TASKS_PAGE_SIZE'] = 50
+app.config['TASKS_MAX_PAGE_SIZE'] = 500
+app.config['MAX_CHANGE_LOG'] = 10000  # cambios recordados por usuario para la sincronización
+app.config['MAX_BATCH_SIZE'] = int(os.environ.get('MAX_BATCH_SIZE', 500))
+app.config['STORAGE_LOCK_STRIPES'] = 64
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'memory')  # memory | sqlite
+app.config['SESSION_SQLITE_PATH'] = os.environ.get('SESSION_SQLITE_PATH', 'sesiones.db')
+app.config['SESSION_CACHE_SIZE'] = 10000
+app.config['SESSION_CACHE_TTL'] = 5  # segundos que un worker confía en su caché
+app.config['SESSION_SWEEP_INTERVAL'] = 60  # segundos
+app.config['SSE_HEARTBEAT'] = 15  # segundos entre comentarios de keep-alive
+# A partir de cuántas tareas GET /api/tasks se envía en streaming por bloques
+app.config['STREAM_JSON_THRESHOLD'] = int(os.environ.get('STREAM_JSON_THRESHOLD', 5000))
+app.config['STREAM_JSON_CHUNK'] = 1000
+app.config['TASK_LIST_CACHE_BYTES'] = int(os.environ.get('TASK_LIST_CACHE_BYTES', 64 * 1024 * 1024))
+# Las tareas completadas hace más de ARCHIVE_AFTER segundos pasan al archivo (0 lo desactiva)
+app.config['ARCHIVE_AFTER'] = int(os.environ.get('ARCHIVE_AFTER', 30 * 24 * 3600))
+app.config['ARCHIVE_INTERVAL'] = 300  # segundos entre pasadas del archivador
+app.config['ARCHIVE_BATCH'] = 1000  # tareas por segmento
+app.config['IMPORT_MAX_LINE'] = 64 * 1024  # caracteres por línea NDJSON
+app.config['IMPORT_MAX_ERRORS'] = 20  # errores detallados en el resumen
+# Identificador de proceso para los ids de tarea (0-31); debe ser distinto en
+# cada proceso que comparta almacenamiento. Sin él, con SQLite cada proceso
+# reserva uno libre en la base (ver TaskIdLease); los demás backends son de un
+# solo proceso y usan el 0.
+app.config['TASK_ID_WORKER'] = int(os.environ['TASK_ID_WORKER']) if 'TASK_ID_WORKER' in os.environ else None
+app.config['TASK_ID_LEASE_TTL'] = 60  # segundos; se renueva cada tercio
+# Modo shards (python app.py --shards N, ver shards.py)
+app.config['SHARD_NAME'] = os.environ.get('SHARD_NAME')  # sólo lo tienen los procesos shard
+app.config['SHARD_DIR'] = os.environ.get('SHARD_DIR', 'shards')  # sockets, sesiones y datos de cada shard
+app.config['SHARD_POOL_SIZE'] = 32  # conexiones que el router mantiene abiertas con cada shard
+app.config['SHARD_REPLICAS'] = 128  # puntos de cada shard en el anillo de hashing
+# Con él, POST /internal/shards en el router añade un shard en caliente
+app.config['SHARD_ADMIN_TOKEN'] = os.environ.get('SHARD_ADMIN_TOKEN')
+
+# Límites (en segundos) de los histogramas de latencia
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class _ShardOwner:
+    """Vive en el threading.local de cada hilo; al morir el hilo se recoge su shard"""
+
+    __slots__ = ('__weakref__',)
+
+class Metrics:
+    """Contadores, gauges e histogramas en formato de texto de Prometheus.
+
+    Cada hilo escribe en su propio shard (un dict serie -> valores) sin
+    tomar ningún lock; render() suma los shards al exportar. Cuando un hilo
+    termina, su shard se vuelca en `_retired` para no perder lo acumulado.
+
+    Las series se identifican por (nombre, etiquetas), con las etiquetas
+    como tupla de pares (clave, valor).
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+        self._families = {}
+
+    def describe(self, name, kind, help_text):
+        """Registra tipo (counter, gauge o histogram) y ayuda de una métrica"""
+        self._families[name] = (kind, help_text)
+
+    def _new_shard(self):
+        shard = self._local.shard = {}
+        self._local.owner = owner = _ShardOwner()
+        weakref.finalize(owner, self._retire, shard)
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self._lock:
+            self._shards.remove(shard)
+            self._merge(self._retired, shard)
+
+    @staticmethod
+    def _merge(into, shard):
+        # list() copia los items sin soltar el GIL, así que es seguro aunque
+        # el hilo dueño del shard esté añadiendo series a la vez.
+        for key, values in list(shard.items()):
+            total = into.get(key)
+            if total is None:
+                into[key] = list(values)
+            else:
+                for index, value in enumerate(values):
+                    total[index] += value
+
+    def inc(self, name, labels=(), value=1):
+        """Suma `value` a un contador o gauge (en negativo para bajar un gauge)"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        key = (name, labels)
+        values = shard.get(key)
+        if values is None:
+            shard[key] = [value]
+        else:
+            values[0] += value
+
+    def observe(self, name, labels, seconds):
+        """Añade una medida al histograma; los valores son [cubos..., +Inf, suma]"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        key = (name, labels)
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = [0] * (len(self.buckets) + 2)
+        values[bisect.bisect_left(self.buckets, seconds)] += 1
+        values[-1] += seconds
+
+    def snapshot(self):
+        """Dict (nombre, etiquetas) -> valores, sumando todos los hilos"""
+        with self._lock:
+            totals = {key: list(values) for key, values in self._retired.items()}
+            for shard in self._shards:
+                self._merge(totals, shard)
+        return totals
+
+    def render(self, extra=()):
+        """Texto para /metrics; `extra` son muestras (nombre, etiquetas, valor) calculadas aparte"""
+        series = {}
+        for (name, labels), values in self.snapshot().items():
+            series.setdefault(name, []).append((labels, values))
+        for name, labels, value in extra:
+            series.setdefault(name, []).append((labels, [value]))
+
+        lines = []
+        for name in sorted(series):
+            kind, help_text = self._families.get(name, ('untyped', ''))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, values in sorted(series[name]):
+                if kind != 'histogram':
+                    lines.append(f'{name}{format_labels(labels)} {values[0]}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {values[-1]}')
+                lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+metrics = Metrics()
+metrics.describe('http_requests_total', 'counter', 'Peticiones atendidas por endpoint, método y estado')
+metrics.describe('http_request_duration_seconds', 'histogram', 'Latencia de las peticiones por endpoint')
+metrics.describe('http_requests_in_flight', 'gauge', 'Peticiones en curso por endpoint')
+metrics.describe('storage_operation_duration_seconds', 'histogram', 'Duración de las operaciones de almacenamiento')
+metrics.describe('pbkdf2_duration_seconds', 'histogram', 'Tiempo de cálculo de PBKDF2')
+metrics.describe('pbkdf2_queue_wait_seconds', 'histogram', 'Espera en cola del pool de PBKDF2')
+metrics.describe('pbkdf2_rejected_total', 'counter', 'Hashes rechazados por pool lleno')
+metrics.describe('pbkdf2_max_wait_seconds', 'gauge', 'Mayor espera en cola del pool de PBKDF2')
+metrics.describe('pbkdf2_max_compute_seconds', 'gauge', 'Mayor tiempo de cálculo de PBKDF2')
+metrics.describe('admission_queue_wait_seconds', 'histogram', 'Espera en la cola de admisión por clase de ruta')
+metrics.describe('admission_rejected_total', 'counter', 'Peticiones rechazadas por el control de admisión')
+metrics.describe('admission_active', 'gauge', 'Peticiones admitidas en curso por clase de ruta')
+metrics.describe('admission_queued', 'gauge', 'Peticiones esperando admisión por clase de ruta')
+metrics.describe('login_rate_limited_total', 'counter', 'Intentos de login frenados por el limitador, por tipo de clave')
+metrics.describe('archive_tasks_total', 'counter', 'Tareas movidas al archivo')
+metrics.describe('archive_bytes_total', 'counter', 'Bytes movidos al archivo, en JSON y ya comprimidos')
+metrics.describe('archive_run_duration_seconds', 'histogram', 'Duración de cada pasada del archivador')
+
+def begin_request(endpoint):
+    """Marca el inicio de una petición; devuelve el instante para end_request"""
+    metrics.inc('http_requests_in_flight', (('endpoint', endpoint),))
+    return time.perf_counter()
+
+def end_request(endpoint, method, status, started):
+    elapsed = time.perf_counter() - started
+    metrics.inc('http_requests_in_flight', (('endpoint', endpoint),), -1)
+    metrics.inc('http_requests_total', (('endpoint', endpoint), ('method', method), ('status', str(status))))
+    metrics.observe('http_request_duration_seconds', (('endpoint', endpoint), ('method', method)), elapsed)
+
+def instrument_storage(backend, operations):
+    """Decorador de clase: mide la duración de las operaciones públicas indicadas"""
+    def timed(fn):
+        labels = (('backend', backend), ('operation', fn.__name__))
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe('storage_operation_duration_seconds', labels, time.perf_counter() - started)
+        return wrapper
+
+    def decorate(cls):
+        for name in operations:
+            setattr(cls, name, timed(getattr(cls, name)))
+        return cls
+    return decorate
+
+STORAGE_OPERATIONS = ('get_user', 'create_user', 'list_tasks', 'count_tasks', 'add_task', 'toggle_task',
+                      'delete_task', 'update_task', 'page_tasks', 'apply_batch', 'task_changes', 'task_version',
+                      'search_tasks', 'due_tasks', 'archivable_users', 'archive_tasks', 'page_archive',
+                      'user_emails', 'export_user', 'import_user', 'delete_user')
+
+class _KeyView:
+    """Vista (created_at, id) de las filas, para usar bisect sobre dos columnas"""
+
+    __slots__ = ('created', 'ids')
+
+    def __init__(self, created, ids):
+        self.created = created
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, row):
+        return self.created[row], self.ids[row]
+
+class TaskColumns:
+    """Tareas de un usuario en columnas compactas.
+
+    Cada tarea es una fila: id en array('q'), created_at, due_at y
+    completed_at en array('d') (NaN si no tienen valor), completed en un bitset,
+    priority en un bytearray y el texto internado en una lista. Las filas se
+    mantienen ordenadas por (created_at, id), así que paginar y filtrar por
+    fecha es un bisect, y `rows` da la fila de cada id en O(1).
+
+    Borrar sólo marca la fila (texto None); cuando las filas muertas superan
+    a las vivas se compactan las columnas.
+    """
+
+    __slots__ = ('ids', 'created', 'completed', 'texts', 'due', 'priority', 'done', 'rows', 'dead')
+    # Columnas con un valor por fila, salvo el bitset de completed
+    COLUMNS = ('ids', 'created', 'texts', 'due', 'priority', 'done')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.created = array('d')
+        self.completed = bytearray()
+        self.texts = []
+        self.due = array('d')
+        self.priority = bytearray()
+        self.done = array('d')
+        self.rows = {}
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    def is_completed(self, row):
+        return bool(self.completed[row >> 3] & (1 << (row & 7)))
+
+    def set_completed(self, row, value):
+        if value:
+            self.completed[row >> 3] |= 1 << (row & 7)
+        else:
+            self.completed[row >> 3] &= ~(1 << (row & 7)) & 0xFF
+
+    def due_at(self, row):
+        due = self.due[row]
+        return None if due != due else due
+
+    def set_due_at(self, row, value):
+        self.due[row] = math.nan if value is None else value
+
+    def completed_at(self, row):
+        done = self.done[row]
+        return None if done != done else done
+
+    def set_completed_at(self, row, value):
+        self.done[row] = math.nan if value is None else value
+
+    def task(self, row):
+        """Materializa la fila como el dict que devuelven las rutas"""
+        return {
+            'id': self.ids[row],
+            'text': self.texts[row],
+            'completed': self.is_completed(row),
+            'created_at': self.created[row],
+            'due_at': self.due_at(row),
+            'priority': self.priority[row],
+            'completed_at': self.completed_at(row)
+        }
+
+    def keys(self):
+        return _KeyView(self.created, self.ids)
+
+    @staticmethod
+    def _values(task):
+        """Valores de la tarea en el orden de COLUMNS, más el de completed"""
+        # Las tareas del diario o de snapshots anteriores no traen estos campos
+        due_at = task.get('due_at')
+        # Sin completed_at, una tarea ya completada se da por completada al crearse
+        completed_at = task.get('completed_at', task['created_at'] if task['completed'] else None)
+        return (task['id'], task['created_at'], sys.intern(task['text']), math.nan if due_at is None else due_at,
+                task.get('priority', 0), math.nan if completed_at is None else completed_at), task['completed']
+
+    def insert(self, task):
+        key = (task['created_at'], task['id'])
+        row = len(self.ids)
+        # Lo normal es que la tarea nueva sea la más reciente y vaya al final
+        if row and key < (self.created[-1], self.ids[-1]):
+            row = bisect.bisect_left(self.keys(), key)
+        values, completed = self._values(task)
+        for name, value in zip(self.COLUMNS, values):
+            getattr(self, name).insert(row, value)
+        if row == len(self.ids) - 1:
+            if row & 7 == 0:
+                self.completed.append(0)
+            self.set_completed(row, completed)
+            self.rows[task['id']] = row
+        else:
+            self._shift_completed(row, completed)
+            self._reindex(row)
+
+    def insert_many(self, tasks):
+        """Inserta varias tareas de una vez.
+
+        Insertar una a una tareas con created_at antiguos (una importación)
+        desplaza en Python todas las filas siguientes en cada inserción. Aquí
+        se busca con bisect la posición de cada tarea del lote ordenado y las
+        columnas se reconstruyen a trozos desde la primera, copiando slices.
+        """
+        tasks = sorted(tasks, key=lambda task: (task['created_at'], task['id']))
+        if len(tasks) < 2 or not self.ids or (tasks[0]['created_at'], tasks[0]['id']) >= self.keys()[-1]:
+            for task in tasks:
+                self.insert(task)
+            return
+        if self.dead:
+            self.compact()
+        keys = self.keys()
+        positions = [bisect.bisect_left(keys, (task['created_at'], task['id'])) for task in tasks]
+        rows = [self._values(task) for task in tasks]
+        start = positions[0]
+        for index, name in enumerate(self.COLUMNS):
+            column = getattr(self, name)
+            tail = column[:0]
+            previous = start
+            for position, (values, _) in zip(positions, rows):
+                tail += column[previous:position]
+                tail.append(values[index])
+                previous = position
+            tail += column[previous:]
+            del column[start:]
+            column += tail
+        old = int.from_bytes(self.completed, 'little')
+        bits = old & ((1 << start) - 1)
+        offset = previous = start
+        for position, (_, completed) in zip(positions, rows):
+            bits |= (old >> previous & ((1 << (position - previous)) - 1)) << offset
+            offset += position - previous
+            bits |= int(bool(completed)) << offset
+            offset += 1
+            previous = position
+        bits |= old >> previous << offset
+        self.completed = bytearray(bits.to_bytes((len(self.ids) + 7) // 8, 'little'))
+        self.rows.update(zip(self.ids[start:], range(start, len(self.ids))))
+
+    def _shift_completed(self, row, value):
+        """Inserta un bit en `row` desplazando los siguientes"""
+        bits = int.from_bytes(self.completed, 'little')
+        low = bits & ((1 << row) - 1)
+        bits = low | (int(bool(value)) << row) | (bits >> row << (row + 1))
+        self.completed = bytearray(bits.to_bytes((len(self.ids) + 7) // 8, 'little'))
+
+    def _reindex(self, start):
+        for row in range(start, len(self.ids)):
+            if self.texts[row] is not None:
+                self.rows[self.ids[row]] = row
+
+    def delete(self, task_id):
+        row = self.rows.pop(task_id, None)
+        if row is None:
+            return False
+        self.texts[row] = None
+        self.dead += 1
+        if self.dead > 1024 and self.dead > len(self.rows):
+            self.compact()
+        return True
+
+    def export(self):
+        """Copia (ids, created, completed, texts, due, priority, done) de las filas vivas, para un snapshot"""
+        if self.dead:
+            self.compact()
+        return (array('q', self.ids), array('d', self.created), bytes(self.completed), list(self.texts),
+                array('d', self.due), bytes(self.priority), array('d', self.done))
+
+    @classmethod
+    def restore(cls, ids, created, completed, texts, due, priority, done):
+        columns = cls()
+        columns.ids, columns.created, columns.completed = ids, created, bytearray(completed)
+        columns.texts = [sys.intern(text) for text in texts]
+        columns.due, columns.priority, columns.done = due, bytearray(priority), done
+        columns.rows = {task_id: row for row, task_id in enumerate(ids)}
+        return columns
+
+    def compact(self):
+        """Reescribe las columnas sin las filas borradas"""
+        live = [row for row in range(len(self.ids)) if self.texts[row] is not None]
+        completed = [self.is_completed(row) for row in live]
+        self.ids = array('q', (self.ids[row] for row in live))
+        self.created = array('d', (self.created[row] for row in live))
+        self.texts = [self.texts[row] for row in live]
+        self.due = array('d', (self.due[row] for row in live))
+        self.priority = bytearray(self.priority[row] for row in live)
+        self.done = array('d', (self.done[row] for row in live))
+        self.completed = bytearray((len(live) + 7) // 8)
+        for row, value in enumerate(completed):
+            self.set_completed(row, value)
+        self.rows = {task_id: row for row, task_id in enumerate(self.ids)}
+        self.dead = 0
+
+SEARCH_TOKEN = re.compile(r'\w+')
+
+# Una coincidencia por prefijo ("tare" -> "tareas") puntúa menos que una exacta
+SEARCH_PREFIX_WEIGHT = 0.5
+
+def search_terms(text):
+    """Términos de búsqueda del texto: en minúsculas y sin tildes.
+
+    Las tareas se guardan escapadas por sanitize_input, así que primero se
+    deshace el escape para no indexar "amp", "lt" y compañía.
+    """
+    text = unicodedata.normalize('NFKD', unescape(text).casefold())
+    return SEARCH_TOKEN.findall(''.join(ch for ch in text if not unicodedata.combining(ch)))
+
+def score_matches(term, postings):
+    """Suma, por tarea, las apariciones de `term` en filas (término, id, apariciones)"""
+    matches = {}
+    for candidate, task_id, count in postings:
+        weight = 1.0 if candidate == term else SEARCH_PREFIX_WEIGHT
+        matches[task_id] = matches.get(task_id, 0) + count * weight
+    return matches
+
+def rank_search(term_matches, total, limit):
+    """Ids de las `limit` tareas que mejor casan con todos los términos.
+
+    `term_matches` tiene, por cada término de la consulta, un dict
+    id -> puntuación de sus coincidencias en esa tarea. Cada término pesa
+    según su rareza entre las `total` tareas del usuario; a igualdad de
+    puntuación gana la tarea más reciente.
+    """
+    scores = None
+    for matches in sorted(term_matches, key=len):
+        if not matches:
+            return []
+        idf = math.log(1 + total / len(matches))
+        if scores is None:
+            scores = {task_id: score * idf for task_id, score in matches.items()}
+        else:
+            scores = {task_id: score + matches[task_id] * idf
+                      for task_id, score in scores.items() if task_id in matches}
+    if not scores:
+        return []
+    return heapq.nlargest(limit, scores, key=lambda task_id: (scores[task_id], task_id))
+
+class TaskSearchIndex:
+    """Índice invertido de las tareas de un usuario.
+
+    `postings` guarda término -> {id: apariciones} y `terms` los mismos
+    términos ordenados, para resolver prefijos con bisect. Se actualiza en
+    cada alta, edición o borrado; nunca se reconstruye al buscar.
+    """
+
+    __slots__ = ('postings', 'terms')
+
+    def __init__(self):
+        self.postings = {}
+        self.terms = []
+
+    def add(self, task_id, text):
+        for term in search_terms(text):
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            posting[task_id] = posting.get(task_id, 0) + 1
+
+    def remove(self, task_id, text):
+        for term in set(search_terms(text)):
+            posting = self.postings.get(term)
+            if posting is None or posting.pop(task_id, None) is None or posting:
+                continue
+            del self.postings[term]
+            del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def postings_for(self, term):
+        """Filas (término, id, apariciones) de `term` y de los términos que empiezan por él"""
+        for index in range(bisect.bisect_left(self.terms, term), len(self.terms)):
+            candidate = self.terms[index]
+            if not candidate.startswith(term):
+                break
+            for task_id, count in self.postings[candidate].items():
+                yield candidate, task_id, count
+
+class TaskStore:
+    """Almacén de tareas por usuario indexado por id.
+
+    Cada usuario tiene un TaskColumns: buscar, alternar o eliminar una tarea
+    por id es O(1), el listado sale en orden de creación y paginar por
+    (created_at, id) es un bisect sobre las columnas.
+
+    Cada cambio incrementa la versión del usuario y mueve el id al final de
+    su registro de cambios (id -> versión), de modo que changes() recorre
+    sólo lo modificado desde la versión pedida. Los ids borrados quedan en
+    ese registro como lápidas. El registro guarda como mucho `max_changes`
+    entradas por usuario; quien pida cambios más antiguos recibe un reset.
+
+    El TaskSearchIndex de cada usuario se construye la primera vez que busca
+    y desde entonces se mantiene al día en add, update y delete. Igual el
+    índice de vencimientos: una lista ordenada de (due_at, -priority, id)
+    con las tareas pendientes que tienen fecha límite, de modo que las
+    próximas y las vencidas salen con un bisect; y el de completadas, con
+    (completed_at, id), que usa el archivado.
+
+    No es seguro entre hilos por sí mismo; MemoryStorage lo protege.
+    """
+
+    def __init__(self, max_changes=10000):
+        self.max_changes = max_changes
+        self._columns = {}
+        self._versions = {}
+        self._changes = {}
+        self._floor = {}
+        self._search = {}
+        self._due = {}
+        self._done = {}
+
+    def create_user(self, user_email):
+        if user_email not in self._columns:
+            self._columns[user_email] = TaskColumns()
+            self._versions[user_email] = 0
+            self._changes[user_email] = OrderedDict()
+            self._floor[user_email] = 0
+
+    def _record_change(self, user_email, task_id):
+        version = self._versions[user_email] + 1
+        self._versions[user_email] = version
+        changes = self._changes[user_email]
+        changes[task_id] = version
+        changes.move_to_end(task_id)
+        if len(changes) > self.max_changes:
+            _, self._floor[user_email] = changes.popitem(last=False)
+        return version
+
+    @staticmethod
+    def _due_key(columns, row):
+        """Clave de la fila en el índice de vencimientos; None si no entra en él"""
+        due = columns.due[row]
+        if due != due or columns.is_completed(row):
+            return None
+        return due, -columns.priority[row], columns.ids[row]
+
+    @staticmethod
+    def _done_key(columns, row):
+        done = columns.done[row]
+        return None if done != done else (done, columns.ids[row])
+
+    @staticmethod
+    def _reindex(indexes, user_email, old, new):
+        index = indexes.get(user_email)
+        if index is None or old == new:
+            return
+        if old is not None:
+            del index[bisect.bisect_left(index, old)]
+        if new is not None:
+            bisect.insort(index, new)
+
+    def _keys(self, columns, row):
+        return self._due_key(columns, row), self._done_key(columns, row)
+
+    def _reindex_row(self, user_email, old, new):
+        """Pasa la fila de sus claves `old` a `new` en los índices de vencimientos y completadas"""
+        self._reindex(self._due, user_email, old[0], new[0])
+        self._reindex(self._done, user_email, old[1], new[1])
+
+    def list(self, user_email):
+        """Tareas del usuario en orden de creación"""
+        columns = self._columns.get(user_email)
+        if columns is None:
+            return []
+        return [columns.task(row) for row in range(len(columns.ids)) if columns.texts[row] is not None]
+
+    def get(self, user_email, task_id):
+        columns = self._columns.get(user_email)
+        row = columns.rows.get(task_id) if columns is not None else None
+        return None if row is None else columns.task(row)
+
+    def add_many(self, user_email, tasks):
+        """Como add() para un lote de tareas nuevas, mezclándolas con las columnas de una vez"""
+        self.create_user(user_email)
+        columns = self._columns[user_email]
+        columns.insert_many(tasks)
+        search = self._search.get(user_email)
+        for task in tasks:
+            if search is not None:
+                search.add(task['id'], task['text'])
+            self._reindex_row(user_email, (None, None), self._keys(columns, columns.rows[task['id']]))
+            self._record_change(user_email, task['id'])
+        return tasks
+
+    def add(self, user_email, task):
+        self.create_user(user_email)
+        columns = self._columns[user_email]
+        columns.insert(task)
+        search = self._search.get(user_email)
+        if search is not None:
+            search.add(task['id'], task['text'])
+        self._reindex_row(user_email, (None, None), self._keys(columns, columns.rows[task['id']]))
+        self._record_change(user_email, task['id'])
+        return task
+
+    def toggle(self, user_email, task_id):
+        """Invierte el estado de la tarea; devuelve None si no existe"""
+        columns = self._columns.get(user_email)
+        row = columns.rows.get(task_id) if columns is not None else None
+        if row is None:
+            return None
+        old = self._keys(columns, row)
+        completed = not columns.is_completed(row)
+        columns.set_completed(row, completed)
+        columns.set_completed_at(row, time.time() if completed else None)
+        self._reindex_row(user_email, old, self._keys(columns, row))
+        self._record_change(user_email, task_id)
+        return columns.task(row)
+
+    def update(self, user_email, task_id, changes):
+        """Aplica los campos de `changes` a la tarea; devuelve None si no existe"""
+        columns = self._columns.get(user_email)
+        row = columns.rows.get(task_id) if columns is not None else None
+        if row is None:
+            return None
+        old = self._keys(columns, row)
+        if 'text' in changes:
+            search = self._search.get(user_email)
+            if search is not None:
+                search.remove(task_id, columns.texts[row])
+                search.add(task_id, changes['text'])
+            columns.texts[row] = sys.intern(changes['text'])
+        if 'completed' in changes and changes['completed'] != columns.is_completed(row):
+            columns.set_completed(row, changes['completed'])
+            columns.set_completed_at(row, time.time() if changes['completed'] else None)
+        # El diario guarda la fecha ya resuelta para reproducir el mismo estado
+        if 'completed_at' in changes:
+            columns.set_completed_at(row, changes['completed_at'])
+        if 'due_at' in changes:
+            columns.set_due_at(row, changes['due_at'])
+        if 'priority' in changes:
+            columns.priority[row] = changes['priority']
+        self._reindex_row(user_email, old, self._keys(columns, row))
+        self._record_change(user_email, task_id)
+        return columns.task(row)
+
+    def delete(self, user_email, task_id):
+        """Elimina la tarea; devuelve False si no existía"""
+        columns = self._columns.get(user_email)
+        row = columns.rows.get(task_id) if columns is not None else None
+        if row is None:
+            return False
+        search = self._search.get(user_email)
+        if search is not None:
+            search.remove(task_id, columns.texts[row])
+        self._reindex_row(user_email, self._keys(columns, row), (None, None))
+        columns.delete(task_id)
+        self._record_change(user_email, task_id)
+        return True
+
+    def count(self, user_email):
+        columns = self._columns.get(user_email)
+        return len(columns) if columns is not None else 0
+
+    def page(self, user_email, limit, after=None, completed=None,
+             created_from=None, created_to=None, descending=False):
+        """Página de tareas ordenadas por (created_at, id).
+
+        `after` es la clave (created_at, id) de la última tarea de la página
+        anterior. Devuelve (tareas, clave_siguiente); la clave es None si no
+        quedan más resultados.
+        """
+        columns = self._columns.get(user_email)
+        if columns is None:
+            return [], None
+        keys = columns.keys()
+        lo = bisect.bisect_left(keys, (created_from,)) if created_from is not None else 0
+        hi = bisect.bisect_left(keys, (created_to,)) if created_to is not None else len(keys)
+        if descending:
+            if after is not None:
+                hi = min(hi, bisect.bisect_left(keys, after))
+            rows = range(hi - 1, lo - 1, -1)
+        else:
+            if after is not None:
+                lo = max(lo, bisect.bisect_right(keys, after))
+            rows = range(lo, hi)
+
+        page = []
+        for row in rows:
+            if columns.texts[row] is None:
+                continue
+            if completed is not None and columns.is_completed(row) != completed:
+                continue
+            if len(page) == limit:
+                last = page[-1]
+                return page, (last['created_at'], last['id'])
+            page.append(columns.task(row))
+        return page, None
+
+    def search(self, user_email, query, limit):
+        """Tareas que contienen todos los términos de `query`, de más a menos relevante"""
+        columns = self._columns.get(user_email)
+        terms = set(search_terms(query))
+        if columns is None or not terms:
+            return []
+        index = self._search.get(user_email)
+        if index is None:
+            index = self._search[user_email] = TaskSearchIndex()
+            for row in columns.rows.values():
+                index.add(columns.ids[row], columns.texts[row])
+        ranked = rank_search([score_matches(term, index.postings_for(term)) for term in terms], self.count(user_email), limit)
+        return [self.get(user_email, task_id) for task_id in ranked]
+
+    def due(self, user_email, now, limit, overdue=False):
+        """Tareas pendientes con fecha límite: las `limit` siguientes a `now`
+        o, con `overdue`, las ya vencidas empezando por la más antigua.
+        A igual fecha va primero la de mayor prioridad."""
+        columns = self._columns.get(user_email)
+        if columns is None:
+            return []
+        index = self._due.get(user_email)
+        if index is None:
+            keys = (self._due_key(columns, row) for row in columns.rows.values())
+            index = self._due[user_email] = sorted(key for key in keys if key is not None)
+        split = bisect.bisect_left(index, (now,))
+        keys = index[:min(split, limit)] if overdue else index[split:split + limit]
+        return [columns.task(columns.rows[task_id]) for _, _, task_id in keys]
+
+    def completed_before(self, user_email, before, limit):
+        """Ids de hasta `limit` tareas completadas antes de `before`, de la más antigua a la más reciente"""
+        columns = self._columns.get(user_email)
+        if columns is None:
+            return []
+        index = self._done.get(user_email)
+        if index is None:
+            keys = (self._done_key(columns, row) for row in columns.rows.values())
+            index = self._done[user_email] = sorted(key for key in keys if key is not None)
+        return [task_id for _, task_id in index[:min(bisect.bisect_left(index, (before,)), limit)]]
+
+    def delete_completed(self, user_email, task_ids):
+        """Elimina las tareas que acaba de devolver completed_before.
+
+        Son el principio del índice de completadas, así que se recorta de
+        una vez en lugar de quitarlas de una en una.
+        """
+        index = self._done.pop(user_email, None)
+        for task_id in task_ids:
+            self.delete(user_email, task_id)
+        if index is not None:
+            self._done[user_email] = index[len(task_ids):]
+
+    def version(self, user_email):
+        return self._versions.get(user_email, 0)
+
+    def users(self):
+        return list(self._columns)
+
+    def drop_user(self, user_email):
+        """Olvida al usuario con todas sus tareas e índices"""
+        for state in (self._columns, self._versions, self._changes, self._floor, self._search, self._due, self._done):
+            state.pop(user_email, None)
+
+    def rebase(self, user_email, version):
+        """Salta a `version` vaciando el registro: quien pida cambios anteriores recibe un reset"""
+        self._versions[user_email] = version
+        self._changes[user_email] = OrderedDict()
+        self._floor[user_email] = version
+
+    def export(self, user_email):
+        """(versión, columnas) del usuario para un snapshot"""
+        return self._versions[user_email], self._columns[user_email].export()
+
+    def restore(self, user_email, version, columns):
+        """Carga el estado de un snapshot; los cambios anteriores a él provocan un reset"""
+        self._columns[user_email] = TaskColumns.restore(*columns)
+        self._versions[user_email] = version
+        self._changes[user_email] = OrderedDict()
+        self._floor[user_email] = version
+        self._search.pop(user_email, None)
+        self._due.pop(user_email, None)
+        self._done.pop(user_email, None)
+
+    def changes(self, user_email, since):
+        """Cambios posteriores a `since` como (versión, cambiadas, borradas, reset).
+
+        Si `since` es anterior a lo que recuerda el registro, reset es True y
+        `cambiadas` contiene la lista completa.
+        """
+        version = self.version(user_email)
+        if since <= 0 or since < self._floor.get(user_email, 0) or since > version:
+            return version, self.list(user_email), [], True
+
+        changed, deleted = [], []
+        changes = self._changes.get(user_email, {})
+        for task_id in reversed(changes):
+            if changes[task_id] <= since:
+                break
+            task = self.get(user_email, task_id)
+            if task is None:
+                deleted.append(task_id)
+            else:
+                changed.append(task)
+        changed.reverse()
+        return version, changed, deleted, False
+
+class BatchError(Exception):
+    """Una operación del lote no se puede aplicar; no se aplica ninguna"""
+
+    def __init__(self, index, message):
+        super().__init__(message)
+        self.index = index
+        self.message = message
+
+def encode_archive_segment(tasks):
+    """Segmento de archivo: el JSON de las tareas comprimido; devuelve (segmento, bytes sin comprimir)"""
+    raw = json.dumps(tasks, separators=(',', ':')).encode('utf-8')
+    return zlib.compress(raw, 6), len(raw)
+
+def page_archive_segments(segments, limit, after=None):
+    """Página de tareas archivadas a partir de la clave (segmento, posición).
+
+    `segments` produce (número, segmento comprimido) en orden a partir del
+    segmento de `after`; sólo se descomprimen los que toca la página. La
+    clave devuelta es la de la primera tarea de la página siguiente, o None.
+    """
+    first, start = after if after is not None else (0, 0)
+    page = []
+    for number, segment in segments:
+        tasks = json.loads(zlib.decompress(segment))
+        for position in range(start if number == first else 0, len(tasks)):
+            if len(page) == limit:
+                return page, (number, position)
+            page.append(tasks[position])
+    return page, None
+
+class TaskArchive:
+    """Almacén frío de tareas archivadas: por usuario, segmentos comprimidos
+    a los que sólo se añade.
+
+    Con `directory` cada usuario tiene un fichero con sus segmentos, cada
+    uno en una trama <longitud, crc32> como las del diario; sin él, los
+    segmentos se guardan en memoria (para MemoryStorage, que tampoco
+    persiste lo demás). El índice de segmentos de cada fichero se carga la
+    primera vez que se usa, leyendo sólo las cabeceras.
+    """
+
+    FRAME = struct.Struct('<II')
+
+    def __init__(self, directory=None, fsync=True):
+        self.directory = directory
+        self.fsync = fsync
+        self._segments = {}  # email -> [(posición, longitud)]
+        self._blobs = {}
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, user_email):
+        return os.path.join(self.directory, hashlib.sha256(user_email.encode('utf-8')).hexdigest()[:32] + '.seg')
+
+    def _index(self, user_email):
+        segments = self._segments.get(user_email)
+        if segments is not None:
+            return segments
+        segments = self._segments[user_email] = []
+        if self.directory is None or not os.path.exists(self._path(user_email)):
+            return segments
+        with open(self._path(user_email), 'rb') as f:
+            offset = 0
+            while True:
+                frame = f.read(self.FRAME.size)
+                if len(frame) < self.FRAME.size:
+                    break
+                length, _ = self.FRAME.unpack(frame)
+                segments.append((offset + self.FRAME.size, length))
+                offset += self.FRAME.size + length
+                f.seek(offset)
+        return segments
+
+    def append(self, user_email, segment):
+        """Añade un segmento ya comprimido; devuelve el tamaño del archivo tras escribirlo"""
+        frame = self.FRAME.pack(len(segment), zlib.crc32(segment)) + segment
+        with self._lock:
+            segments = self._index(user_email)
+            offset = segments[-1][0] + segments[-1][1] if segments else 0
+            if self.directory is None:
+                self._blobs.setdefault(user_email, bytearray()).extend(frame)
+            else:
+                with open(self._path(user_email), 'ab') as f:
+                    f.write(frame)
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+            segments.append((offset + self.FRAME.size, len(segment)))
+            return offset + len(frame)
+
+    def truncate(self, user_email, size):
+        """Descarta lo escrito después de `size`: segmentos cuyo movimiento no llegó a confirmarse"""
+        with self._lock:
+            if self.directory is None:
+                del self._blobs.get(user_email, bytearray())[size:]
+            elif os.path.exists(self._path(user_email)) and os.path.getsize(self._path(user_email)) > size:
+                with open(self._path(user_email), 'r+b') as f:
+                    f.truncate(size)
+            self._segments.pop(user_email, None)
+
+    def drop(self, user_email):
+        """Elimina todos los segmentos del usuario"""
+        with self._lock:
+            self._blobs.pop(user_email, None)
+            self._segments.pop(user_email, None)
+            if self.directory is not None and os.path.exists(self._path(user_email)):
+                os.remove(self._path(user_email))
+
+    def segments(self, user_email, first=0):
+        """(número, segmento) desde el segmento `first`, leídos a medida que se piden"""
+        with self._lock:
+            segments = list(self._index(user_email))
+        if self.directory is None:
+            blob = self._blobs.get(user_email, b'')
+            for number in range(first, len(segments)):
+                offset, length = segments[number]
+                yield number, bytes(blob[offset:offset + length])
+            return
+        if first >= len(segments):
+            return
+        with open(self._path(user_email), 'rb') as f:
+            for number in range(first, len(segments)):
+                offset, length = segments[number]
+                f.seek(offset)
+                yield number, f.read(length)
+
+    def page(self, user_email, limit, after=None):
+        return page_archive_segments(self.segments(user_email, after[0] if after else 0), limit, after)
+
+@instrument_storage('memory', STORAGE_OPERATIONS)
+class MemoryStorage:
+    """Backend en memoria: usuarios en un dict y tareas en un TaskStore.
+
+    Es el más rápido pero se pierde al reiniciar y no se comparte entre
+    procesos. Las operaciones de cada usuario se serializan con un lock
+    elegido por hash del email entre `lock_stripes` locks, de modo que
+    usuarios distintos casi nunca compiten por el mismo.
+
+    Las tareas archivadas salen de TaskStore y pasan a `archive`.
+    """
+
+    def __init__(self, max_changes=10000, lock_stripes=64, archive=None):
+        self.users = {}
+        self.tasks = TaskStore(max_changes)
+        self.archive = archive if archive is not None else TaskArchive()
+        self._locks = [threading.RLock() for _ in range(lock_stripes)]
+
+    def _lock(self, email):
+        return self._locks[hash(email) % len(self._locks)]
+
+    def get_user(self, email):
+        return self.users.get(email)
+
+    def create_user(self, email, user):
+        """Registra el usuario; devuelve False si el email ya existe"""
+        with self._lock(email):
+            if email in self.users:
+                return False
+            self.users[email] = user
+            self.tasks.create_user(email)
+            return True
+
+    def list_tasks(self, user_email):
+        with self._lock(user_email):
+            return self.tasks.list(user_email)
+
+    def count_tasks(self, user_email):
+        return self.tasks.count(user_email)
+
+    def add_task(self, user_email, task):
+        with self._lock(user_email):
+            return self.tasks.add(user_email, task)
+
+    def toggle_task(self, user_email, task_id):
+        with self._lock(user_email):
+            return self.tasks.toggle(user_email, task_id)
+
+    def delete_task(self, user_email, task_id):
+        with self._lock(user_email):
+            return self.tasks.delete(user_email, task_id)
+
+    def update_task(self, user_email, task_id, changes):
+        with self._lock(user_email):
+            return self.tasks.update(user_email, task_id, changes)
+
+    def page_tasks(self, user_email, limit, **filters):
+        with self._lock(user_email):
+            return self.tasks.page(user_email, limit, **filters)
+
+    def apply_batch(self, user_email, operations):
+        """Aplica las operaciones en orden, todas o ninguna.
+
+        Primero se valida el lote completo contra el estado actual (teniendo
+        en cuenta el efecto de las operaciones previas del propio lote) y
+        sólo entonces se aplica, así que nunca queda a medias.
+        """
+        with self._lock(user_email):
+            return self._apply_batch(user_email, operations)
+
+    def _apply_batch(self, user_email, operations):
+        exists = {}
+        for index, operation in enumerate(operations):
+            op = operation['op']
+            task_id = operation['task']['id'] if op == 'create' else operation['id']
+            if task_id not in exists:
+                exists[task_id] = self.tasks.get(user_email, task_id) is not None
+            if op == 'create':
+                if exists[task_id]:
+                    raise BatchError(index, 'La tarea ya existe')
+                exists[task_id] = True
+            elif op == 'delete':
+                exists[task_id] = False
+            elif not exists[task_id]:
+                raise BatchError(index, 'Tarea no encontrada')
+
+        results = []
+        # Las altas seguidas van juntas: con created_at antiguos (importaciones)
+        # insertarlas de una en una sería cuadrático
+        creates = []
+
+        def add_creates():
+            if creates:
+                results.extend(self.tasks.add_many(user_email, creates))
+                creates.clear()
+
+        for operation in operations:
+            op = operation['op']
+            if op == 'create':
+                creates.append(operation['task'])
+                continue
+            add_creates()
+            if op == 'toggle':
+                results.append(self.tasks.toggle(user_email, operation['id']))
+            elif op == 'update':
+                results.append(self.tasks.update(user_email, operation['id'], operation['changes']))
+            else:
+                deleted = self.tasks.delete(user_email, operation['id'])
+                results.append({'id': operation['id'], 'deleted': deleted})
+        add_creates()
+        return results
+
+    def task_changes(self, user_email, since):
+        with self._lock(user_email):
+            return self.tasks.changes(user_email, since)
+
+    def task_version(self, user_email):
+        return self.tasks.version(user_email)
+
+    def search_tasks(self, user_email, query, limit):
+        with self._lock(user_email):
+            return self.tasks.search(user_email, query, limit)
+
+    def due_tasks(self, user_email, now, limit, overdue=False):
+        with self._lock(user_email):
+            return self.tasks.due(user_email, now, limit, overdue)
+
+    def archivable_users(self, before):
+        """Usuarios con tareas completadas antes de `before`"""
+        users = []
+        for email in self.tasks.users():
+            with self._lock(email):
+                if self.tasks.completed_before(email, before, 1):
+                    users.append(email)
+        return users
+
+    def archive_tasks(self, user_email, before, limit):
+        """Mueve al archivo hasta `limit` tareas completadas antes de `before`.
+
+        Devuelve (tareas, bytes sin comprimir, bytes comprimidos).
+        """
+        with self._lock(user_email):
+            moved, raw, stored, _ = self._archive(user_email, before, limit)
+        return len(moved), raw, stored
+
+    def _archive(self, user_email, before, limit):
+        ids = self.tasks.completed_before(user_email, before, limit)
+        if not ids:
+            return ids, 0, 0, None
+        segment, raw = encode_archive_segment([self.tasks.get(user_email, task_id) for task_id in ids])
+        size = self.archive.append(user_email, segment)
+        self.tasks.delete_completed(user_email, ids)
+        return ids, raw, len(segment), size
+
+    def page_archive(self, user_email, limit, after=None):
+        return self.archive.page(user_email, limit, after)
+
+    def user_emails(self):
+        return list(self.users)
+
+    def export_user(self, email):
+        """Usuario, versión, tareas y segmentos archivados, para moverlo a otro shard; None si no existe"""
+        with self._lock(email):
+            user = self.users.get(email)
+            if user is None:
+                return None
+            return {'user': user, 'version': self.tasks.version(email), 'tasks': self.tasks.list(email),
+                    'archive': [segment for _, segment in self.archive.segments(email)]}
+
+    def import_user(self, email, dump):
+        """Da de alta un usuario exportado por export_user(); False si ya existe aquí"""
+        with self._lock(email):
+            if email in self.users:
+                return False
+            self._import_archive(email, dump['archive'])
+            self._import_user(email, dump)
+            return True
+
+    def _import_user(self, email, dump):
+        self.users[email] = dump['user']
+        self.tasks.create_user(email)
+        for task in dump['tasks']:
+            self.tasks.add(email, task)
+        # Por encima de la versión de origen: quien sincronizaba allí recibe un reset
+        self.tasks.rebase(email, dump['version'] + 1)
+
+    def _import_archive(self, email, segments):
+        """Copia los segmentos tal cual; devuelve el tamaño del archivo"""
+        # Lo que quedara es de una copia anterior del usuario que ya no está aquí
+        self.archive.truncate(email, 0)
+        size = 0
+        for segment in segments:
+            size = self.archive.append(email, segment)
+        return size
+
+    def delete_user(self, email):
+        """Elimina al usuario con sus tareas y su archivo; False si no existía"""
+        with self._lock(email):
+            if email not in self.users:
+                return False
+            self._delete_user(email)
+            return True
+
+    def _delete_user(self, email):
+        self.users.pop(email, None)
+        self.tasks.drop_user(email)
+        self.archive.drop(email)
+
+class Journal:
+    """Diario de escritura en disco con group commit.
+
+    append() encola el registro y devuelve su número de secuencia; commit()
+    espera a que esté en disco. El primer hilo que llega a commit() sin un
+    volcado en curso escribe y hace fsync de todo lo pendiente de una vez,
+    mientras los demás esperan; así muchas escrituras concurrentes
+    comparten un solo fsync.
+
+    Cada registro es una trama <longitud, crc32> seguida de JSON; una trama
+    incompleta o corrupta al final indica un corte a mitad de escritura.
+    """
+
+    FRAME = struct.Struct('<II')
+
+    def __init__(self, path, fsync=True):
+        self.fsync = fsync
+        self._file = open(path, 'ab')
+        self._cond = threading.Condition()
+        self._pending = []
+        self._appended = 0
+        self._durable = 0
+        self._flushing = False
+
+    @classmethod
+    def encode(cls, record):
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        return cls.FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+    @classmethod
+    def read(cls, path):
+        """Registros válidos del diario y la posición donde terminan"""
+        records, offset = [], 0
+        if os.path.getsize(path) == 0:
+            return records, offset
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            while offset + cls.FRAME.size <= len(data):
+                length, crc = cls.FRAME.unpack_from(data, offset)
+                payload = data[offset + cls.FRAME.size:offset + cls.FRAME.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                records.append(json.loads(payload))
+                offset += cls.FRAME.size + length
+        return records, offset
+
+    def append(self, record):
+        frame = self.encode(record)
+        with self._cond:
+            self._pending.append(frame)
+            self._appended += 1
+            return self._appended
+
+    def commit(self, sequence):
+        with self._cond:
+            while self._durable < sequence:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flush_locked()
+
+    def _flush_locked(self):
+        """Vuelca lo pendiente; se llama con el lock tomado y lo suelta mientras escribe"""
+        self._flushing = True
+        batch, self._pending = self._pending, []
+        target = self._appended
+        self._cond.release()
+        try:
+            self._file.write(b''.join(batch))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        finally:
+            self._cond.acquire()
+            self._flushing = False
+            self._cond.notify_all()
+        self._durable = target
+
+    def rotate(self, path):
+        """Vuelca lo pendiente y sigue escribiendo en un fichero nuevo"""
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            if self._pending:
+                self._flush_locked()
+            self._file.close()
+            self._file = open(path, 'ab')
+
+    def close(self):
+        self.rotate(os.devnull)
+        self._file.close()
+
+# La versión va en la cabecera; las anteriores se siguen pudiendo leer
+SNAPSHOT_MAGIC = b'TASKSNAP3\n'
+SNAPSHOT_VERSIONS = {b'TASKSNAP1\n': 1, b'TASKSNAP2\n': 2, SNAPSHOT_MAGIC: 3}
+SNAPSHOT_LENGTH = struct.Struct('<Q')
+
+def write_snapshot(path, users, tasks, archive=None):
+    """Escribe un snapshot: usuarios y, por usuario, sus columnas de tareas.
+
+    `tasks` es una lista de (email, versión, columnas) con las columnas de
+    TaskColumns.export(). Las columnas numéricas se guardan tal cual están
+    en memoria para cargarlas con array.frombytes, sin parsear tarea a tarea.
+    `archive` es el tamaño confirmado del archivo de cada usuario.
+    """
+    header = {'users': users,
+              'archive': archive or {},
+              'tasks': [{'email': email, 'version': version, 'count': len(columns[0])}
+                        for email, version, columns in tasks]}
+    with open(path + '.tmp', 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        for blob in [json.dumps(header).encode('utf-8')] + [
+                part for _, _, (ids, created, completed, texts, due, priority, done) in tasks
+                for part in (ids.tobytes(), created.tobytes(), completed, json.dumps(texts).encode('utf-8'),
+                             due.tobytes(), priority, done.tobytes())]:
+            f.write(SNAPSHOT_LENGTH.pack(len(blob)))
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+def read_snapshot(path):
+    """Inverso de write_snapshot, leyendo el fichero con mmap; devuelve (usuarios, tareas, archivo)"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        version = SNAPSHOT_VERSIONS.get(data[:len(SNAPSHOT_MAGIC)])
+        if version is None:
+            raise ValueError(f'Snapshot inválido: {path}')
+        offset = len(SNAPSHOT_MAGIC)
+
+        def blob():
+            nonlocal offset
+            length, = SNAPSHOT_LENGTH.unpack_from(data, offset)
+            offset += SNAPSHOT_LENGTH.size + length
+            return memoryview(data)[offset - length:offset]
+
+        def floats():
+            column = array('d')
+            with blob() as view:
+                column.frombytes(view)
+            return column
+
+        with blob() as view:
+            header = json.loads(bytes(view))
+        tasks = []
+        for entry in header['tasks']:
+            ids = array('q')
+            with blob() as view:
+                ids.frombytes(view)
+            created = floats()
+            with blob() as view:
+                completed = bytes(view)
+            with blob() as view:
+                texts = json.loads(bytes(view))
+            if version >= 2:
+                due = floats()
+                with blob() as view:
+                    priority = bytes(view)
+            else:
+                due, priority = array('d', [math.nan]) * len(ids), bytes(len(ids))
+            if version >= 3:
+                done = floats()
+            else:
+                # Igual que TaskColumns.insert con tareas sin completed_at
+                done = array('d', (created[row] if completed[row >> 3] & (1 << (row & 7)) else math.nan
+                                   for row in range(len(ids))))
+            tasks.append((entry['email'], entry['version'], (ids, created, completed, texts, due, priority, done)))
+    return header['users'], tasks, header.get('archive', {})
+
+@instrument_storage('journal', ('create_user', 'add_task', 'toggle_task', 'delete_task', 'update_task', 'apply_batch',
+                               'archive_tasks'))
+class JournaledStorage(MemoryStorage):
+    """MemoryStorage con durabilidad: diario de escritura más snapshots.
+
+    Cada escritura se aplica en memoria y se anota en el diario bajo el lock
+    del usuario, de modo que el orden del diario es el de las operaciones;
+    la espera al fsync (compartido por group commit) ocurre ya fuera del
+    lock. Cada `snapshot_every` registros se vuelca un snapshot compacto y
+    se descartan los diarios anteriores a él.
+
+    En disco hay ficheros snapshot-N.bin (estado al empezar journal-N.log)
+    y journal-N.log; al arrancar se carga el snapshot más reciente y se
+    reproducen los diarios desde su generación.
+
+    El archivo de tareas va en el subdirectorio `archivo`. Cada segmento se
+    escribe antes de anotar en el diario qué tareas salieron y hasta dónde
+    llega el archivo; al arrancar se descarta lo que pase de esa marca, que
+    son segmentos de un movimiento que no llegó a confirmarse.
+    """
+
+    def __init__(self, directory, snapshot_every=100000, fsync=True, max_changes=10000, lock_stripes=64):
+        super().__init__(max_changes, lock_stripes, TaskArchive(os.path.join(directory, 'archivo'), fsync))
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self._archive_sizes = {}
+        self._dropped = set()  # usuarios eliminados en los diarios que se reproducen
+        os.makedirs(directory, exist_ok=True)
+        self.generation = self._recover()
+        self._journal = Journal(self._path('journal', self.generation), fsync)
+        self._records = 0
+        self._snapshot_lock = threading.Lock()
+
+    def _path(self, kind, generation):
+        return os.path.join(self.directory, f'{kind}-{generation:08d}.' + ('bin' if kind == 'snapshot' else 'log'))
+
+    def _generations(self, kind):
+        prefix = kind + '-'
+        return sorted(int(name[len(prefix):].split('.')[0]) for name in os.listdir(self.directory)
+                      if name.startswith(prefix) and not name.endswith('.tmp'))
+
+    def _recover(self):
+        """Carga el último snapshot y reproduce los diarios; devuelve la generación actual"""
+        snapshots = self._generations('snapshot')
+        generation = snapshots[-1] if snapshots else 0
+        if snapshots:
+            users, tasks, archive = read_snapshot(self._path('snapshot', generation))
+            self.users.update(users)
+            self._archive_sizes.update(archive)
+            for email, version, columns in tasks:
+                self.tasks.restore(email, version, columns)
+
+        for journal_generation in self._generations('journal'):
+            if journal_generation < generation:
+                continue
+            path = self._path('journal', journal_generation)
+            records, end = Journal.read(path)
+            for record in records:
+                self._replay(record)
+            if end < os.path.getsize(path):
+                # Cola de una escritura cortada: se descarta antes de seguir
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+            generation = journal_generation
+
+        for email in self.users:
+            self.archive.truncate(email, self._archive_sizes.get(email, 0))
+        for email in self._dropped - self.users.keys():
+            self.archive.drop(email)
+        self._dropped.clear()
+        return generation
+
+    def _replay(self, record):
+        op, email = record[0], record[1]
+        if op == 'register':
+            MemoryStorage.create_user(self, email, record[2])
+        elif op == 'batch':
+            MemoryStorage.apply_batch(self, email, record[2])
+        elif op == 'add':
+            MemoryStorage.add_task(self, email, record[2])
+        elif op == 'toggle':
+            MemoryStorage.toggle_task(self, email, record[2])
+        elif op == 'update':
+            MemoryStorage.update_task(self, email, record[2], record[3])
+        elif op == 'archive':
+            for task_id in record[2]:
+                MemoryStorage.delete_task(self, email, task_id)
+            self._archive_sizes[email] = record[3]
+        elif op == 'import':
+            MemoryStorage._import_user(self, email, {'user': record[2], 'version': record[3], 'tasks': record[4]})
+            self._archive_sizes[email] = record[5]
+        elif op == 'drop':
+            # El archivo no se toca aquí: puede ser ya el de una importación posterior
+            self.users.pop(email, None)
+            self.tasks.drop_user(email)
+            self._archive_sizes.pop(email, None)
+            self._dropped.add(email)
+        else:
+            MemoryStorage.delete_task(self, email, record[2])
+
+    def _commit(self, sequence):
+        if sequence is None:
+            return
+        self._journal.commit(sequence)
+        self._records += 1
+        if self._records >= self.snapshot_every and self._snapshot_lock.acquire(blocking=False):
+            self._records = 0
+            threading.Thread(target=self._snapshot_locked, daemon=True).start()
+
+    def create_user(self, email, user):
+        with self._lock(email):
+            created = super().create_user(email, user)
+            sequence = self._journal.append(['register', email, user]) if created else None
+        self._commit(sequence)
+        return created
+
+    def add_task(self, user_email, task):
+        with self._lock(user_email):
+            task = super().add_task(user_email, task)
+            sequence = self._journal.append(['add', user_email, task])
+        self._commit(sequence)
+        return task
+
+    @staticmethod
+    def _resolved(operation, task):
+        """La operación de toggle o update con completed_at ya resuelto.
+
+        Así reproducir el diario deja la misma fecha de completado en lugar
+        de la hora a la que se reproduce.
+        """
+        if operation['op'] == 'toggle':
+            operation = {'op': 'update', 'id': operation['id'], 'changes': {'completed': task['completed']}}
+        if operation['op'] == 'update' and 'completed' in operation['changes']:
+            operation = {**operation, 'changes': {**operation['changes'], 'completed_at': task['completed_at']}}
+        return operation
+
+    def toggle_task(self, user_email, task_id):
+        with self._lock(user_email):
+            task = super().toggle_task(user_email, task_id)
+            if task:
+                changes = self._resolved({'op': 'toggle', 'id': task_id}, task)['changes']
+                sequence = self._journal.append(['update', user_email, task_id, changes])
+            else:
+                sequence = None
+        self._commit(sequence)
+        return task
+
+    def update_task(self, user_email, task_id, changes):
+        with self._lock(user_email):
+            task = super().update_task(user_email, task_id, changes)
+            if task:
+                changes = self._resolved({'op': 'update', 'id': task_id, 'changes': changes}, task)['changes']
+                sequence = self._journal.append(['update', user_email, task_id, changes])
+            else:
+                sequence = None
+        self._commit(sequence)
+        return task
+
+    def delete_task(self, user_email, task_id):
+        with self._lock(user_email):
+            deleted = super().delete_task(user_email, task_id)
+            sequence = self._journal.append(['delete', user_email, task_id]) if deleted else None
+        self._commit(sequence)
+        return deleted
+
+    def apply_batch(self, user_email, operations):
+        with self._lock(user_email):
+            results = super().apply_batch(user_email, operations)
+            resolved = [operation if operation['op'] in ('create', 'delete') else self._resolved(operation, task)
+                        for operation, task in zip(operations, results)]
+            sequence = self._journal.append(['batch', user_email, resolved])
+        self._commit(sequence)
+        return results
+
+    def archive_tasks(self, user_email, before, limit):
+        with self._lock(user_email):
+            moved, raw, stored, size = self._archive(user_email, before, limit)
+            if moved:
+                self._archive_sizes[user_email] = size
+                sequence = self._journal.append(['archive', user_email, moved, size])
+            else:
+                sequence = None
+        self._commit(sequence)
+        return len(moved), raw, stored
+
+    def import_user(self, email, dump):
+        with self._lock(email):
+            if email in self.users:
+                return False
+            size = self._import_archive(email, dump['archive'])
+            self._import_user(email, dump)
+            self._archive_sizes[email] = size
+            sequence = self._journal.append(['import', email, dump['user'], dump['version'], dump['tasks'], size])
+        self._commit(sequence)
+        return True
+
+    def delete_user(self, email):
+        with self._lock(email):
+            if email not in self.users:
+                return False
+            # Al revés que el resto: primero el diario, porque borrar el
+            # archivo del usuario no se puede deshacer si el registro se pierde
+            self._commit(self._journal.append(['drop', email]))
+            self._archive_sizes.pop(email, None)
+            self._delete_user(email)
+            return True
+
+    def snapshot(self):
+        """Escribe un snapshot ahora y descarta los diarios que ya cubre"""
+        with self._snapshot_lock:
+            self._snapshot_locked(release=False)
+
+    def _snapshot_locked(self, release=True):
+        try:
+            # Con todos los locks tomados nadie escribe: se copia el estado y
+            # se cambia de diario en el mismo instante.
+            for lock in self._locks:
+                lock.acquire()
+            try:
+                users = dict(self.users)
+                archive = dict(self._archive_sizes)
+                tasks = [(email, *self.tasks.export(email)) for email in self.tasks.users()]
+                generation = self.generation + 1
+                self._journal.rotate(self._path('journal', generation))
+                self.generation = generation
+            finally:
+                for lock in reversed(self._locks):
+                    lock.release()
+
+            write_snapshot(self._path('snapshot', generation), users, tasks, archive)
+            for kind in ('snapshot', 'journal'):
+                for old in self._generations(kind):
+                    if old < generation:
+                        os.remove(self._path(kind, old))
+        finally:
+            if release:
+                self._snapshot_lock.release()
+
+    def close(self):
+        self._journal.close()
+
+class SQLiteConnectionPool:
+    """Conexiones SQLite en modo WAL, una por hilo.
+
+    Cada hilo reutiliza su propia conexión (sqlite3 no permite compartirlas
+    entre hilos) y las consultas son constantes para aprovechar la caché de
+    sentencias preparadas de cada conexión.
+    """
+
+    def __init__(self, path, statement_cache_size=64):
+        self.path = path
+        self.statement_cache_size = statement_cache_size
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        _connection_pools.add(self)
+
+    def _connection(self):
+        """Devuelve la conexión del hilo actual, creándola la primera vez"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                                   cached_statements=self.statement_cache_size)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _after_fork(self):
+        """En el hijo de un fork: abre conexiones propias en vez de las heredadas"""
+        # No se cierran: sqlite3_close en el hijo soltaría los locks POSIX del fichero
+        _inherited_connections.extend(self._connections)
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._local = threading.local()
+
+_connection_pools = weakref.WeakSet()
+_inherited_connections = []
+
+@instrument_storage('sqlite', STORAGE_OPERATIONS)
+class SQLiteStorage(SQLiteConnectionPool):
+    """Backend persistente de usuarios y tareas sobre SQLite.
+
+    Las lápidas de las tareas borradas sólo se guardan para las últimas
+    `max_changes` versiones de cada usuario: al podarlas sube el floor, y
+    quien pida cambios anteriores recibe un reset, igual que en memoria.
+    """
+
+    TABLES = (
+        '''CREATE TABLE IF NOT EXISTS users (
+            email TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            password TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS tasks (
+            user_email TEXT NOT NULL,
+            task_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS task_versions (
+            user_email TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS task_tombstones (
+            user_email TEXT NOT NULL,
+            task_id INTEGER NOT NULL,
+            version INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS task_terms (
+            user_email TEXT NOT NULL,
+            term TEXT NOT NULL,
+            task_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (user_email, term, task_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS task_archive (
+            user_email TEXT NOT NULL,
+            segment INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (user_email, segment)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS task_id_workers (
+            worker_id INTEGER PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''',
+    )
+
+    # Columnas añadidas después de crear la tabla original
+    COLUMNS = (
+        ('tasks', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+        ('tasks', 'due_at', 'REAL'),
+        ('tasks', 'priority', 'INTEGER NOT NULL DEFAULT 0'),
+        ('tasks', 'completed_at', 'REAL'),
+        ('task_versions', 'floor', 'INTEGER NOT NULL DEFAULT 0'),
+    )
+
+    INDEXES = (
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_tasks_user_task ON tasks (user_email, task_id)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_completed ON tasks (user_email, completed)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_email, created_at, task_id)',
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_version ON tasks (user_email, version)',
+        'CREATE INDEX IF NOT EXISTS idx_tombstones_user_version ON task_tombstones (user_email, version)',
+        'CREATE INDEX IF NOT EXISTS idx_terms_user_task ON task_terms (user_email, task_id)',
+        ('CREATE INDEX IF NOT EXISTS idx_tasks_user_due ON tasks '
+         '(user_email, completed, due_at, priority DESC, task_id) WHERE due_at IS NOT NULL'),
+        ('CREATE INDEX IF NOT EXISTS idx_tasks_user_completed_at ON tasks '
+         '(user_email, completed_at) WHERE completed_at IS NOT NULL'),
+    )
+
+    SELECT_USER = 'SELECT name, password, created_at FROM users WHERE email = ?'
+    INSERT_USER = 'INSERT OR IGNORE INTO users (email, name, password, created_at) VALUES (?, ?, ?, ?)'
+    TASK_COLUMNS = 'task_id, text, completed, created_at, due_at, priority, completed_at'
+    SELECT_TASKS = f'SELECT {TASK_COLUMNS} FROM tasks WHERE user_email = ? ORDER BY created_at, task_id'
+    SELECT_TASK = f'SELECT {TASK_COLUMNS} FROM tasks WHERE user_email = ? AND task_id = ?'
+    COUNT_TASKS = 'SELECT COUNT(*) FROM tasks WHERE user_email = ?'
+    INSERT_TASK = ('INSERT INTO tasks (user_email, task_id, text, completed, created_at, due_at, priority, '
+                   'completed_at, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+    # En el SET, `completed` es todavía el valor anterior
+    TOGGLE_TASK = ('UPDATE tasks SET completed = NOT completed, '
+                   'completed_at = CASE WHEN completed THEN NULL ELSE ? END, version = ? '
+                   'WHERE user_email = ? AND task_id = ?')
+    UPDATE_TASK = ('UPDATE tasks SET text = ?, completed = ?, due_at = ?, priority = ?, completed_at = ?, version = ? '
+                   'WHERE user_email = ? AND task_id = ?')
+    DELETE_TASK = 'DELETE FROM tasks WHERE user_email = ? AND task_id = ?'
+    BUMP_VERSION = ('INSERT INTO task_versions (user_email, version) VALUES (?, 1) '
+                    'ON CONFLICT (user_email) DO UPDATE SET version = version + 1')
+    SELECT_VERSION = 'SELECT version FROM task_versions WHERE user_email = ?'
+    # Cambios anteriores a `floor` (la versión con la que llegó un usuario importado) dan reset
+    SELECT_VERSION_FLOOR = 'SELECT version, floor FROM task_versions WHERE user_email = ?'
+    SET_VERSION = 'INSERT OR REPLACE INTO task_versions (user_email, version, floor) VALUES (?, ?, ?)'
+    REBASE_TASKS = 'UPDATE tasks SET version = ? WHERE user_email = ?'
+    RAISE_FLOOR = 'UPDATE task_versions SET floor = ? WHERE user_email = ?'
+    PRUNE_TOMBSTONES = 'DELETE FROM task_tombstones WHERE user_email = ? AND version <= ?'
+    INSERT_TOMBSTONE = 'INSERT INTO task_tombstones (user_email, task_id, version) VALUES (?, ?, ?)'
+    SELECT_CHANGED = f'SELECT {TASK_COLUMNS} FROM tasks WHERE user_email = ? AND version > ? ORDER BY version'
+    # Ambas recorren idx_tasks_user_due en orden, sin ordenar nada aparte
+    SELECT_UPCOMING = (f'SELECT {TASK_COLUMNS} FROM tasks WHERE user_email = ? AND completed = 0 AND due_at >= ? '
+                       'ORDER BY due_at, priority DESC, task_id LIMIT ?')
+    SELECT_OVERDUE = (f'SELECT {TASK_COLUMNS} FROM tasks WHERE user_email = ? AND completed = 0 AND due_at < ? '
+                      'ORDER BY due_at, priority DESC, task_id LIMIT ?')
+    SELECT_TOMBSTONES = 'SELECT task_id FROM task_tombstones WHERE user_email = ? AND version > ?'
+    INSERT_TERM = 'INSERT INTO task_terms (user_email, term, task_id, count) VALUES (?, ?, ?, ?)'
+    DELETE_TERMS = 'DELETE FROM task_terms WHERE user_email = ? AND task_id = ?'
+    # Rango [term, term + U+10FFFF): el término exacto y todos los que empiezan por él
+    SELECT_TERMS = 'SELECT term, task_id, count FROM task_terms WHERE user_email = ? AND term >= ? AND term < ?'
+    SELECT_ARCHIVABLE_USERS = 'SELECT DISTINCT user_email FROM tasks WHERE completed_at < ?'
+    SELECT_ARCHIVABLE = (f'SELECT {TASK_COLUMNS} FROM tasks WHERE user_email = ? AND completed_at < ? '
+                         'ORDER BY completed_at, task_id LIMIT ?')
+    INSERT_SEGMENT = ('INSERT INTO task_archive (user_email, segment, data) VALUES '
+                      '(?, (SELECT COALESCE(MAX(segment) + 1, 0) FROM task_archive WHERE user_email = ?), ?)')
+    SELECT_SEGMENTS = 'SELECT segment, data FROM task_archive WHERE user_email = ? AND segment >= ? ORDER BY segment'
+    INSERT_SEGMENT_AT = 'INSERT INTO task_archive (user_email, segment, data) VALUES (?, ?, ?)'
+    SELECT_USERS = 'SELECT email FROM users'
+    DELETE_USER = 'DELETE FROM users WHERE email = ?'
+    DELETE_USER_ROWS = tuple(f'DELETE FROM {table} WHERE user_email = ?'
+                             for table in ('tasks', 'task_versions', 'task_tombstones', 'task_terms', 'task_archive'))
+    SELECT_WORKER_LEASES = 'SELECT worker_id, expires_at FROM task_id_workers'
+    CLAIM_WORKER = 'INSERT OR REPLACE INTO task_id_workers (worker_id, owner, expires_at) VALUES (?, ?, ?)'
+    RENEW_WORKER = 'UPDATE task_id_workers SET expires_at = ? WHERE worker_id = ? AND owner = ?'
+    RELEASE_WORKER = 'DELETE FROM task_id_workers WHERE worker_id = ? AND owner = ?'
+
+    def __init__(self, path, statement_cache_size=64, max_changes=10000):
+        super().__init__(path, statement_cache_size)
+        self.max_changes = max_changes
+        with self._connection() as conn:
+            for statement in self.TABLES:
+                conn.execute(statement)
+            added = set()
+            for table, column, definition in self.COLUMNS:
+                existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+                if column not in existing:
+                    conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                    added.add(column)
+            if 'completed_at' in added:
+                # Igual que TaskColumns.insert con tareas sin completed_at
+                conn.execute('UPDATE tasks SET completed_at = created_at WHERE completed = 1')
+            for statement in self.INDEXES:
+                conn.execute(statement)
+            # Bases creadas antes del índice de búsqueda
+            if (conn.execute('SELECT 1 FROM task_terms LIMIT 1').fetchone() is None
+                    and conn.execute('SELECT 1 FROM tasks LIMIT 1').fetchone() is not None):
+                for user_email, task_id, text in conn.execute('SELECT user_email, task_id, text FROM tasks').fetchall():
+                    self._index_terms(conn, user_email, task_id, text)
+
+    @staticmethod
+    def _row_to_task(row):
+        return {'id': row[0], 'text': row[1], 'completed': bool(row[2]), 'created_at': row[3],
+                'due_at': row[4], 'priority': row[5], 'completed_at': row[6]}
+
+    def get_user(self, email):
+        row = self._connection().execute(self.SELECT_USER, (email,)).fetchone()
+        if row is None:
+            return None
+        return {'name': row[0], 'password': row[1], 'created_at': row[2]}
+
+    def create_user(self, email, user):
+        with self._connection() as conn:
+            cursor = conn.execute(self.INSERT_USER,
+                                  (email, user['name'], user['password'], user['created_at']))
+        return cursor.rowcount == 1
+
+    def list_tasks(self, user_email):
+        rows = self._connection().execute(self.SELECT_TASKS, (user_email,))
+        return [self._row_to_task(row) for row in rows]
+
+    def count_tasks(self, user_email):
+        return self._connection().execute(self.COUNT_TASKS, (user_email,)).fetchone()[0]
+
+    def _next_version(self, conn, user_email):
+        """Incrementa la versión del usuario dentro de la transacción en curso"""
+        conn.execute(self.BUMP_VERSION, (user_email,))
+        return conn.execute(self.SELECT_VERSION, (user_email,)).fetchone()[0]
+
+    # Las variantes _add/_toggle/_update/_delete trabajan sobre una conexión
+    # con la transacción ya abierta, para poder combinarlas en apply_batch.
+
+    def _index_terms(self, conn, user_email, task_id, text):
+        counts = {}
+        for term in search_terms(text):
+            counts[term] = counts.get(term, 0) + 1
+        conn.executemany(self.INSERT_TERM, ((user_email, term, task_id, count) for term, count in counts.items()))
+
+    def _add(self, conn, user_email, task):
+        version = self._next_version(conn, user_email)
+        completed_at = task.get('completed_at', task['created_at'] if task['completed'] else None)
+        conn.execute(self.INSERT_TASK, (user_email, task['id'], task['text'], int(task['completed']), task['created_at'],
+                                        task.get('due_at'), task.get('priority', 0), completed_at, version))
+        self._index_terms(conn, user_email, task['id'], task['text'])
+        return task
+
+    def _toggle(self, conn, user_email, task_id):
+        if conn.execute(self.SELECT_TASK, (user_email, task_id)).fetchone() is None:
+            return None
+        version = self._next_version(conn, user_email)
+        conn.execute(self.TOGGLE_TASK, (time.time(), version, user_email, task_id))
+        return self._row_to_task(conn.execute(self.SELECT_TASK, (user_email, task_id)).fetchone())
+
+    def _update(self, conn, user_email, task_id, changes):
+        row = conn.execute(self.SELECT_TASK, (user_email, task_id)).fetchone()
+        if row is None:
+            return None
+        old = self._row_to_task(row)
+        task = {**old, **changes}
+        if task['completed'] != old['completed'] and 'completed_at' not in changes:
+            task['completed_at'] = time.time() if task['completed'] else None
+        version = self._next_version(conn, user_email)
+        conn.execute(self.UPDATE_TASK, (task['text'], int(task['completed']), task['due_at'], task['priority'],
+                                        task['completed_at'], version, user_email, task_id))
+        if changes.get('text') is not None:
+            conn.execute(self.DELETE_TERMS, (user_email, task_id))
+            self._index_terms(conn, user_email, task_id, changes['text'])
+        return self._row_to_task(conn.execute(self.SELECT_TASK, (user_email, task_id)).fetchone())
+
+    def _delete(self, conn, user_email, task_id):
+        cursor = conn.execute(self.DELETE_TASK, (user_email, task_id))
+        if cursor.rowcount == 0:
+            return False
+        version = self._next_version(conn, user_email)
+        conn.execute(self.INSERT_TOMBSTONE, (user_email, task_id, version))
+        conn.execute(self.DELETE_TERMS, (user_email, task_id))
+        self._prune_tombstones(conn, user_email)
+        return True
+
+    def _prune_tombstones(self, conn, user_email):
+        """Olvida las lápidas de más de `max_changes` versiones atrás, por tandas de un 10%"""
+        version, floor = conn.execute(self.SELECT_VERSION_FLOOR, (user_email,)).fetchone()
+        retain = version - self.max_changes
+        if retain - floor >= max(1, self.max_changes // 10):
+            conn.execute(self.PRUNE_TOMBSTONES, (user_email, retain))
+            conn.execute(self.RAISE_FLOOR, (retain, user_email))
+
+    def add_task(self, user_email, task):
+        with self._connection() as conn:
+            return self._add(conn, user_email, task)
+
+    def toggle_task(self, user_email, task_id):
+        with self._connection() as conn:
+            return self._toggle(conn, user_email, task_id)
+
+    def update_task(self, user_email, task_id, changes):
+        with self._connection() as conn:
+            return self._update(conn, user_email, task_id, changes)
+
+    def delete_task(self, user_email, task_id):
+        with self._connection() as conn:
+            return self._delete(conn, user_email, task_id)
+
+    def apply_batch(self, user_email, operations):
+        """Aplica las operaciones en una única transacción, todas o ninguna"""
+        conn = self._connection()
+        results = []
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for index, operation in enumerate(operations):
+                op = operation['op']
+                if op == 'create':
+                    if conn.execute(self.SELECT_TASK, (user_email, operation['task']['id'])).fetchone():
+                        raise BatchError(index, 'La tarea ya existe')
+                    results.append(self._add(conn, user_email, operation['task']))
+                elif op == 'delete':
+                    deleted = self._delete(conn, user_email, operation['id'])
+                    results.append({'id': operation['id'], 'deleted': deleted})
+                else:
+                    if op == 'toggle':
+                        task = self._toggle(conn, user_email, operation['id'])
+                    else:
+                        task = self._update(conn, user_email, operation['id'], operation['changes'])
+                    if task is None:
+                        raise BatchError(index, 'Tarea no encontrada')
+                    results.append(task)
+        return results
+
+    def task_version(self, user_email):
+        row = self._connection().execute(self.SELECT_VERSION, (user_email,)).fetchone()
+        return row[0] if row else 0
+
+    def task_changes(self, user_email, since):
+        conn = self._connection()
+        row = conn.execute(self.SELECT_VERSION_FLOOR, (user_email,)).fetchone()
+        version, floor = row if row else (0, 0)
+        if since <= 0 or since < floor or since > version:
+            return version, self.list_tasks(user_email), [], True
+        changed = [self._row_to_task(row) for row in conn.execute(self.SELECT_CHANGED, (user_email, since))]
+        deleted = [row[0] for row in conn.execute(self.SELECT_TOMBSTONES, (user_email, since))]
+        return version, changed, deleted, False
+
+    def search_tasks(self, user_email, query, limit):
+        terms = set(search_terms(query))
+        if not terms:
+            return []
+        conn = self._connection()
+        term_matches = [score_matches(term, conn.execute(self.SELECT_TERMS, (user_email, term, term + '\U0010ffff')))
+                        for term in terms]
+        ranked = rank_search(term_matches, self.count_tasks(user_email), limit)
+        rows = (conn.execute(self.SELECT_TASK, (user_email, task_id)).fetchone() for task_id in ranked)
+        # Una tarea borrada entre las dos consultas simplemente no aparece
+        return [self._row_to_task(row) for row in rows if row is not None]
+
+    def due_tasks(self, user_email, now, limit, overdue=False):
+        query = self.SELECT_OVERDUE if overdue else self.SELECT_UPCOMING
+        return [self._row_to_task(row) for row in self._connection().execute(query, (user_email, now, limit))]
+
+    def archivable_users(self, before):
+        return [row[0] for row in self._connection().execute(self.SELECT_ARCHIVABLE_USERS, (before,))]
+
+    def archive_tasks(self, user_email, before, limit):
+        """Mueve las tareas a un segmento de task_archive en la misma transacción que las borra"""
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            tasks = [self._row_to_task(row) for row in conn.execute(self.SELECT_ARCHIVABLE, (user_email, before, limit))]
+            if not tasks:
+                return 0, 0, 0
+            segment, raw = encode_archive_segment(tasks)
+            conn.execute(self.INSERT_SEGMENT, (user_email, user_email, segment))
+            for task in tasks:
+                self._delete(conn, user_email, task['id'])
+        return len(tasks), raw, len(segment)
+
+    def page_archive(self, user_email, limit, after=None):
+        segments = self._connection().execute(self.SELECT_SEGMENTS, (user_email, after[0] if after else 0))
+        return page_archive_segments(segments, limit, after)
+
+    def user_emails(self):
+        return [row[0] for row in self._connection().execute(self.SELECT_USERS)]
+
+    def export_user(self, email):
+        user = self.get_user(email)
+        if user is None:
+            return None
+        return {'user': user, 'version': self.task_version(email), 'tasks': self.list_tasks(email),
+                'archive': [data for _, data in self._connection().execute(self.SELECT_SEGMENTS, (email, 0))]}
+
+    def import_user(self, email, dump):
+        """Usuario, tareas y segmentos en una sola transacción"""
+        user = dump['user']
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute(self.INSERT_USER, (email, user['name'], user['password'], user['created_at'])).rowcount == 0:
+                return False
+            for task in dump['tasks']:
+                self._add(conn, email, task)
+            version = dump['version'] + 1
+            conn.execute(self.REBASE_TASKS, (version, email))
+            conn.execute(self.SET_VERSION, (email, version, version))
+            conn.executemany(self.INSERT_SEGMENT_AT,
+                             ((email, number, segment) for number, segment in enumerate(dump['archive'])))
+        return True
+
+    def delete_user(self, email):
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute(self.DELETE_USER, (email,)).rowcount == 0:
+                return False
+            for statement in self.DELETE_USER_ROWS:
+                conn.execute(statement, (email,))
+        return True
+
+    def claim_worker_id(self, owner, ttl, workers):
+        """Reserva durante `ttl` segundos el primer worker id libre o caducado; None si no queda ninguno"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            leases = dict(conn.execute(self.SELECT_WORKER_LEASES))
+            for worker_id in range(workers):
+                if leases.get(worker_id, 0) <= now:
+                    conn.execute(self.CLAIM_WORKER, (worker_id, owner, now + ttl))
+                    return worker_id
+        return None
+
+    def renew_worker_id(self, worker_id, owner, ttl):
+        """Alarga la reserva; False si caducó y ya es de otro"""
+        with self._connection() as conn:
+            return conn.execute(self.RENEW_WORKER, (time.time() + ttl, worker_id, owner)).rowcount == 1
+
+    def release_worker_id(self, worker_id, owner):
+        with self._connection() as conn:
+            conn.execute(self.RELEASE_WORKER, (worker_id, owner))
+
+    def page_tasks(self, user_email, limit, after=None, completed=None,
+                   created_from=None, created_to=None, descending=False):
+        # Las combinaciones de filtros son finitas, así que cada variante de
+        # la consulta acaba también en la caché de sentencias preparadas.
+        clauses = ['user_email = ?']
+        params = [user_email]
+        if completed is not None:
+            clauses.append('completed = ?')
+            params.append(int(completed))
+        if created_from is not None:
+            clauses.append('created_at >= ?')
+            params.append(created_from)
+        if created_to is not None:
+            clauses.append('created_at < ?')
+            params.append(created_to)
+        if after is not None:
+            clauses.append('(created_at, task_id) %s (?, ?)' % ('<' if descending else '>'))
+            params.extend(after)
+        direction = 'DESC' if descending else 'ASC'
+        query = ('SELECT %s FROM tasks WHERE %s ORDER BY created_at %s, task_id %s LIMIT ?'
+                 % (self.TASK_COLUMNS, ' AND '.join(clauses), direction, direction))
+        params.append(limit + 1)
+
+        rows = self._connection().execute(query, params).fetchall()
+        page = [self._row_to_task(row) for row in rows[:limit]]
+        if len(rows) > limit:
+            return page, (page[-1]['created_at'], page[-1]['id'])
+        return page, None
+
+def create_storage(config):
+    """Construye el backend de almacenamiento indicado en la configuración"""
+    backend = config['STORAGE_BACKEND']
+    if backend == 'memory':
+        return MemoryStorage(config['MAX_CHANGE_LOG'], config['STORAGE_LOCK_STRIPES'])
+    if backend == 'journal':
+        return JournaledStorage(config['JOURNAL_DIR'], config['JOURNAL_SNAPSHOT_EVERY'], config['JOURNAL_FSYNC'],
+                                config['MAX_CHANGE_LOG'], config['STORAGE_LOCK_STRIPES'])
+    if backend == 'sqlite':
+        return SQLiteStorage(config['SQLITE_PATH'], max_changes=config['MAX_CHANGE_LOG'])
+    raise ValueError(f'Backend de almacenamiento desconocido: {backend}')
+
+storage = None  # lo crea create_app()
+
+class MemorySessionStore:
+    """Sesiones en un dict; sólo sirve para un único proceso"""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Devuelve (datos, expires_at) o None"""
+        return self._sessions.get(key)
+
+    def set(self, key, data, expires_at):
+        self._sessions[key] = (data, expires_at)
+
+    def delete(self, key):
+        self._sessions.pop(key, None)
+
+    def sweep(self, now):
+        """Elimina en bloque las sesiones caducadas; devuelve cuántas"""
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._sessions.items() if expires_at <= now]
+            for key in expired:
+                self._sessions.pop(key, None)
+        return len(expired)
+
+    def count(self, now):
+        return sum(1 for _, expires_at in list(self._sessions.values()) if expires_at > now)
+
+class SQLiteSessionStore(SQLiteConnectionPool):
+    """Sesiones en SQLite, compartidas por todos los workers de la máquina"""
+
+    CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS sessions (
+        key TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )'''
+    CREATE_INDEX = 'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)'
+    SELECT_SESSION = 'SELECT data, expires_at FROM sessions WHERE key = ?'
+    UPSERT_SESSION = 'INSERT OR REPLACE INTO sessions (key, data, expires_at) VALUES (?, ?, ?)'
+    DELETE_SESSION = 'DELETE FROM sessions WHERE key = ?'
+    DELETE_EXPIRED = 'DELETE FROM sessions WHERE expires_at <= ?'
+    COUNT_ACTIVE = 'SELECT COUNT(*) FROM sessions WHERE expires_at > ?'
+
+    def __init__(self, path):
+        super().__init__(path)
+        with self._connection() as conn:
+            conn.execute(self.CREATE_TABLE)
+            conn.execute(self.CREATE_INDEX)
+
+    def get(self, key):
+        row = self._connection().execute(self.SELECT_SESSION, (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, data, expires_at):
+        with self._connection() as conn:
+            conn.execute(self.UPSERT_SESSION, (key, json.dumps(data), expires_at))
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute(self.DELETE_SESSION, (key,))
+
+    def sweep(self, now):
+        with self._connection() as conn:
+            return conn.execute(self.DELETE_EXPIRED, (now,)).rowcount
+
+    def count(self, now):
+        return self._connection().execute(self.COUNT_ACTIVE, (now,)).fetchone()[0]
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Sesión cuyo contenido vive en el servidor; la cookie sólo lleva el token"""
+
+    def __init__(self, initial=None, token=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.token = token
+        # Usuario con el que se cargó; si cambia al guardar, el token se renueva
+        self.loaded_user = self.get('user_email')
+        self.regenerate_token = False
+        self.modified = False
+
+    def regenerate(self):
+        """Pide un token nuevo al guardar (tras autenticarse)"""
+        self.regenerate_token = True
+        self.modified = True
+
+class CachedSessionInterface(SessionInterface):
+    """Sesiones en servidor con una caché LRU por proceso.
+
+    La cookie contiene un token opaco; en el almacén se guarda su SHA-256,
+    así que una copia del almacén no sirve para suplantar sesiones. Validar
+    una petición es una consulta a la caché; sólo se va al almacén en un
+    fallo de caché o cuando la entrada tiene más de `cache_ttl` segundos,
+    que es lo que tarda un logout en otro worker en verse en éste.
+
+    Un hilo en segundo plano elimina en bloque las sesiones caducadas cada
+    `sweep_interval` segundos.
+    """
+
+    def __init__(self, store, cache_size=10000, cache_ttl=5, sweep_interval=60):
+        self.store = store
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.sweep_interval = sweep_interval
+        self._cache = OrderedDict()  # clave -> (datos, expires_at, válida_hasta)
+        self._cache_lock = threading.Lock()
+        self._sweeper_pid = None
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+    def _load(self, key):
+        now = time.time()
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[1] > now and entry[2] > now:
+                self._cache.move_to_end(key)
+                return entry[0]
+
+        stored = self.store.get(key)
+        if stored is None or stored[1] <= now:
+            self._evict(key)
+            return None
+        data, expires_at = stored
+        self._remember(key, data, expires_at, now)
+        return data
+
+    def _remember(self, key, data, expires_at, now):
+        with self._cache_lock:
+            self._cache[key] = (data, expires_at, min(expires_at, now + self.cache_ttl))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _evict(self, key):
+        with self._cache_lock:
+            self._cache.pop(key, None)
+
+    def _ensure_sweeper(self):
+        # Tras un fork el hilo no sobrevive, así que se arranca uno por proceso
+        if self._sweeper_pid != os.getpid():
+            self._sweeper_pid = os.getpid()
+            threading.Thread(target=self._sweep_forever, name='session-sweeper', daemon=True).start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            self.sweep()
+
+    def sweep(self):
+        """Elimina las sesiones caducadas del almacén y de la caché"""
+        now = time.time()
+        removed = self.store.sweep(now)
+        with self._cache_lock:
+            for key in [key for key, entry in self._cache.items() if entry[1] <= now]:
+                del self._cache[key]
+        return removed
+
+    def load(self, token):
+        """Datos de la sesión del token, o None si no existe o caducó"""
+        self._ensure_sweeper()
+        return self._load(self._key(token))
+
+    def save(self, token, data, expires_at):
+        """Guarda la sesión y devuelve su token, creándolo si hace falta"""
+        if token is None:
+            token = secrets.token_urlsafe(32)
+        key = self._key(token)
+        self.store.set(key, data, expires_at)
+        self._remember(key, data, expires_at, time.time())
+        return token
+
+    def delete(self, token):
+        key = self._key(token)
+        self.store.delete(key)
+        self._evict(key)
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if token:
+            data = self.load(token)
+            if data is not None:
+                return ServerSideSession(data, token)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and session.token is not None:
+                self.delete(session.token)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            return
+
+        expires = self.get_expiration_time(app, session)
+        expires_at = expires.timestamp() if expires else time.time() + app.config['PERMANENT_SESSION_LIFETIME']
+        user_changed = session.get('user_email') != session.loaded_user
+        if session.token is not None and (session.regenerate_token or user_changed):
+            # Login o cambio de usuario: un token anterior (quizá plantado por
+            # otro) no debe quedar autenticado, así que se emite uno nuevo
+            self.delete(session.token)
+            session.token = None
+        session.token = self.save(session.token, dict(session), expires_at)
+        session.loaded_user = session.get('user_email')
+        session.regenerate_token = False
+
+        response.set_cookie(name, session.token, expires=expires, domain=domain, path=path,
+                            httponly=self.get_cookie_httponly(app),
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+def create_session_interface(config):
+    backend = config['SESSION_BACKEND']
+    if backend == 'memory':
+        store = MemorySessionStore()
+    elif backend == 'sqlite':
+        store = SQLiteSessionStore(config['SESSION_SQLITE_PATH'])
+    else:
+        raise ValueError(f'Backend de sesiones desconocido: {backend}')
+    return CachedSessionInterface(store, config['SESSION_CACHE_SIZE'], config['SESSION_CACHE_TTL'],
+                                  config['SESSION_SWEEP_INTERVAL'])
+
+class TaskEventBroker:
+    """Pub/sub en proceso que avisa de cambios en las tareas de un usuario.
+
+    Los suscriptores son callbacks sin argumentos que sólo deben despertar a
+    quien espera (un threading.Event, o loop.call_soon_threadsafe desde
+    asyncio); el contenido del cambio se obtiene luego con task_changes(),
+    así que varios avisos seguidos se agrupan en un solo evento.
+
+    Los listeners, en cambio, reciben el email de cada publicación, sea
+    del usuario que sea (por ejemplo, para invalidar cachés).
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def subscribe(self, user_email, callback):
+        with self._lock:
+            self._subscribers.setdefault(user_email, set()).add(callback)
+
+    def unsubscribe(self, user_email, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(user_email)
+            if callbacks is not None:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self._subscribers[user_email]
+
+    def publish(self, user_email):
+        for listener in self._listeners:
+            listener(user_email)
+        with self._lock:
+            callbacks = list(self._subscribers.get(user_email, ()))
+        for callback in callbacks:
+            callback()
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(callbacks) for callbacks in self._subscribers.values())
+
+task_events = None  # lo crea create_app()
+
+class TaskListCache:
+    """Cuerpos JSON ya codificados de GET /api/tasks, con su ETag, por usuario.
+
+    Cada entrada recuerda la versión de las tareas con la que se generó y
+    sólo se sirve si sigue siendo la actual, así que nunca sale una lista
+    vieja aunque el cambio venga de otro proceso. Además task_events borra
+    la entrada en cuanto el usuario modifica sus tareas. El total de bytes
+    está acotado a `max_bytes`, expulsando primero las menos usadas.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_email, version):
+        """(cuerpo, etag) si hay entrada para esa versión; si no, None"""
+        with self._lock:
+            entry = self._entries.get(user_email)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(user_email)
+            return entry[1], entry[2]
+
+    def put(self, user_email, version, body):
+        """Guarda el cuerpo y devuelve (cuerpo, etag)"""
+        etag = hashlib.sha256(body).hexdigest()[:16]
+        # Una lista que ocuparía más de un cuarto de la caché no se guarda
+        if len(body) > self.max_bytes // 4:
+            return body, etag
+        with self._lock:
+            self._discard(user_email)
+            self._entries[user_email] = (version, body, etag)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+        return body, etag
+
+    def invalidate(self, user_email):
+        with self._lock:
+            self._discard(user_email)
+
+    def _discard(self, user_email):
+        entry = self._entries.pop(user_email, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size}
+
+task_list_cache = None  # lo crea create_app()
+
+class TaskArchiver:
+    """Hilo en segundo plano que pasa al archivo las tareas completadas hace
+    más de `archive_after` segundos.
+
+    Cada `interval` segundos recorre los usuarios con tareas archivables y
+    las mueve en segmentos de `batch` tareas; así la lista activa sólo
+    guarda las completadas recientemente. Los clientes ven las tareas
+    archivadas como borradas en /api/tasks/changes.
+    """
+
+    def __init__(self, storage, archive_after, interval=300, batch=1000):
+        self.storage = storage
+        self.archive_after = archive_after
+        self.interval = interval
+        self.batch = batch
+        self._pid = None
+
+    def ensure_running(self):
+        # Igual que el barrido de sesiones: un hilo por proceso, también tras un fork
+        if self.archive_after and self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run_forever, name='task-archiver', daemon=True).start()
+
+    def _run_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                app.logger.warning('Error archivando tareas: %s', e)
+
+    def run_once(self, now=None):
+        """Una pasada completa; devuelve cuántas tareas se archivaron"""
+        started = time.perf_counter()
+        before = (time.time() if now is None else now) - self.archive_after
+        archived = 0
+        for user_email in self.storage.archivable_users(before):
+            while True:
+                moved, raw, stored = self.storage.archive_tasks(user_email, before, self.batch)
+                if not moved:
+                    break
+                archived += moved
+                metrics.inc('archive_tasks_total', value=moved)
+                metrics.inc('archive_bytes_total', (('encoding', 'json'),), raw)
+                metrics.inc('archive_bytes_total', (('encoding', 'zlib'),), stored)
+                task_events.publish(user_email)
+                if moved < self.batch:
+                    break
+        metrics.observe('archive_run_duration_seconds', (), time.perf_counter() - started)
+        return archived
+
+task_archiver = None  # lo crea create_app()
+
+class TaskIdGenerator:
+    """Generador de ids estilo Snowflake: timestamp | worker | stripe | secuencia.
+
+    Los ids caben en 53 bits para que JavaScript los represente sin perder
+    precisión: 40 bits de milisegundos desde EPOCH_MS (~34 años), 5 de
+    worker, 2 de stripe y 6 de secuencia. No hay un lock global: cada hilo
+    empieza siempre por la misma stripe y cada stripe tiene su propio lock,
+    estado y rango de ids, así que hilos de stripes distintas no compiten
+    mientras no agoten su secuencia.
+
+    Si el reloj retrocede o se agota la secuencia del milisegundo, la stripe
+    espera a que el reloj pase de su último milisegundo: nunca da ids por
+    delante del reloj, así que otro proceso que arranque después con el
+    mismo worker id no puede repetirlos. Por lo mismo, el milisegundo en
+    que se crea el generador no se usa.
+    """
+
+    EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+    TIMESTAMP_BITS = 40
+    WORKER_BITS = 5
+    STRIPE_BITS = 2
+    SEQUENCE_BITS = 6
+
+    def __init__(self, worker_id, clock=time.time, sleep=time.sleep):
+        if not 0 <= worker_id < 1 << self.WORKER_BITS:
+            raise ValueError(f'worker_id fuera de rango: {worker_id}')
+        self.worker_id = worker_id
+        self._clock = clock
+        self._sleep = sleep
+        stripes = 1 << self.STRIPE_BITS
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._last_ms = [self._now_ms()] * stripes
+        self._sequence = [(1 << self.SEQUENCE_BITS) - 1] * stripes
+        self._next_stripe = itertools.count()
+        self._local = threading.local()
+
+    def _stripe(self):
+        stripe = getattr(self._local, 'stripe', None)
+        if stripe is None:
+            # next() sobre itertools.count es atómico bajo el GIL
+            stripe = next(self._next_stripe) % len(self._locks)
+            self._local.stripe = stripe
+        return stripe
+
+    def _now_ms(self):
+        return int(self._clock() * 1000) - self.EPOCH_MS
+
+    def next_id(self):
+        own = self._stripe()
+        while True:
+            now_ms = self._now_ms()
+            # Con la secuencia de su stripe agotada, el hilo sigue en las stripes
+            # siguientes dentro del mismo milisegundo; como sus ids son mayores,
+            # cada hilo sigue viendo ids crecientes
+            for stripe in range(own, len(self._locks)):
+                with self._locks[stripe]:
+                    last_ms = self._last_ms[stripe]
+                    if now_ms > last_ms:
+                        last_ms, sequence = now_ms, 0
+                    else:
+                        sequence = self._sequence[stripe] + 1
+                    if not sequence >> self.SEQUENCE_BITS:
+                        self._last_ms[stripe] = last_ms
+                        self._sequence[stripe] = sequence
+                        break
+            else:
+                # Todo el milisegundo agotado o reloj atrasado: se espera fuera de los locks
+                self._sleep((last_ms + 1 - now_ms) / 1000)
+                continue
+            break
+
+        if last_ms >> self.TIMESTAMP_BITS:
+            raise OverflowError('Timestamp fuera del rango de ids de tarea')
+        return ((((last_ms << self.WORKER_BITS | self.worker_id)
+                  << self.STRIPE_BITS | stripe)
+                 << self.SEQUENCE_BITS) | sequence)
+
+class TaskIdLease:
+    """Worker id de TaskIdGenerator reservado en la base SQLite compartida.
+
+    Varios procesos independientes (varias instancias, gunicorn sin
+    --preload) escriben en la misma base y no pueden elegir su worker id
+    por su cuenta sin arriesgarse a repetirlo. Cada uno reserva uno libre
+    durante `ttl` segundos y lo renueva desde un hilo; si la reserva llegó a
+    caducar, reserva otro y se lo pasa al generador. Al salir lo libera.
+    """
+
+    def __init__(self, store, ttl):
+        self.store = store
+        self.ttl = ttl
+        self.owner = f'{os.uname().nodename}:{os.getpid()}:{secrets.token_hex(4)}'
+        self.pid = os.getpid()
+        self.worker_id = self._claim()
+        self.generator = None
+        atexit.register(self.release)
+
+    def _claim(self):
+        worker_id = self.store.claim_worker_id(self.owner, self.ttl, 1 << TaskIdGenerator.WORKER_BITS)
+        if worker_id is None:
+            raise RuntimeError('No quedan worker ids libres para los ids de tarea')
+        return worker_id
+
+    def start(self, generator):
+        """Mantiene la reserva mientras viva el proceso"""
+        self.generator = generator
+        threading.Thread(target=self._renew_forever, name='task-id-lease', daemon=True).start()
+
+    def _renew_forever(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            try:
+                if not self.store.renew_worker_id(self.worker_id, self.owner, self.ttl):
+                    self.worker_id = self.generator.worker_id = self._claim()
+            except Exception:
+                pass  # base ocupada o error puntual: se reintenta en la siguiente vuelta
+
+    def release(self):
+        # Un hijo de fork hereda este atexit, pero la reserva sigue siendo del padre
+        if os.getpid() != self.pid:
+            return
+        try:
+            self.store.release_worker_id(self.worker_id, self.owner)
+        except Exception:
+            pass
+
+def create_task_ids(config, store):
+    """(generador de ids, reserva del worker id o None) para este proceso"""
+    if config['TASK_ID_WORKER'] is not None:
+        return TaskIdGenerator(config['TASK_ID_WORKER']), None
+    if isinstance(store, SQLiteStorage):
+        lease = TaskIdLease(store, config['TASK_ID_LEASE_TTL'])
+        generator = TaskIdGenerator(lease.worker_id)
+        lease.start(generator)
+        return generator, lease
+    return TaskIdGenerator(0), None
+
+task_ids = None  # lo crea create_app()
+task_id_lease = None
+
+def new_task_id():
+    """ID único y creciente en el tiempo, también entre procesos"""
+    return task_ids.next_id()
+
+# Prioridad de 0 (ninguna) a MAX_TASK_PRIORITY (alta)
+MAX_TASK_PRIORITY = 3
+
+def new_task(text, due_at=None, priority=0):
+    return {
+        'id': new_task_id(),
+        'text': text,
+        'completed': False,
+        'created_at': time.time(),
+        'due_at': due_at,
+        'priority': priority,
+        'completed_at': None
+    }
+
+def encode_cursor(key):
+    """Cursor opaco a partir de la clave (created_at, id)"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return float(created_at), int(task_id)
+
+def iter_task_chunks(user_email, chunk_size):
+    """Recorre las tareas del usuario página a página, sin materializarlas todas"""
+    after = None
+    while True:
+        tasks, after = storage.page_tasks(user_email, chunk_size, after=after)
+        yield tasks
+        if after is None:
+            return
+
+def encode_json_body(value):
+    """Los mismos bytes que produciría jsonify(value)"""
+    return f"{app.json.dumps(value, separators=(',', ':'))}\n".encode('utf-8')
+
+def changes_etag(user_email, version):
+    """ETag del estado de las tareas del usuario en `version`"""
+    return hashlib.sha256(f'{user_email}:{version}'.encode('utf-8')).hexdigest()[:16]
+
+def conditional_json(body, etag):
+    """Respuesta JSON con ETag, o 304 sin cuerpo si el cliente ya la tiene"""
+    headers = {'Cache-Control': 'private, no-cache'}
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(body, mimetype='application/json', headers=headers)
+    response.set_etag(etag)
+    return response
+
+def encode_json_items(items):
+    """Elementos de un array JSON separados por comas, en el formato compacto de jsonify"""
+    dumps = app.json.dumps
+    return ','.join(dumps(item, separators=(',', ':')) for item in items)
+
+def encode_json_array(chunks):
+    """Codifica un array JSON bloque a bloque a partir de listas de objetos"""
+    yield '['
+    separator = ''
+    for items in chunks:
+        if items:
+            yield separator + encode_json_items(items)
+            separator = ','
+    yield ']\n'
+
+# Formatos de importación y exportación masiva -> tipo MIME
+TRANSFER_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_FIELDS = ('id', 'text', 'completed', 'created_at', 'due_at', 'priority', 'completed_at')
+
+def transfer_format(requested, mimetype):
+    """Formato pedido en ?format= o, si no, deducido del Content-Type"""
+    if requested:
+        if requested not in TRANSFER_FORMATS:
+            raise ValueError(requested)
+        return requested
+    for name, media_type in TRANSFER_FORMATS.items():
+        if mimetype == media_type:
+            return name
+    raise ValueError(mimetype)
+
+def export_header(fmt):
+    return ','.join(EXPORT_FIELDS) + '\r\n' if fmt == 'csv' else ''
+
+def encode_export_chunk(tasks, fmt):
+    """Codifica un bloque de tareas; el texto sale sin el escape HTML que se le
+    aplicó al guardarlo, para que importar lo exportado dé el mismo texto"""
+    if fmt == 'ndjson':
+        return ''.join(json.dumps({**task, 'text': unescape(task['text'])}, ensure_ascii=False) + '\n'
+                       for task in tasks)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        (task['id'], unescape(task['text']), 'true' if task['completed'] else 'false', task['created_at'],
+         '' if task['due_at'] is None else task['due_at'], task['priority'],
+         '' if task['completed_at'] is None else task['completed_at'])
+        for task in tasks)
+    return buffer.getvalue()
+
+def encode_export(chunks, fmt):
+    yield export_header(fmt)
+    for tasks in chunks:
+        if tasks:
+            yield encode_export_chunk(tasks, fmt)
+
+def iter_import_rows(stream, fmt):
+    """(número de línea, registro) del fichero subido, leído por líneas.
+
+    En NDJSON el registro es la línea sin parsear; en CSV, un dict con las
+    columnas de la cabecera. Las líneas NDJSON más largas que
+    IMPORT_MAX_LINE se descartan enteras y llegan como None.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    max_line = app.config['IMPORT_MAX_LINE']
+    number = 0
+    while True:
+        line = text.readline(max_line)
+        if not line:
+            return
+        number += 1
+        if len(line) == max_line and not line.endswith('\n'):
+            while line and not line.endswith('\n'):
+                line = text.readline(max_line)
+            yield number, None
+        elif line.strip():
+            yield number, line
+
+def parse_import_time(value, message):
+    """Fecha importada en segundos desde epoch, o None si no viene"""
+    if value in (None, ''):
+        return None
+    try:
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(value)
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError(value)
+    except ValueError:
+        raise ValueError(message)
+    return value
+
+def parse_import_record(record, fmt):
+    """Valida un registro importado y lo convierte en una tarea nueva; lanza ValueError si no es válido"""
+    if record is None:
+        raise ValueError('Línea demasiado larga')
+    if fmt == 'ndjson':
+        try:
+            record = json.loads(record)
+        except ValueError:
+            raise ValueError('JSON inválido')
+        if not isinstance(record, dict):
+            raise ValueError('Se esperaba un objeto JSON')
+
+    text = record.get('text')
+    text = sanitize_input(text).strip() if isinstance(text, str) else ''
+    if not text:
+        raise ValueError('El texto de la tarea no puede estar vacío')
+    task = new_task(text)
+
+    completed = record.get('completed')
+    try:
+        if isinstance(completed, str):
+            completed = parse_bool(completed) if completed else False
+        if completed is not None and not isinstance(completed, bool):
+            raise ValueError(completed)
+    except ValueError:
+        raise ValueError('El campo completed debe ser booleano')
+    task['completed'] = bool(completed)
+
+    created_at = parse_import_time(record.get('created_at'), 'Fecha de creación inválida')
+    if created_at is not None:
+        task['created_at'] = created_at
+    if task['completed']:
+        completed_at = parse_import_time(record.get('completed_at'), 'Fecha de completado inválida')
+        task['completed_at'] = time.time() if completed_at is None else completed_at
+
+    # En CSV todo llega como texto y un campo vacío es "sin valor"
+    due_at = record.get('due_at')
+    if isinstance(due_at, str):
+        due_at = parse_number(due_at, float, 'La fecha límite') if due_at else None
+    task['due_at'] = parse_due_at(due_at)
+    priority = record.get('priority')
+    if isinstance(priority, str):
+        priority = parse_number(priority, int, 'La prioridad') if priority else None
+    task['priority'] = 0 if priority is None else parse_priority(priority)
+    return task
+
+def import_task_stream(user_email, stream, fmt):
+    """Importa tareas de un stream NDJSON o CSV en lotes de MAX_BATCH_SIZE.
+
+    Sólo hay en memoria un lote a la vez. Las filas inválidas se saltan y
+    se cuentan; el resumen incluye las primeras IMPORT_MAX_ERRORS.
+    """
+    summary = {'imported': 0, 'rejected': 0, 'errors': []}
+    batch = []
+
+    def flush():
+        storage.apply_batch(user_email, batch)
+        task_events.publish(user_email)
+        summary['imported'] += len(batch)
+        batch.clear()
+
+    try:
+        for line, record in iter_import_rows(stream, fmt):
+            try:
+                batch.append({'op': 'create', 'task': parse_import_record(record, fmt)})
+            except ValueError as e:
+                summary['rejected'] += 1
+                if len(summary['errors']) < app.config['IMPORT_MAX_ERRORS']:
+                    summary['errors'].append({'line': line, 'error': str(e)})
+                continue
+            if len(batch) == app.config['MAX_BATCH_SIZE']:
+                flush()
+    except (csv.Error, UnicodeDecodeError):
+        # Lo ya leído se importa igualmente; el resto del fichero no es legible
+        summary['error'] = 'Fichero mal formado'
+    if batch:
+        flush()
+    return summary
+
+def parse_page_args(args):
+    """Extrae (limit, filtros) de los parámetros de GET /api/tasks"""
+    limit = min(int(args.get('limit', app.config['TASKS_PAGE_SIZE'])), app.config['TASKS_MAX_PAGE_SIZE'])
+    order = args.get('order', 'asc')
+    if limit < 1 or order not in ('asc', 'desc'):
+        raise ValueError('parámetros fuera de rango')
+
+    filters = {'descending': order == 'desc'}
+    if 'cursor' in args:
+        filters['after'] = decode_cursor(args['cursor'])
+        if not math.isfinite(filters['after'][0]):
+            raise ValueError('cursor fuera de rango')
+    if 'completed' in args:
+        filters['completed'] = parse_bool(args['completed'])
+    # nan no es menor ni mayor que nada: como filtro dejaría pasar todas las tareas
+    for name in ('created_from', 'created_to'):
+        if name in args:
+            filters[name] = float(args[name])
+            if not math.isfinite(filters[name]):
+                raise ValueError('parámetros fuera de rango')
+    return limit, filters
+
+def parse_search_args(args):
+    """Extrae (consulta, limit) de los parámetros de GET /api/tasks/search"""
+    query = args.get('q', '').strip()
+    limit = min(int(args.get('limit', app.config['TASKS_PAGE_SIZE'])), app.config['TASKS_MAX_PAGE_SIZE'])
+    if not query or limit < 1:
+        raise ValueError('parámetros fuera de rango')
+    return query, limit
+
+def search_results(tasks, limit):
+    """Cuerpo de GET /api/tasks/search a partir de `limit` + 1 resultados:
+    `truncated` avisa de que hay más coincidencias que las devueltas"""
+    return {'tasks': tasks[:limit], 'truncated': len(tasks) > limit}
+
+def parse_bool(value):
+    if value.lower() in ('true', '1'):
+        return True
+    if value.lower() in ('false', '0'):
+        return False
+    raise ValueError(value)
+
+def parse_number(value, kind, field):
+    """Convierte texto con `kind` (int o float); lanza ValueError nombrando el campo"""
+    try:
+        return kind(value)
+    except ValueError:
+        raise ValueError(f'{field} debe ser un número')
+
+def parse_due_at(value):
+    """Fecha límite en segundos desde epoch, o None para quitarla"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError('La fecha límite debe ser un número de segundos o null')
+    return float(value)
+
+def parse_priority(value):
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value <= MAX_TASK_PRIORITY:
+        raise ValueError(f'La prioridad debe ser un entero entre 0 y {MAX_TASK_PRIORITY}')
+    return value
+
+def parse_task_changes(data):
+    """Valida los campos a modificar de una tarea; lanza ValueError si no son válidos"""
+    changes = {}
+    if 'text' in data:
+        text = sanitize_input(data['text']).strip() if isinstance(data['text'], str) else ''
+        if not text:
+            raise ValueError('El texto de la tarea no puede estar vacío')
+        changes['text'] = text
+    if 'completed' in data:
+        if not isinstance(data['completed'], bool):
+            raise ValueError('El campo completed debe ser booleano')
+        changes['completed'] = data['completed']
+    if 'due_at' in data:
+        changes['due_at'] = parse_due_at(data['due_at'])
+    if 'priority' in data:
+        changes['priority'] = parse_priority(data['priority'])
+    if not changes:
+        raise ValueError('La actualización no modifica ningún campo')
+    return changes
+
+def parse_due_args(args):
+    """Extrae (overdue, limit) de los parámetros de GET /api/tasks/due"""
+    view = args.get('view', 'upcoming')
+    limit = min(int(args.get('limit', app.config['TASKS_PAGE_SIZE'])), app.config['TASKS_MAX_PAGE_SIZE'])
+    if view not in ('upcoming', 'overdue') or limit < 1:
+        raise ValueError('parámetros fuera de rango')
+    return view == 'overdue', limit
+
+def parse_archive_args(args):
+    """Extrae (limit, clave) de los parámetros de GET /api/tasks/archive"""
+    limit = min(int(args.get('limit', app.config['TASKS_PAGE_SIZE'])), app.config['TASKS_MAX_PAGE_SIZE'])
+    if limit < 1:
+        raise ValueError('parámetros fuera de rango')
+    after = None
+    if 'cursor' in args:
+        segment, position = json.loads(base64.urlsafe_b64decode(args['cursor'].encode('ascii')))
+        after = int(segment), int(position)
+        if after[0] < 0 or after[1] < 0:
+            raise ValueError('cursor fuera de rango')
+    return limit, after
+
+class HashPoolBusy(Exception):
+    """La cola del pool de hashing está llena"""
+
+class PasswordHasher:
+    """Pool acotado de hilos dedicado a PBKDF2.
+
+    hashlib libera el GIL durante PBKDF2, así que un pool de hilos basta para
+    que los picos de login no acaparen la CPU de las peticiones baratas.
+    Como máximo hay `workers` cálculos en curso y `max_queue` en espera; por
+    encima de eso submit() falla inmediatamente con HashPoolBusy.
+    """
+
+    def __init__(self, workers, max_queue):
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pbkdf2')
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._stats_lock = threading.Lock()
+        self._stats = {'jobs': 0, 'rejected': 0, 'wait_seconds': 0.0, 'compute_seconds': 0.0,
+                       'max_wait_seconds': 0.0, 'max_compute_seconds': 0.0}
+
+    def submit(self, fn, *args):
+        """Ejecuta fn(*args) en el pool y espera su resultado"""
+        return self._submit(fn, *args).result()
+
+    def submit_async(self, fn, *args):
+        """Como submit(), pero devuelve un awaitable de asyncio"""
+        import asyncio
+        return asyncio.wrap_future(self._submit(fn, *args))
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._stats['rejected'] += 1
+            raise HashPoolBusy()
+        enqueued = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self._record(started - enqueued, time.perf_counter() - started)
+                self._slots.release()
+
+        return self._executor.submit(run)
+
+    def _record(self, wait, compute):
+        metrics.observe('pbkdf2_queue_wait_seconds', (), wait)
+        metrics.observe('pbkdf2_duration_seconds', (), compute)
+        with self._stats_lock:
+            stats = self._stats
+            stats['jobs'] += 1
+            stats['wait_seconds'] += wait
+            stats['compute_seconds'] += compute
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], wait)
+            stats['max_compute_seconds'] = max(stats['max_compute_seconds'], compute)
+
+    def stats(self):
+        """Copia de las métricas de espera en cola frente a tiempo de cálculo"""
+        with self._stats_lock:
+            return dict(self._stats)
+
+password_hasher = None  # lo crea create_app()
+
+def _pbkdf2(password, salt):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
+
+def hash_password(password):
+    """Hashea la contraseña usando SHA-256 con salt"""
+    salt = os.urandom(32)
+    key = password_hasher.submit(_pbkdf2, password, salt)
+    return salt + key
+
+def verify_password(stored_password, provided_password):
+    """Verifica si la contraseña proporcionada coincide con la almacenada"""
+    salt = stored_password[:32]
+    stored_key = stored_password[32:]
+    key = password_hasher.submit(_pbkdf2, provided_password, salt)
+    return hmac.compare_digest(key, stored_key)
+
+class _Waiter:
+    __slots__ = ('wake', 'admitted')
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.admitted = False
+
+class AdmissionQueue:
+    """Limita la concurrencia de una clase de rutas con una cola FIFO acotada.
+
+    Como máximo hay `limit` peticiones en curso y `max_queue` esperando; al
+    terminar una, su hueco pasa directamente a la primera de la cola. Una
+    petición se rechaza al llegar si la cola está llena o si, según el tiempo
+    de servicio medio, no va a entrar antes de `max_wait` segundos; si aun así
+    agota el plazo esperando, se rechaza entonces.
+    """
+
+    def __init__(self, name, limit, max_queue, max_wait):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._labels = (('class', name),)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+        self._service = 0.0  # media móvil exponencial del tiempo de servicio
+
+    def _enter(self, wake):
+        """(motivo de rechazo, waiter); ambos None si la petición entra ya"""
+        with self._lock:
+            if self._active < self.limit:
+                self._active += 1
+                return None, None
+            queued = len(self._waiters)
+            if queued >= self.max_queue:
+                return 'queue_full', None
+            # Las peticiones por delante se reparten entre los `limit` huecos
+            if (queued + 1) * self._service / self.limit > self.max_wait:
+                return 'deadline', None
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            return None, waiter
+
+    def _abandon(self, waiter):
+        """Saca de la cola un waiter que agotó su plazo; False si ya tenía hueco"""
+        with self._lock:
+            if waiter.admitted:
+                return False
+            self._waiters.remove(waiter)
+            return True
+
+    def _admitted(self, reason, started):
+        if reason is None:
+            metrics.observe('admission_queue_wait_seconds', self._labels, time.perf_counter() - started)
+        else:
+            metrics.inc('admission_rejected_total', self._labels + (('reason', reason),))
+        return reason
+
+    def acquire(self):
+        """Espera un hueco; devuelve None si la petición entra o el motivo del rechazo"""
+        started = time.perf_counter()
+        event = threading.Event()
+        reason, waiter = self._enter(event.set)
+        if waiter is not None and not event.wait(self.max_wait) and self._abandon(waiter):
+            reason = 'timeout'
+        return self._admitted(reason, started)
+
+    async def acquire_async(self):
+        """Como acquire(), pero sin bloquear el bucle de asyncio"""
+        import asyncio
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        reason, waiter = self._enter(wake)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(future, self.max_wait)
+            except asyncio.TimeoutError:
+                if self._abandon(waiter):
+                    reason = 'timeout'
+            except asyncio.CancelledError:
+                # El cliente se fue: si ya nos habían cedido el hueco, se devuelve
+                if not self._abandon(waiter):
+                    self.release(0.0)
+                raise
+        return self._admitted(reason, started)
+
+    def release(self, elapsed):
+        """Libera el hueco de una petición que tardó `elapsed` segundos"""
+        with self._lock:
+            self._service += (elapsed - self._service) * 0.2
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.admitted = True
+                waiter.wake()
+            else:
+                self._active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'active': self._active, 'queued': len(self._waiters), 'service_seconds': self._service}
+
+# Clase de admisión de cada endpoint (mismos nombres en Flask y en el modo asyncio).
+# El stream SSE queda fuera: ocuparía un hueco durante toda la conexión.
+ADMISSION_ROUTES = {
+    'register': 'auth', 'login': 'auth',
+    'get_tasks': 'read', 'get_task_changes': 'read', 'search_tasks': 'read', 'get_due_tasks': 'read',
+    'get_archived_tasks': 'read', 'export_tasks': 'read',
+    'add_task': 'write', 'batch_tasks': 'write', 'import_tasks': 'write', 'toggle_task': 'write',
+    'update_task': 'write', 'delete_task': 'write',
+}
+
+admission_queues = {}  # los crea create_app()
 
-# Simulación de base de datos segura
-users_db = {}
-tasks_db = {}
+def admission_queue(endpoint):
+    """Cola de admisión del endpoint, o None si no está limitado"""
+    return admission_queues.get(ADMISSION_ROUTES.get(endpoint))
 
-def hash_password(password):
-    """Hashea la contraseña usando SHA-256 con salt"""
-    salt = os.urandom(32)
-    key = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-    return salt + key
+def admission_samples():
+    """Gauges de ocupación de las colas de admisión para /metrics"""
+    samples = []
+    for name, queue in admission_queues.items():
+        stats = queue.stats()
+        samples.append(('admission_active', (('class', name),), stats['active']))
+        samples.append(('admission_queued', (('class', name),), stats['queued']))
+    return samples
 
-def verify_password(stored_password, provided_password):
-    """Verifica si la contraseña proporcionada coincide con la almacenada"""
-    salt = stored_password[:32]
-    stored_key = stored_password[32:]
-    key = hashlib.pbkdf2_hmac('sha256', provided_password.encode('utf-8'), salt, 100000)
-    return key == stored_key
+class TokenBucketLimiter:
+    """Token bucket por clave: `rate` tokens por segundo hasta un máximo de `burst`.
+
+    Recuerda como mucho `max_keys` claves; las menos usadas se olvidan (y
+    vuelven con el bucket lleno).
+    """
+
+    def __init__(self, rate, burst, max_keys):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # clave -> (tokens, instante)
+
+    def take(self, key, now=None, spend=True):
+        """Gasta un token; devuelve 0 si lo había o los segundos hasta el siguiente.
+
+        Con spend=False sólo comprueba si queda alguno, sin gastarlo.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens >= 1:
+                tokens -= spend
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+login_ip_limiter = login_email_limiter = None  # los crea create_app()
+
+def login_retry_after(ip, email):
+    """0 si el intento de login puede seguir; si no, segundos que debe esperar.
+
+    Se comprueba antes de buscar al usuario para que ni los emails inexistentes
+    ni las contraseñas erróneas lleguen a PBKDF2 por encima del ritmo permitido.
+    El bucket de la IP sólo se consulta aquí y lo gasta login_failed(): así los
+    logins correctos de muchos usuarios tras una misma IP no se bloquean.
+    """
+    if not app.config['LOGIN_RATE_LIMIT']:
+        return 0
+    for kind, limiter, key, spend in (('ip', login_ip_limiter, ip, False),
+                                      ('email', login_email_limiter, email, True)):
+        wait = limiter.take(key, spend=spend)
+        if wait:
+            metrics.inc('login_rate_limited_total', (('key', kind),))
+            return wait
+    return 0
+
+def login_failed(ip):
+    """Gasta un token del bucket de la IP por un intento de login fallido"""
+    if app.config['LOGIN_RATE_LIMIT']:
+        login_ip_limiter.take(ip)
+
+def server_busy():
+    """Respuesta 503 para cuando el pool de hashing está saturado"""
+    response = jsonify({'error': 'Servidor ocupado, inténtalo de nuevo en unos segundos'})
+    response.headers['Retry-After'] = str(app.config['HASH_RETRY_AFTER'])
+    return response, 503
+
+def too_many_requests(wait):
+    """Respuesta 429 con el Retry-After que indica el limitador"""
+    response = jsonify({'error': 'Demasiados intentos, inténtalo de nuevo más tarde'})
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response, 429
 
 def login_required(f):
     """Decorator para requerir autenticación"""
@@ -156,6 +3373,20 @@ HTML_CONTENT = '''<!DOCTYPE html>
             padding: 12px 24px;
         }
 
+        .task-input-group input.task-due,
+        .task-input-group select {
+            flex: 0 0 auto;
+            width: auto;
+        }
+
+        select {
+            padding: 12px;
+            border: 2px solid #e0e0e0;
+            border-radius: 8px;
+            font-size: 16px;
+            background: white;
+        }
+
         .tasks-list {
             margin-top: 20px;
         }
@@ -185,6 +3416,17 @@ HTML_CONTENT = '''<!DOCTYPE html>
             color: #333;
         }
 
+        .task-meta {
+            color: #888;
+            font-size: 13px;
+            margin: 0 10px;
+        }
+
+        .task-meta.overdue {
+            color: #e74c3c;
+            font-weight: 600;
+        }
+
         .task-actions {
             display: flex;
             gap: 10px;
@@ -223,6 +3465,18 @@ HTML_CONTENT = '''<!DOCTYPE html>
             background: #e74c3c;
         }
 
+        .bulk-actions {
+            display: flex;
+            gap: 10px;
+            margin-bottom: 20px;
+        }
+
+        .bulk-actions button {
+            margin-top: 0;
+            padding: 8px 16px;
+            font-size: 14px;
+        }
+
         .hidden {
             display: none;
         }
@@ -241,6 +3495,12 @@ HTML_CONTENT = '''<!DOCTYPE html>
             text-align: center;
         }
 
+        .search-notice {
+            color: #999;
+            font-size: 13px;
+            margin: -10px 0 10px;
+        }
+
         .empty-state {
             text-align: center;
             color: #999;
@@ -319,15 +3579,38 @@ HTML_CONTENT = '''<!DOCTYPE html>
 
             <div class="task-input-group">
                 <input type="text" id="taskInput" placeholder="Nueva tarea..." onkeypress="if(event.key==='Enter') addTask()">
+                <input type="datetime-local" id="taskDue" class="task-due" title="Fecha límite">
+                <select id="taskPriority" title="Prioridad">
+                    <option value="0">Sin prioridad</option>
+                    <option value="1">Baja</option>
+                    <option value="2">Media</option>
+                    <option value="3">Alta</option>
+                </select>
                 <button onclick="addTask()">Agregar</button>
             </div>
 
+            <div class="bulk-actions">
+                <button class="secondary-btn" onclick="completeAll()">Completar todas</button>
+                <button class="secondary-btn" onclick="clearCompleted()">Borrar completadas</button>
+            </div>
+
+            <div class="task-input-group">
+                <input type="search" id="searchInput" placeholder="Buscar tareas..." oninput="scheduleSearch()">
+            </div>
+            <div class="search-notice" id="searchNotice" hidden></div>
+
             <div class="tasks-list" id="tasksList"></div>
         </div>
     </div>
 
     <script>
         let currentUser = null;
+        let taskState = new Map();  // id -> { task, element }
+        let syncVersion = 0;
+        let syncETag = null;
+        let taskStream = null;
+        let searchQuery = '';
+        let searchTimer = null;
 
         function showLogin() {
             document.getElementById('loginScreen').classList.remove('hidden');
@@ -439,6 +3722,8 @@ HTML_CONTENT = '''<!DOCTYPE html>
                 console.log('Error durante logout:', error);
             } finally {
                 currentUser = null;
+                closeTaskStream();
+                resetTaskState();
                 document.getElementById('loginEmail').value = '';
                 document.getElementById('loginPassword').value = '';
                 showLogin();
@@ -447,6 +3732,8 @@ HTML_CONTENT = '''<!DOCTYPE html>
 
         async function addTask() {
             const taskInput = document.getElementById('taskInput');
+            const taskDue = document.getElementById('taskDue');
+            const taskPriority = document.getElementById('taskPriority');
             const taskText = taskInput.value.trim();
 
             if (!taskText) return;
@@ -457,12 +3744,21 @@ HTML_CONTENT = '''<!DOCTYPE html>
                     headers: {
                         'Content-Type': 'application/json',
                     },
-                    body: JSON.stringify({ text: taskText })
+                    body: JSON.stringify({
+                        text: taskText,
+                        // El servidor guarda las fechas como segundos desde epoch
+                        due_at: taskDue.value ? new Date(taskDue.value).getTime() / 1000 : null,
+                        priority: Number(taskPriority.value)
+                    })
                 });
 
                 if (response.ok) {
                     taskInput.value = '';
-                    renderTasks();
+                    taskDue.value = '';
+                    taskPriority.value = '0';
+                    upsertTask(await response.json());
+                    updateEmptyState();
+                    refreshAfterMutation();
                 }
             } catch (error) {
                 console.log('Error agregando tarea:', error);
@@ -476,7 +3772,8 @@ HTML_CONTENT = '''<!DOCTYPE html>
                 });
 
                 if (response.ok) {
-                    renderTasks();
+                    upsertTask(await response.json());
+                    refreshAfterMutation();
                 }
             } catch (error) {
                 console.log('Error actualizando tarea:', error);
@@ -490,64 +3787,270 @@ HTML_CONTENT = '''<!DOCTYPE html>
                 });
 
                 if (response.ok) {
-                    renderTasks();
+                    removeTask(id);
+                    updateEmptyState();
+                    refreshAfterMutation();
                 }
             } catch (error) {
                 console.log('Error eliminando tarea:', error);
             }
         }
 
-        async function renderTasks() {
+        // El servidor limita el tamaño de cada lote (MAX_BATCH_SIZE)
+        const BATCH_SIZE = 100;
+
+        async function runBatch(operations) {
+            try {
+                for (let i = 0; i < operations.length; i += BATCH_SIZE) {
+                    const response = await fetch('/api/tasks/batch', {
+                        method: 'POST',
+                        headers: {
+                            'Content-Type': 'application/json',
+                        },
+                        body: JSON.stringify({ operations: operations.slice(i, i + BATCH_SIZE) })
+                    });
+
+                    if (!response.ok) {
+                        break;
+                    }
+                }
+            } catch (error) {
+                console.log('Error aplicando lote:', error);
+            } finally {
+                refreshAfterMutation();
+            }
+        }
+
+        function completeAll() {
+            const operations = [];
+            taskState.forEach(({ task }) => {
+                if (!task.completed) {
+                    operations.push({ op: 'update', id: task.id, completed: true });
+                }
+            });
+            if (operations.length > 0) {
+                runBatch(operations);
+            }
+        }
+
+        function clearCompleted() {
+            const operations = [];
+            taskState.forEach(({ task }) => {
+                if (task.completed) {
+                    operations.push({ op: 'delete', id: task.id });
+                }
+            });
+            if (operations.length > 0) {
+                runBatch(operations);
+            }
+        }
+
+        const PRIORITY_LABELS = ['', 'Baja', 'Media', 'Alta'];
+
+        function createTaskElement(task) {
+            // Usamos createElement para prevenir XSS
+            const taskElement = document.createElement('div');
+
+            const taskText = document.createElement('div');
+            taskText.className = 'task-text';
+
+            const taskMeta = document.createElement('div');
+            taskMeta.className = 'task-meta';
+
+            const taskActions = document.createElement('div');
+            taskActions.className = 'task-actions';
+
+            const completeBtn = document.createElement('button');
+            completeBtn.className = 'complete-btn';
+            completeBtn.onclick = () => toggleTask(task.id);
+
+            const deleteBtn = document.createElement('button');
+            deleteBtn.className = 'delete-btn';
+            deleteBtn.textContent = '🗑️';
+            deleteBtn.onclick = () => deleteTask(task.id);
+
+            taskActions.appendChild(completeBtn);
+            taskActions.appendChild(deleteBtn);
+            taskElement.appendChild(taskText);
+            taskElement.appendChild(taskMeta);
+            taskElement.appendChild(taskActions);
+            return taskElement;
+        }
+
+        function updateTaskElement(taskElement, task) {
+            taskElement.className = `task-item ${task.completed ? 'completed' : ''}`;
+            taskElement.querySelector('.task-text').textContent = task.text; // textContent previene XSS
+            taskElement.querySelector('.complete-btn').textContent = task.completed ? '↩️' : '✓';
+
+            const meta = [];
+            if (task.priority) meta.push(PRIORITY_LABELS[task.priority]);
+            if (task.due_at !== null) meta.push(new Date(task.due_at * 1000).toLocaleString());
+            const taskMeta = taskElement.querySelector('.task-meta');
+            taskMeta.textContent = meta.join(' · ');
+            taskMeta.classList.toggle('overdue', !task.completed && task.due_at !== null && task.due_at * 1000 < Date.now());
+        }
+
+        function upsertTask(task) {
+            const tasksList = document.getElementById('tasksList');
+            let entry = taskState.get(task.id);
+
+            if (!entry) {
+                entry = { task, element: createTaskElement(task) };
+                taskState.set(task.id, entry);
+                // Las tareas nuevas casi siempre van al final; sólo se busca
+                // la posición si llega una más antigua que la última.
+                let next = null;
+                for (let node = tasksList.lastElementChild; node && node.dataset.createdAt > task.created_at; node = node.previousElementSibling) {
+                    next = node;
+                }
+                entry.element.dataset.createdAt = task.created_at;
+                tasksList.insertBefore(entry.element, next);
+            }
+
+            entry.task = task;
+            updateTaskElement(entry.element, task);
+        }
+
+        function removeTask(id) {
+            const entry = taskState.get(id);
+            if (entry) {
+                entry.element.remove();
+                taskState.delete(id);
+            }
+        }
+
+        function resetTaskState() {
+            taskState.clear();
+            syncVersion = 0;
+            syncETag = null;
+            document.getElementById('tasksList').innerHTML = '';
+        }
+
+        function updateEmptyState() {
             const tasksList = document.getElementById('tasksList');
+            let emptyState = document.getElementById('emptyState');
+
+            if (taskState.size === 0 && !emptyState) {
+                emptyState = document.createElement('div');
+                emptyState.id = 'emptyState';
+                emptyState.className = 'empty-state';
+                emptyState.textContent = 'No tienes tareas. ¡Agrega una para comenzar!';
+                tasksList.appendChild(emptyState);
+            } else if (taskState.size > 0 && emptyState) {
+                emptyState.remove();
+            }
+        }
+
+        function applyDelta(delta) {
+            if (delta.reset) {
+                resetTaskState();
+            }
+            delta.deleted.forEach(removeTask);
+            delta.changed.forEach(upsertTask);
+            syncVersion = delta.version;
+            updateEmptyState();
+            if (searchQuery) {
+                scheduleSearch();
+            }
+        }
+
+        // La búsqueda la resuelve el índice del servidor; aquí sólo se
+        // ocultan las tareas que no están entre los resultados.
+        function scheduleSearch() {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(searchTasks, 200);
+        }
+
+        async function searchTasks() {
+            const query = document.getElementById('searchInput').value.trim();
+            const notice = document.getElementById('searchNotice');
+            searchQuery = query;
+            if (!query) {
+                taskState.forEach((entry) => { entry.element.hidden = false; });
+                notice.hidden = true;
+                return;
+            }
 
             try {
-                const response = await fetch('/api/tasks');
-                const tasks = await response.json();
+                const response = await fetch(`/api/tasks/search?q=${encodeURIComponent(query)}&limit=500`);
+                const data = await response.json();
 
                 if (!response.ok) {
-                    throw new Error('Error cargando tareas');
+                    throw new Error(data.error);
                 }
+                if (query !== searchQuery) return;  // llegó tarde, ya hay otra búsqueda
+
+                const found = new Set(data.tasks.map((task) => task.id));
+                taskState.forEach((entry, id) => { entry.element.hidden = !found.has(id); });
+                // El servidor sólo devuelve las más relevantes; mejor decirlo que ocultar el resto sin avisar
+                notice.textContent = `Se muestran las ${data.tasks.length} tareas más relevantes; afina la búsqueda para ver el resto.`;
+                notice.hidden = !data.truncated;
+            } catch (error) {
+                console.log('Error buscando tareas:', error);
+            }
+        }
 
-                if (tasks.length === 0) {
-                    tasksList.innerHTML = '<div class="empty-state">No tienes tareas. ¡Agrega una para comenzar!</div>';
+        // Aplica sólo los cambios desde la última versión sincronizada en
+        // lugar de volver a descargar y reconstruir toda la lista. Con
+        // If-None-Match el servidor responde 304 sin cuerpo si no hay nada.
+        async function renderTasks() {
+            const tasksList = document.getElementById('tasksList');
+
+            try {
+                const headers = syncETag ? { 'If-None-Match': syncETag } : {};
+                const response = await fetch(`/api/tasks/changes?since=${syncVersion}`, { headers });
+
+                if (response.status === 304) {
+                    openTaskStream();
                     return;
                 }
 
-                // Usamos createElement para prevenir XSS
-                tasksList.innerHTML = '';
-                tasks.forEach(task => {
-                    const taskElement = document.createElement('div');
-                    taskElement.className = `task-item ${task.completed ? 'completed' : ''}`;
-                    
-                    const taskText = document.createElement('div');
-                    taskText.className = 'task-text';
-                    taskText.textContent = task.text; // textContent previene XSS
-                    
-                    const taskActions = document.createElement('div');
-                    taskActions.className = 'task-actions';
-                    
-                    const completeBtn = document.createElement('button');
-                    completeBtn.className = 'complete-btn';
-                    completeBtn.textContent = task.completed ? '↩️' : '✓';
-                    completeBtn.onclick = () => toggleTask(task.id);
-                    
-                    const deleteBtn = document.createElement('button');
-                    deleteBtn.className = 'delete-btn';
-                    deleteBtn.textContent = '🗑️';
-                    deleteBtn.onclick = () => deleteTask(task.id);
-                    
-                    taskActions.appendChild(completeBtn);
-                    taskActions.appendChild(deleteBtn);
-                    taskElement.appendChild(taskText);
-                    taskElement.appendChild(taskActions);
-                    tasksList.appendChild(taskElement);
-                });
+                const delta = await response.json();
+
+                if (!response.ok) {
+                    throw new Error('Error cargando tareas');
+                }
+
+                applyDelta(delta);
+                syncETag = response.headers.get('ETag');
+                openTaskStream();
 
             } catch (error) {
+                resetTaskState();
                 tasksList.innerHTML = '<div class="error">Error cargando tareas</div>';
             }
         }
 
+        // El servidor empuja los cambios (también los de otras pestañas) por
+        // Server-Sent Events; al reconectar, el navegador envía Last-Event-ID
+        // y el servidor manda sólo lo que falte.
+        function openTaskStream() {
+            if (taskStream || !window.EventSource) return;
+
+            taskStream = new EventSource(`/api/tasks/stream?since=${syncVersion}`);
+            taskStream.addEventListener('tasks', (event) => applyDelta(JSON.parse(event.data)));
+            taskStream.onerror = () => {
+                if (taskStream && taskStream.readyState === EventSource.CLOSED) {
+                    taskStream = null;
+                }
+            };
+        }
+
+        function closeTaskStream() {
+            if (taskStream) {
+                taskStream.close();
+                taskStream = null;
+            }
+        }
+
+        // Tras una acción propia sólo hace falta pedir cambios si el stream
+        // no está conectado; si lo está, el cambio llegará por él.
+        function refreshAfterMutation() {
+            if (!taskStream || taskStream.readyState !== EventSource.OPEN) {
+                renderTasks();
+            }
+        }
+
         // Verificar sesión al cargar la página
         async function checkSession() {
             try {
@@ -571,7 +4074,223 @@ HTML_CONTENT = '''<!DOCTYPE html>
 </body>
 </html>'''
 
+class StaticAsset:
+    """Recurso estático precalculado al arrancar.
+
+    Guarda el cuerpo en claro y sus variantes gzip/brotli ya comprimidas,
+    de modo que servirlo es sólo elegir la codificación y comparar ETag.
+    """
+
+    def __init__(self, body, mimetype, cache_control):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, 9)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body)
+
+    def response(self):
+        encoding = request.accept_encodings.best_match(
+            [name for name in ('br', 'gzip') if name in self.variants], default='identity')
+        etag = self.etag if encoding == 'identity' else f'{self.etag}-{encoding}'
+        headers = {'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding'}
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, headers=headers)
+        else:
+            response = Response(self.variants[encoding], mimetype=self.mimetype, headers=headers)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+        response.set_etag(etag)
+        return response
+
+def build_index_assets(html):
+    """Separa el CSS y el JS en línea de la página en recursos con huella.
+
+    Devuelve (página, {nombre: StaticAsset}); la página enlaza los recursos
+    por nombre con hash, así que pueden cachearse indefinidamente.
+    """
+    immutable = 'public, max-age=31536000, immutable'
+    assets = {}
+    for open_tag, close_tag, extension, mimetype, link in (
+            ('<style>', '</style>', 'css', 'text/css', '<link rel="stylesheet" href="/assets/{}">'),
+            ('<script>', '</script>', 'js', 'text/javascript', '<script src="/assets/{}"></script>')):
+        start = html.index(open_tag)
+        end = html.index(close_tag, start) + len(close_tag)
+        body = html[start + len(open_tag):end - len(close_tag)].encode('utf-8')
+        name = f'app.{hashlib.sha256(body).hexdigest()[:12]}.{extension}'
+        assets[name] = StaticAsset(body, mimetype, immutable)
+        html = html[:start] + link.format(name) + html[end:]
+
+    page = StaticAsset(html.encode('utf-8'), 'text/html', 'no-cache')
+    return page, assets
+
+INDEX_PAGE, INDEX_ASSETS = None, {}  # los crea create_app()
+
+_app_lock = threading.Lock()
+_app_created = False
+
+def create_app(config=None):
+    """Crea los subsistemas de la app (almacenamiento, sesiones, pools, cachés,
+    página inicial) y devuelve `app`.
+
+    Importar el módulo no abre ficheros ni arranca nada: así un proceso
+    maestro puede precargar la app con create_app() y luego hacer fork
+    (python app.py --workers N, o gunicorn --preload 'app:create_app()'), y
+    los workers comparten esas páginas copy-on-write en vez de repetir el
+    arranque. Llamarla otra vez sin `config` no hace nada; con `config`
+    aplica esos valores y vuelve a crear todo.
+    """
+    global storage, task_events, task_list_cache, task_archiver, task_ids, task_id_lease, password_hasher
+    global admission_queues, login_ip_limiter, login_email_limiter, INDEX_PAGE, INDEX_ASSETS
+    global _wsgi_app, _app_created
+    with _app_lock:
+        if _app_created and not config:
+            return app
+        app.config.update(config or {})
+        storage = create_storage(app.config)
+        app.session_interface = create_session_interface(app.config)
+        task_events = TaskEventBroker()
+        task_list_cache = TaskListCache(app.config['TASK_LIST_CACHE_BYTES'])
+        task_events.add_listener(task_list_cache.invalidate)
+        task_archiver = TaskArchiver(storage, app.config['ARCHIVE_AFTER'], app.config['ARCHIVE_INTERVAL'],
+                                     app.config['ARCHIVE_BATCH'])
+        if task_id_lease is not None:
+            task_id_lease.release()
+        task_ids, task_id_lease = create_task_ids(app.config, storage)
+        password_hasher = PasswordHasher(app.config['HASH_WORKERS'], app.config['HASH_QUEUE_DEPTH'])
+        admission_queues = {name: AdmissionQueue(name, limit, max_queue, app.config['ADMISSION_MAX_WAIT'])
+                            for name, (limit, max_queue) in app.config['ADMISSION_LIMITS'].items()}
+        login_ip_limiter = TokenBucketLimiter(*app.config['LOGIN_RATE_PER_IP'], app.config['LOGIN_RATE_MAX_KEYS'])
+        login_email_limiter = TokenBucketLimiter(*app.config['LOGIN_RATE_PER_EMAIL'],
+                                                 app.config['LOGIN_RATE_MAX_KEYS'])
+        INDEX_PAGE, INDEX_ASSETS = build_index_assets(HTML_CONTENT)
+        if app.config['TRUSTED_PROXIES']:
+            from werkzeug.middleware.proxy_fix import ProxyFix
+            _wsgi_app = ProxyFix(_flask_wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+        else:
+            _wsgi_app = _flask_wsgi_app
+        _app_created = True
+    return app
+
+_flask_wsgi_app = _wsgi_app = app.wsgi_app
+
+def _lazy_wsgi_app(environ, start_response):
+    # Quien sirva `app:app` sin llamar a create_app() (flask run, test_client)
+    # la inicializa con la primera petición
+    if not _app_created:
+        create_app()
+    return _wsgi_app(environ, start_response)
+
+app.wsgi_app = _lazy_wsgi_app
+
+def _after_fork_in_child():
+    global task_ids, task_id_lease
+    for pool in list(_connection_pools):
+        pool._after_fork()
+    # La reserva es del maestro (y su hilo de renovación no sobrevive al fork)
+    if task_id_lease is not None:
+        task_ids, task_id_lease = create_task_ids(app.config, storage)
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def serve_workers(host, port, workers):
+    """Precarga la app, abre el socket y hace fork de `workers` servidores que lo comparten"""
+    global task_ids
+    import socket
+    from werkzeug.serving import make_server
+    if workers > 1 and (app.config['STORAGE_BACKEND'] != 'sqlite' or app.config['SESSION_BACKEND'] != 'sqlite'):
+        raise SystemExit('Con varios workers hacen falta STORAGE_BACKEND=sqlite y SESSION_BACKEND=sqlite')
+    # Sin recolecciones durante la precarga, y gc.freeze() deja esos objetos fuera
+    # del GC para que los hijos no toquen (ni copien) sus páginas al recolectar
+    gc.disable()
+    create_app()
+    listener = socket.create_server((host, port), backlog=1024)
+    gc.freeze()
+    children = []
+    for index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            gc.enable()
+            if app.config['TASK_ID_WORKER'] is not None:
+                task_ids = TaskIdGenerator((app.config['TASK_ID_WORKER'] + index) % 32)
+            try:
+                make_server(host, port, app, threaded=True, fd=listener.fileno()).serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    gc.enable()
+    listener.close()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except (KeyboardInterrupt, SystemExit):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+
 # API Routes
+@app.before_request
+def start_request_metrics():
+    if request.endpoint is None:
+        # Mismos nombres que los handlers de 404/405 del modo asyncio
+        g.metrics_endpoint = 'method_not_allowed' if getattr(request.routing_exception, 'code', 404) == 405 else 'not_found'
+    else:
+        g.metrics_endpoint = request.endpoint
+    g.metrics_started = begin_request(g.metrics_endpoint)
+
+@app.before_request
+def admit_request():
+    queue = admission_queue(request.endpoint)
+    if queue is None:
+        return None
+    if queue.acquire() is not None:
+        return server_busy()
+    g.admission = (queue, time.perf_counter())
+
+@app.after_request
+def hold_admission_while_streaming(response):
+    """Un cuerpo en streaming ocupa su hueco hasta que se termina de enviar,
+    no sólo mientras corre la vista"""
+    admission = g.pop('admission', None) if response.is_streamed else None
+    if admission is not None:
+        queue, started = admission
+        response.call_on_close(lambda: queue.release(time.perf_counter() - started))
+    return response
+
+@app.teardown_request
+def release_admission(exc):
+    admission = g.pop('admission', None)
+    if admission is not None:
+        queue, started = admission
+        queue.release(time.perf_counter() - started)
+
+@app.after_request
+def record_response_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Una excepción sin capturar no pasa por after_request: cuenta como 500
+    if 'metrics_started' in g:
+        end_request(g.metrics_endpoint, request.method, g.get('metrics_status', 500), g.metrics_started)
+
+def password_hasher_samples():
+    """Muestras de password_hasher.stats() que no cubren los histogramas"""
+    stats = password_hasher.stats()
+    return [('pbkdf2_rejected_total', (), stats['rejected']),
+            ('pbkdf2_max_wait_seconds', (), stats['max_wait_seconds']),
+            ('pbkdf2_max_compute_seconds', (), stats['max_compute_seconds'])]
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(password_hasher_samples() + admission_samples()), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/register', methods=['POST'])
 def register():
     try:
@@ -586,21 +4305,24 @@ def register():
         if len(password) < 8:
             return jsonify({'error': 'La contraseña debe tener al menos 8 caracteres'}), 400
 
-        if email in users_db:
+        if storage.get_user(email) is not None:
             return jsonify({'error': 'Este email ya está registrado'}), 400
 
         # Hash de la contraseña
         hashed_password = hash_password(password)
-        users_db[email] = {
+        created = storage.create_user(email, {
             'name': name,
             'password': hashed_password.hex(),
             'created_at': time.time()
-        }
-        
-        tasks_db[email] = []
+        })
+
+        if not created:
+            return jsonify({'error': 'Este email ya está registrado'}), 400
 
         return jsonify({'message': 'Usuario registrado exitosamente'}), 201
 
+    except HashPoolBusy:
+        return server_busy()
     except Exception as e:
         return jsonify({'error': 'Error interno del servidor'}), 500
 
@@ -614,16 +4336,23 @@ def login():
         if not email or not password:
             return jsonify({'error': 'Email y contraseña son requeridos'}), 400
 
-        user = users_db.get(email)
+        wait = login_retry_after(request.remote_addr, email)
+        if wait:
+            return too_many_requests(wait)
+
+        user = storage.get_user(email)
         if not user:
+            login_failed(request.remote_addr)
             return jsonify({'error': 'Credenciales inválidas'}), 401
 
         # Verificar contraseña
         stored_password = bytes.fromhex(user['password'])
         if not verify_password(stored_password, password):
+            login_failed(request.remote_addr)
             return jsonify({'error': 'Credenciales inválidas'}), 401
 
-        # Crear sesión
+        # Crear sesión, siempre con un token nuevo
+        session.regenerate()
         session.permanent = True
         session['user_email'] = email
         session['user_name'] = user['name']
@@ -634,6 +4363,8 @@ def login():
             'user': {'name': user['name'], 'email': email}
         }), 200
 
+    except HashPoolBusy:
+        return server_busy()
     except Exception as e:
         return jsonify({'error': 'Error interno del servidor'}), 500
 
@@ -644,12 +4375,8 @@ def logout():
 
 @app.route('/api/session')
 def check_session():
+    # Las sesiones caducadas ya no llegan aquí: el almacén no las devuelve
     if 'user_email' in session:
-        # Verificar timeout de sesión
-        if time.time() - session.get('login_time', 0) > app.config['PERMANENT_SESSION_LIFETIME']:
-            session.clear()
-            return jsonify({'authenticated': False}), 401
-            
         return jsonify({
             'authenticated': True,
             'user': {
@@ -664,11 +4391,148 @@ def check_session():
 def get_tasks():
     try:
         user_email = session['user_email']
-        tasks = tasks_db.get(user_email, [])
-        return jsonify(tasks), 200
+        if not request.args:
+            version = storage.task_version(user_email)
+            cached = task_list_cache.get(user_email, version)
+            if cached is None:
+                # Las listas grandes se codifican por bloques mientras se
+                # envían en lugar de construir todo el JSON en memoria.
+                if storage.count_tasks(user_email) > app.config['STREAM_JSON_THRESHOLD']:
+                    chunks = iter_task_chunks(user_email, app.config['STREAM_JSON_CHUNK'])
+                    return Response(encode_json_array(chunks), mimetype='application/json')
+                cached = task_list_cache.put(user_email, version, encode_json_body(storage.list_tasks(user_email)))
+            return conditional_json(*cached)
+
+        try:
+            limit, filters = parse_page_args(request.args)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Parámetros de consulta inválidos'}), 400
+
+        tasks, next_key = storage.page_tasks(user_email, limit, **filters)
+        return jsonify({
+            'tasks': tasks,
+            'next_cursor': encode_cursor(next_key) if next_key else None
+        }), 200
     except Exception as e:
         return jsonify({'error': 'Error obteniendo tareas'}), 500
 
+@app.route('/api/tasks/changes', methods=['GET'])
+@login_required
+def get_task_changes():
+    try:
+        user_email = session['user_email']
+        try:
+            since = int(request.args.get('since', 0))
+        except ValueError:
+            return jsonify({'error': 'Parámetros de consulta inválidos'}), 400
+
+        # Si el cliente ya está en la versión actual no hay nada que calcular
+        current = changes_etag(user_email, storage.task_version(user_email))
+        if request.if_none_match.contains(current):
+            return conditional_json(b'', current)
+
+        version, changed, deleted, reset = storage.task_changes(user_email, since)
+        body = encode_json_body({'version': version, 'reset': reset, 'changed': changed, 'deleted': deleted})
+        return conditional_json(body, changes_etag(user_email, version))
+    except Exception as e:
+        return jsonify({'error': 'Error obteniendo cambios'}), 500
+
+@app.route('/api/tasks/search', methods=['GET'])
+@login_required
+def search_tasks():
+    try:
+        user_email = session['user_email']
+        try:
+            query, limit = parse_search_args(request.args)
+        except ValueError:
+            return jsonify({'error': 'Parámetros de consulta inválidos'}), 400
+
+        return jsonify(search_results(storage.search_tasks(user_email, query, limit + 1), limit)), 200
+    except Exception as e:
+        return jsonify({'error': 'Error buscando tareas'}), 500
+
+@app.route('/api/tasks/due', methods=['GET'])
+@login_required
+def get_due_tasks():
+    try:
+        try:
+            overdue, limit = parse_due_args(request.args)
+        except ValueError:
+            return jsonify({'error': 'Parámetros de consulta inválidos'}), 400
+
+        tasks = storage.due_tasks(session['user_email'], time.time(), limit, overdue)
+        return jsonify({'tasks': tasks}), 200
+    except Exception as e:
+        return jsonify({'error': 'Error obteniendo vencimientos'}), 500
+
+@app.before_request
+def start_task_archiver():
+    task_archiver.ensure_running()
+
+@app.route('/api/tasks/archive', methods=['GET'])
+@login_required
+def get_archived_tasks():
+    try:
+        try:
+            limit, after = parse_archive_args(request.args)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Parámetros de consulta inválidos'}), 400
+
+        tasks, next_key = storage.page_archive(session['user_email'], limit, after)
+        return jsonify({
+            'tasks': tasks,
+            'next_cursor': encode_cursor(next_key) if next_key else None
+        }), 200
+    except Exception as e:
+        return jsonify({'error': 'Error obteniendo tareas archivadas'}), 500
+
+def sse_event(event, event_id, data):
+    return f'id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+
+def task_change_stream(user_email, since, heartbeat):
+    """Generador SSE: emite un evento `tasks` por cada grupo de cambios.
+
+    Entre eventos la conexión sólo espera en un threading.Event, sin sondeo
+    propio. Con el servidor WSGI con hilos que arranca `python app.py` cada
+    stream abierto ocupa un hilo del sistema mientras espera; para muchas
+    conexiones inactivas hay que servir con `--asgi` (asgi.py las atiende
+    en el bucle de eventos) o con un worker cooperativo como gunicorn -k
+    gevent. El latido también vuelve a consultar la versión, lo que recoge
+    cambios hechos por otros procesos con almacenamiento compartido.
+    """
+    wakeup = threading.Event()
+    task_events.subscribe(user_email, wakeup.set)
+    try:
+        yield 'retry: 3000\n\n'
+        while True:
+            wakeup.clear()
+            version, changed, deleted, reset = storage.task_changes(user_email, since)
+            if version != since:
+                yield sse_event('tasks', version, {
+                    'version': version,
+                    'reset': reset,
+                    'changed': changed,
+                    'deleted': deleted
+                })
+                since = version
+            if not wakeup.wait(heartbeat):
+                yield ': heartbeat\n\n'
+    finally:
+        task_events.unsubscribe(user_email, wakeup.set)
+
+@app.route('/api/tasks/stream', methods=['GET'])
+@login_required
+def stream_tasks():
+    try:
+        # Last-Event-ID lo envía el navegador al reconectar; tiene prioridad
+        since = int(request.headers.get('Last-Event-ID') or request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'Parámetros de consulta inválidos'}), 400
+
+    return Response(task_change_stream(session['user_email'], since, app.config['SSE_HEARTBEAT']),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/tasks', methods=['POST'])
 @login_required
 def add_task():
@@ -679,39 +4543,139 @@ def add_task():
         if not task_text:
             return jsonify({'error': 'El texto de la tarea no puede estar vacío'}), 400
 
+        try:
+            due_at = parse_due_at(data.get('due_at'))
+            priority = parse_priority(data.get('priority', 0))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         user_email = session['user_email']
-        task_id = int(time.time() * 1000)  # ID único basado en timestamp
+        task = storage.add_task(user_email, new_task(task_text, due_at, priority))
+        task_events.publish(user_email)
 
-        new_task = {
-            'id': task_id,
-            'text': task_text,
-            'completed': False,
-            'created_at': time.time()
-        }
+        return jsonify(task), 201
+
+    except Exception as e:
+        return jsonify({'error': 'Error creando tarea'}), 500
+
+def parse_batch_operation(operation):
+    """Valida y normaliza una operación del lote; lanza ValueError si no es válida"""
+    if not isinstance(operation, dict):
+        raise ValueError('Operación inválida')
+    op = operation.get('op')
+
+    if op == 'create':
+        text = operation.get('text')
+        text = sanitize_input(text).strip() if isinstance(text, str) else ''
+        if not text:
+            raise ValueError('El texto de la tarea no puede estar vacío')
+        return {'op': 'create', 'task': new_task(text, parse_due_at(operation.get('due_at')),
+                                                  parse_priority(operation.get('priority', 0)))}
+
+    if op not in ('toggle', 'delete', 'update'):
+        raise ValueError('Operación desconocida')
+    task_id = operation.get('id')
+    if not isinstance(task_id, int) or isinstance(task_id, bool):
+        raise ValueError('Id de tarea inválido')
+    if op != 'update':
+        return {'op': op, 'id': task_id}
+    return {'op': 'update', 'id': task_id, 'changes': parse_task_changes(operation)}
 
-        if user_email not in tasks_db:
-            tasks_db[user_email] = []
+@app.route('/api/tasks/batch', methods=['POST'])
+@login_required
+def batch_tasks():
+    try:
+        data = request.get_json()
+        operations = data.get('operations') if isinstance(data, dict) else None
+
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'error': 'Se requiere una lista de operaciones'}), 400
 
-        tasks_db[user_email].append(new_task)
+        if len(operations) > app.config['MAX_BATCH_SIZE']:
+            return jsonify({
+                'error': 'Demasiadas operaciones en el lote',
+                'max_batch_size': app.config['MAX_BATCH_SIZE']
+            }), 413
 
-        return jsonify(new_task), 201
+        parsed = []
+        for index, operation in enumerate(operations):
+            try:
+                parsed.append(parse_batch_operation(operation))
+            except ValueError as e:
+                return jsonify({'error': str(e), 'index': index}), 400
+
+        user_email = session['user_email']
+        try:
+            results = storage.apply_batch(user_email, parsed)
+        except BatchError as e:
+            return jsonify({'error': e.message, 'index': e.index}), 409
+        task_events.publish(user_email)
+
+        return jsonify({'results': results}), 200
 
     except Exception as e:
-        return jsonify({'error': 'Error creando tarea'}), 500
+        return jsonify({'error': 'Error aplicando operaciones'}), 500
+
+@app.route('/api/tasks/import', methods=['POST'])
+@login_required
+def import_tasks():
+    try:
+        try:
+            fmt = transfer_format(request.args.get('format'), request.mimetype)
+        except ValueError:
+            return jsonify({'error': 'Formato no soportado, usa NDJSON o CSV'}), 415
+
+        return jsonify(import_task_stream(session['user_email'], request.stream, fmt)), 200
+    except Exception as e:
+        return jsonify({'error': 'Error importando tareas'}), 500
+
+@app.route('/api/tasks/export', methods=['GET'])
+@login_required
+def export_tasks():
+    try:
+        fmt = transfer_format(request.args.get('format', 'ndjson'), None)
+    except ValueError:
+        return jsonify({'error': 'Formato no soportado, usa NDJSON o CSV'}), 400
+
+    chunks = iter_task_chunks(session['user_email'], app.config['STREAM_JSON_CHUNK'])
+    response = Response(encode_export(chunks, fmt), mimetype=TRANSFER_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=tareas.{fmt}'
+    return response
 
 @app.route('/api/tasks/<int:task_id>/toggle', methods=['POST'])
 @login_required
 def toggle_task(task_id):
     try:
         user_email = session['user_email']
-        tasks = tasks_db.get(user_email, [])
+        task = storage.toggle_task(user_email, task_id)
 
-        for task in tasks:
-            if task['id'] == task_id:
-                task['completed'] = not task['completed']
-                return jsonify(task), 200
+        if task is None:
+            return jsonify({'error': 'Tarea no encontrada'}), 404
+
+        task_events.publish(user_email)
+        return jsonify(task), 200
+
+    except Exception as e:
+        return jsonify({'error': 'Error actualizando tarea'}), 500
+
+@app.route('/api/tasks/<int:task_id>', methods=['PATCH'])
+@login_required
+def update_task(task_id):
+    try:
+        data = request.get_json()
+        try:
+            changes = parse_task_changes(data if isinstance(data, dict) else {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        user_email = session['user_email']
+        task = storage.update_task(user_email, task_id, changes)
 
-        return jsonify({'error': 'Tarea no encontrada'}), 404
+        if task is None:
+            return jsonify({'error': 'Tarea no encontrada'}), 404
+
+        task_events.publish(user_email)
+        return jsonify(task), 200
 
     except Exception as e:
         return jsonify({'error': 'Error actualizando tarea'}), 500
@@ -721,21 +4685,87 @@ def toggle_task(task_id):
 def delete_task(task_id):
     try:
         user_email = session['user_email']
-        tasks = tasks_db.get(user_email, [])
-
-        tasks_db[user_email] = [task for task in tasks if task['id'] != task_id]
+        if storage.delete_task(user_email, task_id):
+            task_events.publish(user_email)
 
         return jsonify({'message': 'Tarea eliminada'}), 200
 
     except Exception as e:
         return jsonify({'error': 'Error eliminando tarea'}), 500
 
+def shard_only(f):
+    """Decorator para las rutas internas que usa el router; fuera de un shard no existen"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not app.config['SHARD_NAME']:
+            abort(404)
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.route('/internal/users', methods=['GET'])
+@shard_only
+def list_shard_users():
+    return jsonify({'shard': app.config['SHARD_NAME'], 'users': storage.user_emails()}), 200
+
+@app.route('/internal/users/<path:email>', methods=['GET'])
+@shard_only
+def export_shard_user(email):
+    dump = storage.export_user(email)
+    if dump is None:
+        return jsonify({'error': 'Usuario no encontrado'}), 404
+    dump['archive'] = [base64.b64encode(segment).decode('ascii') for segment in dump['archive']]
+    return jsonify(dump), 200
+
+@app.route('/internal/users/<path:email>', methods=['PUT'])
+@shard_only
+def import_shard_user(email):
+    dump = request.get_json()
+    dump['archive'] = [base64.b64decode(segment) for segment in dump['archive']]
+    if not storage.import_user(email, dump):
+        return jsonify({'error': 'El usuario ya existe en este shard'}), 409
+    task_events.publish(email)
+    return jsonify({'imported': len(dump['tasks'])}), 201
+
+@app.route('/internal/users/<path:email>', methods=['DELETE'])
+@shard_only
+def delete_shard_user(email):
+    if not storage.delete_user(email):
+        return jsonify({'error': 'Usuario no encontrado'}), 404
+    task_events.publish(email)
+    return jsonify({'message': 'Usuario eliminado'}), 200
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_CONTENT)
+    return INDEX_PAGE.response()
+
+@app.route('/assets/<name>')
+def index_asset(name):
+    asset = INDEX_ASSETS.get(name)
+    if asset is None:
+        abort(404)
+    return asset.response()
 
 if __name__ == '__main__':
     # En producción, usar: export SECRET_KEY='tu-clave-super-secreta-aqui'
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('DEBUG', 'False').lower() == 'true'
-    app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
+    if '--asgi' in sys.argv:
+        # Modo asyncio: mismas rutas servidas por handlers async (asgi.py)
+        import asgi
+        asgi.serve('0.0.0.0', port)
+    elif '--shards' in sys.argv:
+        # Router delante de N procesos shard (shards.py)
+        import shards
+        shards.serve('0.0.0.0', port, int(sys.argv[sys.argv.index('--shards') + 1]))
+    elif app.config['SHARD_NAME']:
+        # Proceso shard lanzado por el router
+        import shards
+        shards.serve_shard(os.environ['SHARD_SOCKET'])
+    elif '--workers' in sys.argv:
+        # Precarga y fork: N procesos sirviendo el mismo socket (SQLite para datos y sesiones)
+        serve_workers('0.0.0.0', port, int(sys.argv[sys.argv.index('--workers') + 1]))
+    else:
+        create_app()
+        app.logger.warning('Servidor WSGI con hilos: cada /api/tasks/stream abierto ocupa un hilo; '
+                           'para muchos clientes en tiempo real, arranca con --asgi')
+        app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,870 @@
+"""Modo de servicio asyncio (ASGI) para la API de tareas.
+
+Expone las mismas rutas que app.py con handlers async: las conexiones
+lentas o de larga duración (como el stream SSE) son corrutinas en lugar de
+hilos del servidor WSGI. Comparte con app.py el almacenamiento, las
+sesiones, el pool de PBKDF2 y el broker de eventos.
+
+Uso: python app.py --asgi   (requiere uvicorn)
+"""
+import asyncio
+import functools
+import hmac
+import io
+import json
+import math
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+from werkzeug.http import dump_cookie, parse_cookie
+
+import app as core
+
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class AsyncStorage:
+    """Interfaz async sobre el backend de almacenamiento síncrono.
+
+    Las operaciones puntuales del backend en memoria son microsegundos y se
+    ejecutan directamente en el bucle de eventos; las de SQLite (o de cualquier
+    otro backend que haga E/S) se delegan a un executor para no bloquearlo. Las
+    que recorren todas las tareas del usuario (listado, búsqueda, cambios,
+    lotes, vencimientos, archivo) van siempre al executor, también en memoria.
+    """
+
+    def __init__(self, backend, executor=None):
+        self.backend = backend
+        # JournaledStorage también es un MemoryStorage, pero sus escrituras esperan al fsync
+        self.inline = type(backend) is core.MemoryStorage
+        self.executor = executor
+
+    async def run(self, fn, *args, **kwargs):
+        if self.inline:
+            return fn(*args, **kwargs)
+        return await self.offload(fn, *args, **kwargs)
+
+    async def offload(self, fn, *args, **kwargs):
+        """Ejecuta fn en el executor aunque el backend sea en memoria"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def get_user(self, email):
+        return await self.run(self.backend.get_user, email)
+
+    async def create_user(self, email, user):
+        return await self.run(self.backend.create_user, email, user)
+
+    async def list_tasks(self, user_email):
+        return await self.offload(self.backend.list_tasks, user_email)
+
+    async def count_tasks(self, user_email):
+        return await self.run(self.backend.count_tasks, user_email)
+
+    async def page_tasks(self, user_email, limit, **filters):
+        return await self.offload(self.backend.page_tasks, user_email, limit, **filters)
+
+    async def task_changes(self, user_email, since):
+        return await self.offload(self.backend.task_changes, user_email, since)
+
+    async def task_version(self, user_email):
+        return await self.run(self.backend.task_version, user_email)
+
+    async def search_tasks(self, user_email, query, limit):
+        return await self.offload(self.backend.search_tasks, user_email, query, limit)
+
+    async def due_tasks(self, user_email, now, limit, overdue=False):
+        return await self.offload(self.backend.due_tasks, user_email, now, limit, overdue)
+
+    async def page_archive(self, user_email, limit, after=None):
+        return await self.offload(self.backend.page_archive, user_email, limit, after)
+
+    async def add_task(self, user_email, task):
+        return await self.run(self.backend.add_task, user_email, task)
+
+    async def toggle_task(self, user_email, task_id):
+        return await self.run(self.backend.toggle_task, user_email, task_id)
+
+    async def update_task(self, user_email, task_id, changes):
+        return await self.run(self.backend.update_task, user_email, task_id, changes)
+
+    async def delete_task(self, user_email, task_id):
+        return await self.run(self.backend.delete_task, user_email, task_id)
+
+    async def apply_batch(self, user_email, operations):
+        return await self.offload(self.backend.apply_batch, user_email, operations)
+
+
+core.create_app()
+storage = AsyncStorage(core.storage)
+sessions = core.app.session_interface
+# Las sesiones en memoria se consultan sin salir del bucle, igual que el storage
+sessions_inline = isinstance(sessions.store, core.MemorySessionStore)
+
+
+async def hash_password(password):
+    salt = os.urandom(32)
+    key = await core.password_hasher.submit_async(core._pbkdf2, password, salt)
+    return salt + key
+
+
+async def verify_password(stored_password, provided_password):
+    salt = stored_password[:32]
+    key = await core.password_hasher.submit_async(core._pbkdf2, provided_password, salt)
+    return hmac.compare_digest(key, stored_password[32:])
+
+
+def client_address(scope, headers):
+    """IP del cliente; tras TRUSTED_PROXIES proxies sale de X-Forwarded-For, como con ProxyFix"""
+    address = (scope.get('client') or (None, 0))[0]
+    proxies = core.app.config['TRUSTED_PROXIES']
+    if proxies:
+        forwarded = headers.get('x-forwarded-for', '').split(',')
+        if len(forwarded) >= proxies and forwarded[-proxies].strip():
+            address = forwarded[-proxies].strip()
+    return address
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {name: values[-1] for name, values in
+                     parse_qs(scope['query_string'].decode('latin-1')).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope['headers']}
+        self.client = client_address(scope, self.headers)
+        self.cookies = parse_cookie(self.headers.get('cookie', ''))
+        self.body = body
+        self.session = {}
+        self.session_token = None
+        self.receive = None
+
+    @property
+    def mimetype(self):
+        return self.headers.get('content-type', '').split(';')[0].strip().lower()
+
+    def get_json(self):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+class Response:
+    def __init__(self, body=b'', status=200, content_type='application/json', headers=None, stream=None):
+        self.body = body
+        self.status = status
+        self.headers = [('content-type', content_type)] if content_type else []
+        self.headers.extend((headers or {}).items())
+        self.stream = stream
+        self.on_close = []  # se llaman cuando termina el envío, como call_on_close en werkzeug
+
+    def set_cookie(self, value, expires=None, max_age=None):
+        config = core.app.config
+        cookie = dump_cookie(config['SESSION_COOKIE_NAME'], value, expires=expires, max_age=max_age,
+                             path=config['SESSION_COOKIE_PATH'] or '/',
+                             domain=config['SESSION_COOKIE_DOMAIN'] or None,
+                             secure=config['SESSION_COOKIE_SECURE'],
+                             httponly=config['SESSION_COOKIE_HTTPONLY'],
+                             samesite=config['SESSION_COOKIE_SAMESITE'])
+        self.headers.append(('set-cookie', cookie))
+
+
+def jsonify(data, status=200):
+    return Response(json.dumps(data).encode('utf-8'), status)
+
+
+def conditional_json(request, body, etag):
+    """Igual que core.conditional_json: 304 sin cuerpo si el ETag coincide"""
+    headers = {'cache-control': 'private, no-cache', 'etag': f'"{etag}"'}
+    if f'"{etag}"' in request.headers.get('if-none-match', ''):
+        return Response(status=304, content_type=None, headers=headers)
+    return Response(body, headers=headers)
+
+
+routes = []
+
+
+def route(method, pattern, login=False, streams_body=False):
+    """Registra un handler async; los grupos con nombre del patrón son argumentos.
+
+    Con streams_body el cuerpo no se lee de antemano: el handler lo consume
+    desde request.receive.
+    """
+    def decorator(handler):
+        handler.streams_body = streams_body
+        routes.append((method, re.compile(f'^{pattern}$'), handler, login))
+        return handler
+    return decorator
+
+
+# --- Sesión y autenticación ---
+
+@route('POST', '/api/register')
+async def register(request):
+    try:
+        data = request.get_json() or {}
+        name = core.sanitize_input(data.get('name', ''))
+        email = core.sanitize_input(data.get('email', '')).lower()
+        password = data.get('password', '')
+
+        if not name or not email or not password:
+            return jsonify({'error': 'Todos los campos son obligatorios'}, 400)
+
+        if len(password) < 8:
+            return jsonify({'error': 'La contraseña debe tener al menos 8 caracteres'}, 400)
+
+        if await storage.get_user(email) is not None:
+            return jsonify({'error': 'Este email ya está registrado'}, 400)
+
+        hashed_password = await hash_password(password)
+        created = await storage.create_user(email, {
+            'name': name,
+            'password': hashed_password.hex(),
+            'created_at': time.time()
+        })
+
+        if not created:
+            return jsonify({'error': 'Este email ya está registrado'}, 400)
+
+        return jsonify({'message': 'Usuario registrado exitosamente'}, 201)
+
+    except core.HashPoolBusy:
+        return server_busy()
+    except Exception:
+        return jsonify({'error': 'Error interno del servidor'}, 500)
+
+
+@route('POST', '/api/login')
+async def login(request):
+    try:
+        data = request.get_json() or {}
+        email = core.sanitize_input(data.get('email', '')).lower()
+        password = data.get('password', '')
+
+        if not email or not password:
+            return jsonify({'error': 'Email y contraseña son requeridos'}, 400)
+
+        wait = core.login_retry_after(request.client, email)
+        if wait:
+            return too_many_requests(wait)
+
+        user = await storage.get_user(email)
+        if not user:
+            core.login_failed(request.client)
+            return jsonify({'error': 'Credenciales inválidas'}, 401)
+
+        if not await verify_password(bytes.fromhex(user['password']), password):
+            core.login_failed(request.client)
+            return jsonify({'error': 'Credenciales inválidas'}, 401)
+
+        now = time.time()
+        expires_at = now + core.app.config['PERMANENT_SESSION_LIFETIME']
+        data = {'_permanent': True, 'user_email': email, 'user_name': user['name'], 'login_time': now}
+        # Siempre un token nuevo: uno anterior (quizá plantado por otro) no debe quedar autenticado
+        if request.session_token is not None:
+            await run_session(sessions.delete, request.session_token)
+        token = await run_session(sessions.save, None, data, expires_at)
+
+        response = jsonify({
+            'message': 'Login exitoso',
+            'user': {'name': user['name'], 'email': email}
+        })
+        response.set_cookie(token, expires=expires_at)
+        return response
+
+    except core.HashPoolBusy:
+        return server_busy()
+    except Exception:
+        return jsonify({'error': 'Error interno del servidor'}, 500)
+
+
+@route('POST', '/api/logout')
+async def logout(request):
+    response = jsonify({'message': 'Logout exitoso'})
+    if request.session_token is not None:
+        await run_session(sessions.delete, request.session_token)
+        response.set_cookie('', expires=0, max_age=0)
+    return response
+
+
+@route('GET', '/api/session')
+async def check_session(request):
+    if 'user_email' in request.session:
+        return jsonify({
+            'authenticated': True,
+            'user': {
+                'name': request.session['user_name'],
+                'email': request.session['user_email']
+            }
+        })
+    return jsonify({'authenticated': False}, 401)
+
+
+# --- Tareas ---
+
+@route('GET', '/api/tasks', login=True)
+async def get_tasks(request):
+    try:
+        user_email = request.session['user_email']
+        if not request.args:
+            version = await storage.task_version(user_email)
+            cached = core.task_list_cache.get(user_email, version)
+            if cached is None:
+                if await storage.count_tasks(user_email) > core.app.config['STREAM_JSON_THRESHOLD']:
+                    return Response(stream=stream_task_list(user_email, core.app.config['STREAM_JSON_CHUNK']))
+                body = await storage.offload(core.encode_json_body, await storage.list_tasks(user_email))
+                cached = core.task_list_cache.put(user_email, version, body)
+            return conditional_json(request, *cached)
+
+        try:
+            limit, filters = core.parse_page_args(request.args)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Parámetros de consulta inválidos'}, 400)
+
+        tasks, next_key = await storage.page_tasks(user_email, limit, **filters)
+        return jsonify({
+            'tasks': tasks,
+            'next_cursor': core.encode_cursor(next_key) if next_key else None
+        })
+    except Exception:
+        return jsonify({'error': 'Error obteniendo tareas'}, 500)
+
+
+async def stream_task_list(user_email, chunk_size):
+    """Versión async de core.encode_json_array sobre páginas del storage"""
+    yield b'['
+    separator, after = b'', None
+    while True:
+        tasks, after = await storage.page_tasks(user_email, chunk_size, after=after)
+        if tasks:
+            yield separator + core.encode_json_items(tasks).encode('utf-8')
+            separator = b','
+        if after is None:
+            break
+    yield b']\n'
+
+
+@route('GET', '/api/tasks/changes', login=True)
+async def get_task_changes(request):
+    try:
+        try:
+            since = int(request.args.get('since', 0))
+        except ValueError:
+            return jsonify({'error': 'Parámetros de consulta inválidos'}, 400)
+
+        user_email = request.session['user_email']
+        current = core.changes_etag(user_email, await storage.task_version(user_email))
+        if f'"{current}"' in request.headers.get('if-none-match', ''):
+            return conditional_json(request, b'', current)
+
+        version, changed, deleted, reset = await storage.task_changes(user_email, since)
+        body = json.dumps({'version': version, 'reset': reset, 'changed': changed, 'deleted': deleted})
+        return conditional_json(request, body.encode('utf-8'), core.changes_etag(user_email, version))
+    except Exception:
+        return jsonify({'error': 'Error obteniendo cambios'}, 500)
+
+
+@route('GET', '/api/tasks/search', login=True)
+async def search_tasks(request):
+    try:
+        try:
+            query, limit = core.parse_search_args(request.args)
+        except ValueError:
+            return jsonify({'error': 'Parámetros de consulta inválidos'}, 400)
+
+        tasks = await storage.search_tasks(request.session['user_email'], query, limit + 1)
+        return jsonify(core.search_results(tasks, limit))
+    except Exception:
+        return jsonify({'error': 'Error buscando tareas'}, 500)
+
+
+@route('GET', '/api/tasks/archive', login=True)
+async def get_archived_tasks(request):
+    try:
+        try:
+            limit, after = core.parse_archive_args(request.args)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Parámetros de consulta inválidos'}, 400)
+
+        tasks, next_key = await storage.page_archive(request.session['user_email'], limit, after)
+        return jsonify({
+            'tasks': tasks,
+            'next_cursor': core.encode_cursor(next_key) if next_key else None
+        })
+    except Exception:
+        return jsonify({'error': 'Error obteniendo tareas archivadas'}, 500)
+
+
+@route('GET', '/api/tasks/due', login=True)
+async def get_due_tasks(request):
+    try:
+        try:
+            overdue, limit = core.parse_due_args(request.args)
+        except ValueError:
+            return jsonify({'error': 'Parámetros de consulta inválidos'}, 400)
+
+        tasks = await storage.due_tasks(request.session['user_email'], time.time(), limit, overdue)
+        return jsonify({'tasks': tasks})
+    except Exception:
+        return jsonify({'error': 'Error obteniendo vencimientos'}, 500)
+
+
+@route('GET', '/api/tasks/stream', login=True)
+async def stream_tasks(request):
+    try:
+        since = int(request.headers.get('last-event-id') or request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'Parámetros de consulta inválidos'}, 400)
+
+    return Response(content_type='text/event-stream',
+                    headers={'cache-control': 'no-cache', 'x-accel-buffering': 'no'},
+                    stream=task_change_stream(request.session['user_email'], since))
+
+
+async def task_change_stream(user_email, since):
+    """Versión async de core.task_change_stream: una corrutina por conexión"""
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+
+    def notify():
+        loop.call_soon_threadsafe(wakeup.set)
+
+    core.task_events.subscribe(user_email, notify)
+    try:
+        yield b'retry: 3000\n\n'
+        while True:
+            wakeup.clear()
+            version, changed, deleted, reset = await storage.task_changes(user_email, since)
+            if version != since:
+                yield core.sse_event('tasks', version, {
+                    'version': version,
+                    'reset': reset,
+                    'changed': changed,
+                    'deleted': deleted
+                }).encode('utf-8')
+                since = version
+            try:
+                await asyncio.wait_for(wakeup.wait(), core.app.config['SSE_HEARTBEAT'])
+            except asyncio.TimeoutError:
+                yield b': heartbeat\n\n'
+    finally:
+        core.task_events.unsubscribe(user_email, notify)
+
+
+@route('POST', '/api/tasks', login=True)
+async def add_task(request):
+    try:
+        data = request.get_json() or {}
+        task_text = core.sanitize_input(data.get('text', '')).strip()
+
+        if not task_text:
+            return jsonify({'error': 'El texto de la tarea no puede estar vacío'}, 400)
+
+        try:
+            due_at = core.parse_due_at(data.get('due_at'))
+            priority = core.parse_priority(data.get('priority', 0))
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        user_email = request.session['user_email']
+        task = await storage.add_task(user_email, core.new_task(task_text, due_at, priority))
+        core.task_events.publish(user_email)
+
+        return jsonify(task, 201)
+
+    except Exception:
+        return jsonify({'error': 'Error creando tarea'}, 500)
+
+
+@route('POST', '/api/tasks/batch', login=True)
+async def batch_tasks(request):
+    try:
+        data = request.get_json()
+        operations = data.get('operations') if isinstance(data, dict) else None
+
+        if not isinstance(operations, list) or not operations:
+            return jsonify({'error': 'Se requiere una lista de operaciones'}, 400)
+
+        max_batch_size = core.app.config['MAX_BATCH_SIZE']
+        if len(operations) > max_batch_size:
+            return jsonify({'error': 'Demasiadas operaciones en el lote', 'max_batch_size': max_batch_size}, 413)
+
+        parsed = []
+        for index, operation in enumerate(operations):
+            try:
+                parsed.append(core.parse_batch_operation(operation))
+            except ValueError as e:
+                return jsonify({'error': str(e), 'index': index}, 400)
+
+        user_email = request.session['user_email']
+        try:
+            results = await storage.apply_batch(user_email, parsed)
+        except core.BatchError as e:
+            return jsonify({'error': e.message, 'index': e.index}, 409)
+        core.task_events.publish(user_email)
+
+        return jsonify({'results': results})
+
+    except Exception:
+        return jsonify({'error': 'Error aplicando operaciones'}, 500)
+
+
+class ReceiveStream(io.RawIOBase):
+    """Cuerpo de la petición ASGI como fichero binario bloqueante.
+
+    Se lee desde un hilo del executor: cada lectura espera el siguiente
+    mensaje de `receive` en el bucle de eventos.
+    """
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.pending = b''
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending and not self.finished:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                raise OSError('el cliente se desconectó')
+            self.pending = message.get('body', b'')
+            self.finished = not message.get('more_body')
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+@route('POST', '/api/tasks/import', login=True, streams_body=True)
+async def import_tasks(request):
+    try:
+        try:
+            fmt = core.transfer_format(request.args.get('format'), request.mimetype)
+        except ValueError:
+            return jsonify({'error': 'Formato no soportado, usa NDJSON o CSV'}, 415)
+
+        # El parser es el mismo que el del modo WSGI y es síncrono: corre en
+        # un hilo y va pidiendo el cuerpo al bucle a medida que lo necesita.
+        loop = asyncio.get_running_loop()
+        summary = await loop.run_in_executor(storage.executor, core.import_task_stream,
+                                             request.session['user_email'], ReceiveStream(request.receive, loop), fmt)
+        return jsonify(summary)
+    except Exception:
+        return jsonify({'error': 'Error importando tareas'}, 500)
+
+
+@route('GET', '/api/tasks/export', login=True)
+async def export_tasks(request):
+    try:
+        fmt = core.transfer_format(request.args.get('format', 'ndjson'), None)
+    except ValueError:
+        return jsonify({'error': 'Formato no soportado, usa NDJSON o CSV'}, 400)
+
+    return Response(stream=stream_export(request.session['user_email'], fmt),
+                    content_type=core.TRANSFER_FORMATS[fmt],
+                    headers={'content-disposition': f'attachment; filename=tareas.{fmt}'})
+
+
+async def stream_export(user_email, fmt):
+    """Versión async de core.encode_export sobre páginas del storage"""
+    header = core.export_header(fmt)
+    if header:
+        yield header.encode('utf-8')
+    after = None
+    while True:
+        tasks, after = await storage.page_tasks(user_email, core.app.config['STREAM_JSON_CHUNK'], after=after)
+        if tasks:
+            yield core.encode_export_chunk(tasks, fmt).encode('utf-8')
+        if after is None:
+            break
+
+
+@route('POST', r'/api/tasks/(?P<task_id>\d+)/toggle', login=True)
+async def toggle_task(request, task_id):
+    try:
+        user_email = request.session['user_email']
+        task = await storage.toggle_task(user_email, int(task_id))
+
+        if task is None:
+            return jsonify({'error': 'Tarea no encontrada'}, 404)
+
+        core.task_events.publish(user_email)
+        return jsonify(task)
+
+    except Exception:
+        return jsonify({'error': 'Error actualizando tarea'}, 500)
+
+
+@route('PATCH', r'/api/tasks/(?P<task_id>\d+)', login=True)
+async def update_task(request, task_id):
+    try:
+        data = request.get_json()
+        try:
+            changes = core.parse_task_changes(data if isinstance(data, dict) else {})
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+
+        user_email = request.session['user_email']
+        task = await storage.update_task(user_email, int(task_id), changes)
+
+        if task is None:
+            return jsonify({'error': 'Tarea no encontrada'}, 404)
+
+        core.task_events.publish(user_email)
+        return jsonify(task)
+
+    except Exception:
+        return jsonify({'error': 'Error actualizando tarea'}, 500)
+
+
+@route('DELETE', r'/api/tasks/(?P<task_id>\d+)', login=True)
+async def delete_task(request, task_id):
+    try:
+        user_email = request.session['user_email']
+        if await storage.delete_task(user_email, int(task_id)):
+            core.task_events.publish(user_email)
+
+        return jsonify({'message': 'Tarea eliminada'})
+
+    except Exception:
+        return jsonify({'error': 'Error eliminando tarea'}, 500)
+
+
+# --- Página principal ---
+
+def accepted_encodings(header):
+    """Codificaciones de Accept-Encoding con calidad mayor que cero"""
+    accepted = set()
+    for token in header.split(','):
+        name, _, params = token.strip().partition(';')
+        quality = params.strip()[2:] if params.strip().startswith('q=') else '1'
+        try:
+            if float(quality) > 0:
+                accepted.add(name.strip().lower())
+        except ValueError:
+            pass
+    return accepted
+
+
+def asset_response(request, asset):
+    accepted = accepted_encodings(request.headers.get('accept-encoding', ''))
+    encoding = next((name for name in ('br', 'gzip') if name in accepted and name in asset.variants), 'identity')
+    etag = asset.etag if encoding == 'identity' else f'{asset.etag}-{encoding}'
+    headers = {'cache-control': asset.cache_control, 'vary': 'Accept-Encoding', 'etag': f'"{etag}"'}
+
+    if f'"{etag}"' in request.headers.get('if-none-match', ''):
+        return Response(status=304, content_type=None, headers=headers)
+    if encoding != 'identity':
+        headers['content-encoding'] = encoding
+    content_type = asset.mimetype + ('; charset=utf-8' if asset.mimetype.startswith('text/') else '')
+    return Response(asset.variants[encoding], content_type=content_type, headers=headers)
+
+
+@route('GET', '/metrics')
+async def get_metrics(request):
+    body = core.metrics.render(core.password_hasher_samples() + core.admission_samples()).encode('utf-8')
+    return Response(body, content_type='text/plain; version=0.0.4')
+
+
+@route('GET', '/')
+async def index(request):
+    return asset_response(request, core.INDEX_PAGE)
+
+
+@route('GET', r'/assets/(?P<name>[\w.]+)')
+async def index_asset(request, name):
+    asset = core.INDEX_ASSETS.get(name)
+    if asset is None:
+        return jsonify({'error': 'No encontrado'}, 404)
+    return asset_response(request, asset)
+
+
+# --- Aplicación ASGI ---
+
+def server_busy():
+    response = jsonify({'error': 'Servidor ocupado, inténtalo de nuevo en unos segundos'}, 503)
+    response.headers.append(('retry-after', str(core.app.config['HASH_RETRY_AFTER'])))
+    return response
+
+
+def too_many_requests(wait):
+    response = jsonify({'error': 'Demasiados intentos, inténtalo de nuevo más tarde'}, 429)
+    response.headers.append(('retry-after', str(math.ceil(wait))))
+    return response
+
+
+async def admit(request, handler, login, params):
+    """dispatch() tras pasar por la cola de admisión de su clase de ruta"""
+    queue = core.admission_queue(handler.__name__)
+    if queue is None:
+        return await dispatch(request, handler, login, params)
+    if await queue.acquire_async() is not None:
+        return server_busy()
+    started = time.perf_counter()
+
+    def release():
+        queue.release(time.perf_counter() - started)
+
+    try:
+        response = await dispatch(request, handler, login, params)
+    except BaseException:
+        release()
+        raise
+    # Un cuerpo en streaming sigue ocupando el hueco hasta terminar de enviarse
+    if response.stream is None:
+        release()
+    else:
+        response.on_close.append(release)
+    return response
+
+
+async def run_session(fn, *args):
+    if sessions_inline:
+        return fn(*args)
+    return await storage.run(fn, *args)
+
+
+async def read_body(receive):
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunks.append(message.get('body', b''))
+        size += len(chunks[-1])
+        if size > MAX_BODY_SIZE:
+            raise ValueError('cuerpo demasiado grande')
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def not_found(request):
+    return jsonify({'error': 'No encontrado'}, 404)
+
+
+async def method_not_allowed(request):
+    return jsonify({'error': 'Método no permitido'}, 405)
+
+
+not_found.streams_body = method_not_allowed.streams_body = False
+
+
+def find_route(request):
+    """(handler, requiere login, argumentos) de la ruta que corresponde a la petición"""
+    allowed = False
+    for method, pattern, handler, login in routes:
+        match = pattern.match(request.path)
+        if match is None:
+            continue
+        if method != request.method:
+            allowed = True
+            continue
+        return handler, login, match.groupdict()
+    return (method_not_allowed if allowed else not_found), False, {}
+
+
+async def dispatch(request, handler, login, params):
+    token = request.cookies.get(core.app.config['SESSION_COOKIE_NAME'])
+    if token:
+        data = await run_session(sessions.load, token)
+        if data is not None:
+            request.session, request.session_token = data, token
+    if login and 'user_email' not in request.session:
+        return jsonify({'error': 'No autorizado'}, 401)
+    return await handler(request, **params)
+
+
+async def handle(request, handler, login, params):
+    """admit() registrando las métricas de la petición"""
+    started = core.begin_request(handler.__name__)
+    try:
+        response = await admit(request, handler, login, params)
+    except BaseException:
+        core.end_request(handler.__name__, request.method, 500, started)
+        raise
+    core.end_request(handler.__name__, request.method, response.status, started)
+    return response
+
+
+async def send_stream(response, receive, send):
+    """Envía un cuerpo en streaming hasta que acabe o el cliente se desconecte"""
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    disconnect = asyncio.ensure_future(wait_disconnect())
+    chunks = response.stream.__aiter__()
+    try:
+        while True:
+            chunk = asyncio.ensure_future(chunks.__anext__())
+            await asyncio.wait({chunk, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if not chunk.done():
+                # Cancelar la espera cierra el generador (ejecuta su finally)
+                chunk.cancel()
+                await asyncio.gather(chunk, return_exceptions=True)
+                break
+            try:
+                body = chunk.result()
+            except StopAsyncIteration:
+                break
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnect.cancel()
+        await chunks.aclose()
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    core.task_archiver.ensure_running()
+    request = Request(scope, b'')
+    handler, login, params = find_route(request)
+    if handler.streams_body:
+        request.receive = receive
+        response = await handle(request, handler, login, params)
+    else:
+        try:
+            body = await read_body(receive)
+        except ValueError:
+            response = jsonify({'error': 'Petición demasiado grande'}, 413)
+        else:
+            if body is None:
+                return
+            request.body = body
+            response = await handle(request, handler, login, params)
+
+    headers = [(name.encode('latin-1'), str(value).encode('latin-1')) for name, value in response.headers]
+    try:
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': headers})
+        if response.stream is not None:
+            await send_stream(response, receive, send)
+        else:
+            await send({'type': 'http.response.body', 'body': response.body})
+    finally:
+        for callback in response.on_close:
+            callback()
+
+
+def serve(host, port):
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('El modo asyncio requiere uvicorn: pip install uvicorn')
+    uvicorn.run(application, host=host, port=port, loop='asyncio', log_level='warning')
@@ -0,0 +1,867 @@
+"""Microbenchmarks del gestor de tareas.
+
+Uso: python benchmark.py
+"""
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, render_template_string
+
+import app as app_module
+from app import (HashPoolBusy, JournaledStorage, MemoryStorage, PasswordHasher, SQLiteStorage, TaskIdGenerator,
+                 TaskStore)
+
+app_module.create_app()
+
+SIZES = (10_000, 100_000)
+OPERATIONS = 1_000
+
+
+def make_task(task_id):
+    return {'id': task_id, 'text': f'Tarea {task_id}', 'completed': False, 'created_at': time.time()}
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+# --- Implementación original: lista de dicts por usuario ---
+
+def list_toggle(tasks, ids):
+    for task_id in ids:
+        for task in tasks:
+            if task['id'] == task_id:
+                task['completed'] = not task['completed']
+                break
+
+
+def list_delete(tasks_db, ids):
+    for task_id in ids:
+        tasks_db['u'] = [task for task in tasks_db['u'] if task['id'] != task_id]
+
+
+# --- TaskStore indexado ---
+
+def store_toggle(store, ids):
+    for task_id in ids:
+        store.toggle('u', task_id)
+
+
+def store_delete(store, ids):
+    for task_id in ids:
+        store.delete('u', task_id)
+
+
+def bench_task_store():
+    print('TaskStore vs lista de dicts (%d operaciones)' % OPERATIONS)
+    for size in SIZES:
+        ids = random.sample(range(size), OPERATIONS)
+
+        tasks_db = {'u': [make_task(i) for i in range(size)]}
+        store = TaskStore()
+        for i in range(size):
+            store.add('u', make_task(i))
+
+        results = {
+            'toggle lista': timed(list_toggle, tasks_db['u'], ids),
+            'toggle store': timed(store_toggle, store, ids),
+            'delete lista': timed(list_delete, tasks_db, ids),
+            'delete store': timed(store_delete, store, ids),
+        }
+        for name, elapsed in results.items():
+            print(f'  {size:>7} tareas  {name:<13} {elapsed * 1e6 / OPERATIONS:10.2f} us/op')
+
+
+def login_client(email='bench@example.com', password='benchmark-password'):
+    """Registra un usuario y devuelve un test client con sesión iniciada"""
+    app_module.app.config['SESSION_COOKIE_SECURE'] = False
+    client = app_module.app.test_client()
+    client.post('/api/register', json={'name': 'Bench', 'email': email, 'password': password})
+    client.post('/api/login', json={'email': email, 'password': password})
+    return client
+
+
+def run_request_mix(client, requests):
+    """Alta, consulta, cambio de estado y borrado de tareas; devuelve req/s"""
+    start = time.perf_counter()
+    done = 0
+    while done < requests:
+        task = client.post('/api/tasks', json={'text': 'Tarea de prueba'}).get_json()
+        client.get('/api/tasks')
+        client.post(f"/api/tasks/{task['id']}/toggle")
+        client.delete(f"/api/tasks/{task['id']}")
+        done += 4
+    return done / (time.perf_counter() - start)
+
+
+def bench_storage_backends(requests=4_000):
+    print('Throughput por backend (%d peticiones)' % requests)
+    original = app_module.storage
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'memory': MemoryStorage(),
+            'sqlite': SQLiteStorage(os.path.join(tmp, 'bench.db')),
+        }
+        try:
+            for name, backend in backends.items():
+                app_module.storage = backend
+                client = login_client()
+                print(f'  {name:<7} {run_request_mix(client, requests):10.0f} req/s')
+        finally:
+            app_module.storage = original
+            backends['sqlite'].close()
+
+
+def bench_password_hasher(burst=64, workers=4, max_queue=16):
+    """Ráfaga de logins simultáneos contra un pool acotado de PBKDF2"""
+    print(f'Pool PBKDF2 ({workers} hilos, cola {max_queue}, ráfaga de {burst})')
+    hasher = PasswordHasher(workers, max_queue)
+
+    def attempt(_):
+        try:
+            hasher.submit(app_module._pbkdf2, 'password', b'salt' * 8)
+            return True
+        except HashPoolBusy:
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=burst) as clients:
+        accepted = sum(clients.map(attempt, range(burst)))
+    elapsed = time.perf_counter() - start
+    stats = hasher.stats()
+    jobs = stats['jobs'] or 1
+    print(f'  aceptados {accepted}, rechazados {stats["rejected"]}, total {elapsed:.2f}s')
+    print(f'  espera media {stats["wait_seconds"] / jobs * 1e3:8.2f} ms  (máx {stats["max_wait_seconds"] * 1e3:.2f} ms)')
+    print(f'  cálculo medio {stats["compute_seconds"] / jobs * 1e3:7.2f} ms  (máx {stats["max_compute_seconds"] * 1e3:.2f} ms)')
+
+
+def bench_index_page(requests=2_000):
+    """Página principal: render_template_string por petición frente a la precalculada"""
+    print('GET / (%d peticiones)' % requests)
+    legacy = Flask('legacy')
+    legacy.add_url_rule('/', 'index', lambda: render_template_string(app_module.HTML_CONTENT))
+
+    def rate(client, headers):
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get('/', headers=headers)
+        return requests / (time.perf_counter() - start)
+
+    gzip_only = {'Accept-Encoding': 'gzip'}
+    etag = app_module.app.test_client().get('/', headers=gzip_only).headers['ETag']
+    cases = {
+        'render_template_string': (legacy.test_client(), {}),
+        'precalculada': (app_module.app.test_client(), {}),
+        'precalculada gzip': (app_module.app.test_client(), gzip_only),
+        'If-None-Match (304)': (app_module.app.test_client(), dict(gzip_only, **{'If-None-Match': etag})),
+    }
+    for name, (client, headers) in cases.items():
+        print(f'  {name:<23} {rate(client, headers):10.0f} req/s')
+
+
+def generate_ids(worker_id, threads, per_thread):
+    """Genera ids desde varios hilos; devuelve (ids, segundos)"""
+    generator = TaskIdGenerator(worker_id)
+
+    def run(_):
+        return [generator.next_id() for _ in range(per_thread)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        chunks = list(pool.map(run, range(threads)))
+    elapsed = time.perf_counter() - start
+    return [task_id for chunk in chunks for task_id in chunk], elapsed
+
+
+def bench_task_ids(threads=8, per_thread=100_000, processes=4):
+    """Ids por segundo desde varios hilos y procesos (la unicidad la comprueba tests/test_task_ids.py)"""
+    from multiprocessing import Pool
+
+    print(f'Ids de tarea ({threads} hilos x {per_thread} ids, {processes} procesos)')
+    ids, elapsed = generate_ids(0, threads, per_thread)
+    print(f'  un proceso  {len(ids) / elapsed:12.0f} ids/s')
+
+    with Pool(processes) as pool:
+        results = pool.starmap(generate_ids, [(worker, threads, per_thread) for worker in range(processes)])
+    total = sum(len(chunk) for chunk, _ in results)
+    print(f'  {processes} procesos  {total / max(elapsed for _, elapsed in results):12.0f} ids/s')
+
+
+def mutate_user_tasks(storage, user_email, count):
+    """Crea `count` tareas, las alterna tres veces y borra una de cada tres"""
+    ids = [app_module.new_task_id() for _ in range(count)]
+    for task_id in ids:
+        storage.add_task(user_email, {'id': task_id, 'text': 'x', 'completed': False, 'created_at': time.time()})
+    for _ in range(3):
+        for task_id in ids:
+            storage.toggle_task(user_email, task_id)
+    for task_id in ids[::3]:
+        storage.delete_task(user_email, task_id)
+    return ids
+
+
+def bench_concurrent_storage(per_thread=500):
+    """Throughput de MemoryStorage al crecer el número de hilos (la corrección la comprueba tests/test_storage.py)"""
+    print(f'Concurrencia MemoryStorage ({per_thread} tareas por usuario)')
+    for thread_count in (1, 2, 4, 8, 16):
+        storage = MemoryStorage()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=thread_count) as pool:
+            list(pool.map(lambda n: mutate_user_tasks(storage, f'user{n}@example.com', per_thread),
+                          range(thread_count * 4)))
+        ops = thread_count * 4 * per_thread * (1 + 3) + thread_count * 4 * len(range(0, per_thread, 3))
+        print(f'  {thread_count:>2} hilos {ops / (time.perf_counter() - start):12.0f} ops/s')
+
+
+async def http_request(port, method, path, body=None, cookie=None):
+    """Petición HTTP/1.1 mínima; devuelve (status, cabeceras, cuerpo)"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    lines = [f'{method} {path} HTTP/1.1', 'Host: localhost', 'Connection: close',
+             f'Content-Length: {len(payload)}', 'Content-Type: application/json']
+    if cookie:
+        lines.append(f'Cookie: {cookie}')
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in header_lines)
+    return int(status_line.split()[1]), {k.lower(): v for k, v in headers.items()}, content
+
+
+async def open_idle_stream(port, cookie):
+    """Abre una conexión SSE y espera sus cabeceras; la deja abierta"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET /api/tasks/stream HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n\r\n'.encode())
+    await writer.drain()
+    await reader.readuntil(b'\r\n\r\n')
+    return writer
+
+
+async def measure_mode(port, idle_connections, requests, concurrency):
+    await http_request(port, 'POST', '/api/register',
+                       {'name': 'Bench', 'email': 'bench@example.com', 'password': 'benchmark-password'})
+    _, headers, _ = await http_request(port, 'POST', '/api/login',
+                                       {'email': 'bench@example.com', 'password': 'benchmark-password'})
+    cookie = headers['set-cookie'].split(';')[0]
+
+    opened = []
+    for _ in range(idle_connections):
+        try:
+            opened.append(await asyncio.wait_for(open_idle_stream(port, cookie), 2))
+        except (asyncio.TimeoutError, OSError):
+            break
+
+    latencies = []
+
+    async def client(count):
+        for _ in range(count):
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(http_request(port, 'GET', '/api/tasks', cookie=cookie), 10)
+                latencies.append(time.perf_counter() - start)
+            except (asyncio.TimeoutError, OSError):
+                latencies.append(float('inf'))
+
+    await asyncio.gather(*(client(requests // concurrency) for _ in range(concurrency)))
+    for writer in opened:
+        writer.close()
+    latencies.sort()
+    return len(opened), latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def bench_serving_modes(idle_connections=500, requests=2_000, concurrency=50, port=5123):
+    """WSGI con hilos frente a asyncio: conexiones SSE abiertas y latencia p99"""
+    print(f'Modos de servicio ({idle_connections} streams inactivos, {requests} GET /api/tasks, '
+          f'concurrencia {concurrency})')
+    for mode, flags in (('wsgi', []), ('asyncio', ['--asgi'])):
+        if flags:
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                print(f'  {mode:<8} omitido: falta uvicorn')
+                continue
+        server = subprocess.Popen([sys.executable, 'app.py', *flags],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  env=dict(os.environ, PORT=str(port)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            time.sleep(2)
+            opened, p50, p99 = asyncio.run(measure_mode(port, idle_connections, requests, concurrency))
+            print(f'  {mode:<8} {opened:>5} streams abiertos  p50 {p50 * 1e3:8.2f} ms  p99 {p99 * 1e3:8.2f} ms')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def measure_list_rss(tasks, streamed):
+    """Pico de RSS (KB) que añade un GET /api/tasks con `tasks` tareas"""
+    import resource
+
+    app_module.app.config['STREAM_JSON_THRESHOLD'] = 0 if streamed else tasks + 1
+    client = login_client()
+    for i in range(tasks):
+        app_module.storage.add_task('bench@example.com', app_module.new_task(f'Tarea de prueba número {i}'))
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    response = client.get('/api/tasks', buffered=False)
+    first_byte = None
+    size = 0
+    for chunk in response.response:
+        if first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    response.close()
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return after - before, first_byte, size
+
+
+def traced_size(build):
+    """Bytes que siguen reservados tras construir el objeto que devuelve `build`"""
+    tracemalloc.start()
+    obj = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+def build_task_dicts(tasks):
+    """Representación anterior: un dict por tarea, indexado por id"""
+    created_at = time.time()
+    return {'u': {i: {'id': i, 'text': f'Tarea {i % 1000}', 'completed': i % 2 == 0, 'created_at': created_at + i}
+                  for i in range(tasks)}}
+
+
+def build_task_columns(tasks):
+    created_at = time.time()
+    store = TaskStore()
+    for i in range(tasks):
+        store.add('u', {'id': i, 'text': f'Tarea {i % 1000}', 'completed': i % 2 == 0, 'created_at': created_at + i})
+    return store
+
+
+def bench_task_memory(tasks=1_000_000):
+    """Memoria de las tareas en dicts frente a las columnas de TaskStore"""
+    print(f'Memoria de {tasks} tareas (tracemalloc)')
+    for name, build in (('dicts', build_task_dicts), ('columnas', build_task_columns)):
+        size = traced_size(lambda: build(tasks))
+        print(f'  {name:<9} {size / 2**20:8.1f} MB  {size / tasks:6.1f} B/tarea')
+
+
+SEARCH_WORDS = ('comprar', 'llamar', 'revisar', 'médico', 'reunión', 'informe', 'factura', 'jardín',
+                'cocina', 'correo', 'presupuesto', 'viaje', 'cumpleaños', 'banco', 'coche', 'niños')
+SEARCH_QUERIES = ('medico', 'reunion informe', 'presu', 'cumpleanos banco coche', 'tarea12345')
+
+
+def search_text(i, rng):
+    return ' '.join(rng.sample(SEARCH_WORDS, 3)) + f' tarea{i}'
+
+
+def linear_search(tasks, query):
+    """Lo que había que hacer sin índice: recorrer todas las tareas"""
+    terms = app_module.search_terms(query)
+    return [task for task in tasks
+            if all(any(word.startswith(term) for word in app_module.search_terms(task['text'])) for term in terms)]
+
+
+def bench_search(tasks=100_000, repeat=20):
+    """Latencia de /api/tasks/search por backend frente a un filtrado lineal"""
+    print(f'Búsqueda en {tasks} tareas (mediana de {repeat} consultas, us)')
+    rng = random.Random(0)
+    texts = [search_text(i, rng) for i in range(tasks)]
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {'memory': MemoryStorage(), 'sqlite': SQLiteStorage(os.path.join(tmp, 'search.db'))}
+        start = time.perf_counter()
+        backends['memory'].apply_batch('u', [{'op': 'create', 'task': make_task(i) | {'text': text}}
+                                             for i, text in enumerate(texts)])
+        print(f'  alta indexada memory {(time.perf_counter() - start) * 1e6 / tasks:8.2f} us/tarea')
+        start = time.perf_counter()
+        backends['sqlite'].apply_batch('u', [{'op': 'create', 'task': make_task(i) | {'text': text}}
+                                             for i, text in enumerate(texts)])
+        print(f'  alta indexada sqlite {(time.perf_counter() - start) * 1e6 / tasks:8.2f} us/tarea')
+        listed = backends['memory'].list_tasks('u')
+
+        print(f'  {"consulta":<24} {"memory":>10} {"sqlite":>10} {"lineal":>10}')
+        for query in SEARCH_QUERIES:
+            row = []
+            for backend in backends.values():
+                timings = sorted(timed(backend.search_tasks, 'u', query, 50) for _ in range(repeat))
+                row.append(timings[repeat // 2])
+            row.append(timed(linear_search, listed, query))
+            print(f'  {query:<24} ' + ' '.join(f'{elapsed * 1e6:10.0f}' for elapsed in row))
+        backends['sqlite'].close()
+
+
+def scan_due(tasks, now, limit, overdue):
+    """Lo que había que hacer sin índice: filtrar y ordenar todas las tareas"""
+    due = sorted((task for task in tasks if task['due_at'] is not None and not task['completed']
+                  and (task['due_at'] < now) == overdue),
+                 key=lambda task: (task['due_at'], -task['priority'], task['id']))
+    return due[:limit]
+
+
+def bench_due_tasks(tasks=100_000, repeat=20, updates=2_000):
+    """Próximas y vencidas por backend frente a filtrar y ordenar la lista"""
+    print(f'Vencimientos en {tasks} tareas (mediana de {repeat} consultas, us)')
+    rng = random.Random(0)
+    now = time.time()
+    operations = [{'op': 'create', 'task': make_task(i) | {
+        'due_at': now + rng.uniform(-30, 30) * 86400 if rng.random() < 0.7 else None,
+        'priority': rng.randint(0, app_module.MAX_TASK_PRIORITY),
+        'completed': rng.random() < 0.3}} for i in range(tasks)]
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {'memory': MemoryStorage(), 'sqlite': SQLiteStorage(os.path.join(tmp, 'due.db'))}
+        for backend in backends.values():
+            backend.apply_batch('u', operations)
+        listed = backends['memory'].list_tasks('u')
+        print(f'  construir el índice memory  {timed(backends["memory"].due_tasks, "u", now, 1) * 1e3:8.1f} ms')
+
+        print(f'  {"consulta":<22} {"memory":>10} {"sqlite":>10} {"lineal":>10}')
+        for name, overdue in (('próximas 20', False), ('vencidas 20', True)):
+            row = []
+            for backend in backends.values():
+                timings = sorted(timed(backend.due_tasks, 'u', now, 20, overdue) for _ in range(repeat))
+                row.append(timings[repeat // 2])
+            row.append(timed(scan_due, listed, now, 20, overdue))
+            print(f'  {name:<22} ' + ' '.join(f'{elapsed * 1e6:10.0f}' for elapsed in row))
+
+        ids = [operation['task']['id'] for operation in operations]
+        for name, backend in backends.items():
+            elapsed = timed(lambda: [backend.update_task('u', rng.choice(ids), {'due_at': now + rng.uniform(-30, 30) * 86400})
+                                     for _ in range(updates)])
+            print(f'  cambio de fecha {name:<7} {elapsed * 1e6 / updates:10.1f} us/operación')
+        backends['sqlite'].close()
+
+
+def bench_archive(tasks=100_000, completed=0.8, page=50):
+    """Archivado de completadas: coste de la pasada, compresión y lista activa antes y después"""
+    print(f'Archivado de {int(tasks * completed)} completadas de {tasks} tareas')
+    now = time.time()
+    operations = [{'op': 'create', 'task': make_task(i) | {'completed': i < tasks * completed,
+                                                           'completed_at': now - 86400 if i < tasks * completed else None}}
+                  for i in range(tasks)]
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {'memory': MemoryStorage(), 'sqlite': SQLiteStorage(os.path.join(tmp, 'archive.db'))}
+        for name, backend in backends.items():
+            backend.apply_batch('u', operations)
+            listed_before = timed(backend.list_tasks, 'u')
+            metrics_before = app_module.metrics.snapshot()
+            elapsed = timed(app_module.TaskArchiver(backend, 3600, batch=app_module.app.config['ARCHIVE_BATCH']).run_once, now)
+            totals = app_module.metrics.snapshot()
+            raw, stored = (totals[('archive_bytes_total', (('encoding', encoding),))][0]
+                           - metrics_before.get(('archive_bytes_total', (('encoding', encoding),)), [0])[0]
+                           for encoding in ('json', 'zlib'))
+            print(f'  {name:<7} pasada {elapsed:6.2f} s  {tasks * completed / elapsed:8.0f} tareas/s  '
+                  f'{raw / 1e6:5.1f} MB -> {stored / 1e6:4.1f} MB ({raw / stored:.1f}x)')
+            print(f'          list_tasks {listed_before * 1e3:7.1f} ms -> {timed(backend.list_tasks, "u") * 1e3:6.1f} ms')
+            first = timed(backend.page_archive, 'u', page)
+            last_segment = int(tasks * completed) // app_module.app.config['ARCHIVE_BATCH'] - 1
+            deep = timed(backend.page_archive, 'u', page, (last_segment, 500))
+            print(f'          página del archivo {first * 1e3:6.2f} ms (primera)  {deep * 1e3:6.2f} ms (última)')
+        backends['sqlite'].close()
+
+
+def record_requests(count):
+    """Lo que hace la instrumentación en cada petición, sin la petición"""
+    for _ in range(count):
+        started = app_module.begin_request('get_tasks')
+        app_module.end_request('get_tasks', 'GET', 200, started)
+
+
+def metrics_hooks():
+    flask_app = app_module.app
+    return [(flask_app.before_request_funcs[None], app_module.start_request_metrics),
+            (flask_app.after_request_funcs[None], app_module.record_response_status),
+            (flask_app.teardown_request_funcs[None], app_module.finish_request_metrics)]
+
+
+def bench_metrics_overhead(requests=20_000, threads=8):
+    """Coste por petición de los hooks de métricas"""
+    print(f'Sobrecoste de las métricas ({requests} peticiones)')
+    elapsed = timed(record_requests, requests)
+    print(f'  registro aislado, 1 hilo     {elapsed * 1e6 / requests:6.2f} us/petición')
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(record_requests, [requests // threads] * threads))
+        elapsed = time.perf_counter() - start
+    print(f'  registro aislado, {threads} hilos    {elapsed * 1e6 / requests:6.2f} us/petición')
+
+    client = app_module.app.test_client()
+    client.get('/api/session')
+    with_metrics = timed(lambda: [client.get('/api/session') for _ in range(requests)])
+    for hooks, hook in metrics_hooks():
+        hooks.remove(hook)
+    try:
+        without_metrics = timed(lambda: [client.get('/api/session') for _ in range(requests)])
+    finally:
+        for hooks, hook in metrics_hooks():
+            hooks.append(hook)
+    print(f'  GET /api/session con hooks   {with_metrics * 1e6 / requests:6.2f} us/petición')
+    print(f'  GET /api/session sin hooks   {without_metrics * 1e6 / requests:6.2f} us/petición')
+
+
+def journal_writes(storage, user_email, count):
+    for _ in range(count):
+        storage.add_task(user_email, make_task(app_module.new_task_id()))
+
+
+def bench_journal(writes=2_000, tasks=1_000_000, batch=1_000):
+    """Escrituras con group commit y tiempo de recuperación del diario"""
+    print(f'JournaledStorage: escrituras con fsync ({writes} por prueba)')
+    with tempfile.TemporaryDirectory() as tmp:
+        for threads in (1, 4, 16, 64):
+            storage = JournaledStorage(os.path.join(tmp, f'w{threads}'), snapshot_every=10**9)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(lambda n: journal_writes(storage, f'user{n}@example.com', writes // threads),
+                              range(threads)))
+            print(f'  {threads:>2} hilos {writes / (time.perf_counter() - start):10.0f} escrituras/s')
+            storage.close()
+
+        print(f'Recuperación con {tasks} tareas')
+        directory = os.path.join(tmp, 'recovery')
+        storage = JournaledStorage(directory, snapshot_every=10**9, fsync=False)
+        for start in range(0, tasks, batch):
+            storage.apply_batch('u', [{'op': 'create', 'task': make_task(i)} for i in range(start, start + batch)])
+        storage.close()
+        start = time.perf_counter()
+        storage = JournaledStorage(directory, snapshot_every=10**9)
+        print(f'  sólo diario          {time.perf_counter() - start:8.2f} s')
+        storage.snapshot()
+        storage.close()
+        start = time.perf_counter()
+        storage = JournaledStorage(directory, snapshot_every=10**9)
+        print(f'  snapshot (mmap)      {time.perf_counter() - start:8.2f} s')
+        assert storage.count_tasks('u') == tasks
+        start = time.perf_counter()
+        storage.snapshot()
+        print(f'  escribir snapshot    {time.perf_counter() - start:8.2f} s')
+        storage.close()
+
+
+def bulk_body(rows, fmt):
+    if fmt == 'csv':
+        return io.BytesIO(b'text,completed\n' + b''.join(b'Tarea importada %d,false\n' % i for i in range(rows)))
+    return io.BytesIO(b''.join(b'{"text": "Tarea importada %d"}\n' % i for i in range(rows)))
+
+
+def bench_bulk_transfer(rows=200_000):
+    """Importación y exportación masivas: filas/s y memoria transitoria"""
+    print(f'Importación/exportación de {rows} tareas')
+    for fmt in ('ndjson', 'csv'):
+        client = login_client(f'bulk-{fmt}@example.com')
+        body = bulk_body(rows, fmt)
+        tracemalloc.start()
+        start = time.perf_counter()
+        summary = client.post(f'/api/tasks/import?format={fmt}', data=body).get_json()
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'  importar {fmt:<6} {summary["imported"] / elapsed:10.0f} filas/s  '
+              f'pico transitorio {(peak - current) / 2**20:6.1f} MB')
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        response = client.get(f'/api/tasks/export?format={fmt}', buffered=False)
+        size = sum(len(chunk) for chunk in response.response)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'  exportar {fmt:<6} {rows / elapsed:10.0f} filas/s  {size / 2**20:6.1f} MB enviados, pico {peak / 2**20:5.1f} MB')
+
+
+def history_body(rows, rng):
+    """CSV con fechas de creación antiguas y desordenadas, como una exportación de otra herramienta"""
+    return io.BytesIO(b'text,created_at\n' + b''.join(b'Tarea antigua %d,%f\n' % (i, rng.uniform(1e9, 1.7e9))
+                                                      for i in range(rows)))
+
+
+def bench_import_history(sizes=(2_000, 32_000)):
+    """Importar filas con created_at históricos: filas/s y coste por fila según el tamaño"""
+    print(f'Importación con fechas históricas ({" y ".join(map(str, sizes))} filas)')
+    rng = random.Random(7)
+    original = app_module.storage
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'memory': MemoryStorage(),
+            'journal': JournaledStorage(os.path.join(tmp, 'diario'), fsync=False),
+        }
+        try:
+            for name, backend in backends.items():
+                app_module.storage = backend
+                per_row = []
+                for rows in sizes:
+                    client = login_client(f'historia-{rows}@example.com')
+                    body = history_body(rows, rng)
+                    start = time.perf_counter()
+                    summary = client.post('/api/tasks/import?format=csv', data=body).get_json()
+                    elapsed = time.perf_counter() - start
+                    per_row.append(elapsed / summary['imported'])
+                    print(f'  {name:<7} {rows:>7} filas {elapsed:8.3f} s  {summary["imported"] / elapsed:10.0f} filas/s')
+                # Lineal da ~1; insertar fila a fila (cuadrático) da del orden de sizes[-1] / sizes[0]
+                print(f'  {name:<7} coste por fila {per_row[-1] / per_row[0]:.1f}x')
+        finally:
+            app_module.storage = original
+            backends['journal'].close()
+
+
+def bench_task_list_cache(tasks=1_000, requests=2_000):
+    """GET /api/tasks repetido: sin caché, con caché y con If-None-Match"""
+    print(f'GET /api/tasks con {tasks} tareas ({requests} peticiones)')
+    client = login_client('cache@example.com')
+    for start in range(0, tasks, 500):
+        client.post('/api/tasks/batch', json={'operations': [
+            {'op': 'create', 'text': f'Tarea {i}'} for i in range(start, min(start + 500, tasks))
+        ]})
+    etag = client.get('/api/tasks').headers['ETag']
+    cache = app_module.task_list_cache
+
+    def get_all(headers=None):
+        for _ in range(requests):
+            client.get('/api/tasks', headers=headers)
+
+    size = cache.max_bytes
+    cache.max_bytes = 0  # ninguna lista cabe: se serializa en cada petición
+    cache.invalidate('cache@example.com')
+    try:
+        uncached = timed(get_all)
+    finally:
+        cache.max_bytes = size
+    cached = timed(get_all)
+    revalidated = timed(get_all, {'If-None-Match': etag})
+    for name, elapsed in (('sin caché', uncached), ('con caché', cached), ('304', revalidated)):
+        print(f'  {name:<10} {requests / elapsed:10.0f} req/s')
+
+
+def bench_streaming_json(tasks=200_000):
+    """Pico de RSS y tiempo hasta el primer byte: jsonify frente a streaming"""
+    import multiprocessing
+
+    print(f'GET /api/tasks con {tasks} tareas')
+    # Cada caso en un proceso nuevo para que el pico de RSS no se contamine
+    with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+        for name, streamed in (('jsonify', False), ('streaming', True)):
+            rss_kb, first_byte, size = pool.apply(measure_list_rss, (tasks, streamed))
+            print(f'  {name:<10} +{rss_kb / 1024:8.1f} MB RSS  primer byte {first_byte * 1e3:8.1f} ms  '
+                  f'{size / 1e6:.1f} MB enviados')
+
+
+def bench_admission(writers=32, duration=3.0, probes=200):
+    """Latencia de /api/session mientras `writers` hilos saturan las escrituras"""
+    print(f'Control de admisión ({writers} hilos con lotes de escritura, {probes} GET /api/session)')
+    client = login_client('admission@example.com')
+    cookie = client.get_cookie(app_module.app.config['SESSION_COOKIE_NAME'])
+    batch = {'operations': [{'op': 'create', 'text': f'Tarea {i}'} for i in range(200)]}
+    queue = app_module.admission_queues['write']
+    original = queue.limit
+
+    def writer(deadline, statuses):
+        writer_client = app_module.app.test_client()
+        writer_client.set_cookie(cookie.key, cookie.value)
+        while time.perf_counter() < deadline:
+            statuses.append(writer_client.post('/api/tasks/batch', json=batch).status_code)
+
+    for name, limit in (('sin límite', 10_000), ('limitado', 2)):
+        queue.limit = limit
+        statuses, latencies = [], []
+        deadline = time.perf_counter() + duration
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            for _ in range(writers):
+                pool.submit(writer, deadline, statuses)
+            time.sleep(0.2)
+            for _ in range(probes):
+                start = time.perf_counter()
+                client.get('/api/session')
+                latencies.append(time.perf_counter() - start)
+                time.sleep(duration / probes / 2)
+        latencies.sort()
+        print(f'  {name:<10} sesión p50 {latencies[len(latencies) // 2] * 1e3:7.2f} ms  '
+              f'p99 {latencies[int(len(latencies) * 0.99)] * 1e3:7.2f} ms  '
+              f'lotes {statuses.count(200):5}  rechazados {statuses.count(503):5}')
+    queue.limit = original
+
+
+def shard_client_load(port, cookies, seconds):
+    """Proceso cliente: búsquedas, páginas y altas sobre sus usuarios; devuelve peticiones hechas"""
+    import http.client
+
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    rng = random.Random(port)
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        cookie = rng.choice(cookies)
+        roll = rng.random()
+        if roll < 0.5:
+            method, path, body = 'GET', f'/api/tasks/search?q=tarea+{rng.randrange(200)}', None
+        elif roll < 0.8:
+            method, path, body = 'GET', '/api/tasks?limit=50', None
+        else:
+            method, path, body = 'POST', '/api/tasks', json.dumps({'text': 'Tarea de carga'})
+        conn.request(method, path, body, {'Cookie': cookie, 'Content-Type': 'application/json'})
+        conn.getresponse().read()
+        done += 1
+    conn.close()
+    return done
+
+
+def bench_sharding(shard_counts=(0, 1, 2, 4), users=32, tasks=200, clients=8, seconds=5, port=5140):
+    """Throughput del router con 1..N shards (python app.py --shards N); 0 es app.py sin router"""
+    import http.client
+    import multiprocessing
+
+    print(f'Shards ({users} usuarios con {tasks} tareas, {clients} procesos cliente, '
+          f'{os.cpu_count()} CPUs)')
+
+    def call(method, path, body=None, cookie=None):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        headers = {'Content-Type': 'application/json', **({'Cookie': cookie} if cookie else {})}
+        conn.request(method, path, json.dumps(body), headers)
+        response = conn.getresponse()
+        response.read()
+        conn.close()
+        return response
+
+    for count in shard_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            flags = ['--shards', str(count)] if count else []
+            server = subprocess.Popen([sys.executable, 'app.py', *flags],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)),
+                                      env=dict(os.environ, PORT=str(port), SHARD_DIR=os.path.join(tmp, 'shards'),
+                                               LOGIN_RATE_LIMIT='false'),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                for _ in range(300):
+                    try:
+                        call('GET', '/api/session')
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+                cookies = []
+                for user in range(users):
+                    email = f'shard{user}@example.com'
+                    call('POST', '/api/register', {'name': 'Bench', 'email': email, 'password': 'benchmark-password'})
+                    login = call('POST', '/api/login', {'email': email, 'password': 'benchmark-password'})
+                    cookies.append(login.getheader('Set-Cookie').split(';')[0])
+                    call('POST', '/api/tasks/batch', {'operations': [
+                        {'op': 'create', 'text': f'Tarea {i}'} for i in range(tasks)
+                    ]}, cookies[-1])
+                with multiprocessing.get_context('spawn').Pool(clients) as pool:
+                    done = sum(pool.starmap(shard_client_load,
+                                            [(port, cookies[i::clients], seconds) for i in range(clients)]))
+                name = f'{count} shards' if count else 'sin router'
+                print(f'  {name:<10} {done / seconds:10.0f} req/s')
+            finally:
+                server.terminate()
+                server.wait()
+
+
+def process_memory(pid):
+    """(RSS, PSS) en MB; PSS reparte las páginas compartidas entre quienes las usan"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                values[key] = int(rest.split()[0]) / 1024
+    return values['Rss'], values['Pss']
+
+
+def bench_startup(workers=4, repeat=5, requests=200, port=5150):
+    """Import, create_app(), primera petición y memoria por worker: preload + fork frente a procesos sueltos"""
+    import http.client
+    import statistics
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = ('import time; t = time.perf_counter(); import app; t1 = time.perf_counter(); '
+             'app.create_app(); print(t1 - t, time.perf_counter() - t1)')
+    samples = [subprocess.run([sys.executable, '-c', probe], cwd=here, capture_output=True, text=True,
+                              env=dict(os.environ, STORAGE_BACKEND='memory')).stdout.split()
+               for _ in range(repeat)]
+    print(f'Arranque ({workers} workers, {os.cpu_count()} CPUs)')
+    print(f'  import app       {statistics.median(float(s[0]) for s in samples) * 1000:8.1f} ms')
+    print(f'  create_app()     {statistics.median(float(s[1]) for s in samples) * 1000:8.1f} ms')
+
+    def get(port_, path):
+        conn = http.client.HTTPConnection('127.0.0.1', port_, timeout=10)
+        conn.request('GET', path)
+        conn.getresponse().read()
+        conn.close()
+
+    def wait_ready(port_, started):
+        while True:
+            try:
+                get(port_, '/')
+                return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.005)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, STORAGE_BACKEND='sqlite', SESSION_BACKEND='sqlite',
+                   SQLITE_PATH=os.path.join(tmp, 'tareas.db'), SESSION_SQLITE_PATH=os.path.join(tmp, 'sesiones.db'))
+        layouts = {
+            'preload + fork': [[sys.executable, 'app.py', '--workers', str(workers)]],
+            'procesos sueltos': [[sys.executable, 'app.py']] * workers,
+        }
+        for name, commands in layouts.items():
+            started = time.perf_counter()
+            servers = [subprocess.Popen(command, cwd=here, env=dict(env, PORT=str(port + i)),
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                       for i, command in enumerate(commands)]
+            try:
+                ports = [port + i for i in range(len(servers))]
+                first = max(wait_ready(p, started) for p in ports)
+                for i in range(requests):
+                    get(ports[i % len(ports)], '/api/session')
+                if len(servers) == 1:
+                    with open(f'/proc/{servers[0].pid}/task/{servers[0].pid}/children') as f:
+                        pids = [int(pid) for pid in f.read().split()]
+                else:
+                    pids = [server.pid for server in servers]
+                memory = [process_memory(pid) for pid in pids]
+                rss = sum(m[0] for m in memory) / len(memory)
+                pss = sum(m[1] for m in memory) / len(memory)
+                print(f'  {name:<16} primera petición {first * 1000:7.1f} ms   '
+                      f'RSS {rss:6.1f} MB   PSS {pss:6.1f} MB por worker')
+            finally:
+                for server in servers:
+                    server.terminate()
+                    server.wait()
+
+
+if __name__ == '__main__':
+    bench_task_store()
+    bench_storage_backends()
+    bench_password_hasher()
+    bench_index_page()
+    bench_task_ids()
+    bench_concurrent_storage()
+    bench_task_memory()
+    bench_search()
+    bench_due_tasks()
+    bench_archive()
+    bench_metrics_overhead()
+    bench_journal()
+    bench_bulk_transfer()
+    bench_import_history()
+    bench_serving_modes()
+    bench_task_list_cache()
+    bench_streaming_json()
+    bench_admission()
+    bench_sharding()
+    bench_startup()
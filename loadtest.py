@@ -0,0 +1,380 @@
+"""Pruebas de carga reproducibles de la API de tareas.
+
+Siembra usuarios y tareas, lanza contra todas las rutas una mezcla de
+peticiones parecida al uso real y escribe en JSON el throughput y las
+latencias p50/p95/p99 de cada ruta. El modo compare contrasta un resultado
+con una línea base guardada y falla si alguna ruta empeora.
+
+Uso:
+    python loadtest.py run [--target client|wsgi|asgi|http://host:puerto]
+                           [--users 16] [--tasks 1000] [--requests 20000]
+                           [--concurrency 8] [--seed 1] [--out resultado.json]
+    python loadtest.py compare base.json resultado.json [--threshold 0.10]
+
+Con --target client las peticiones pasan por el test client de Flask en
+este mismo proceso; wsgi y asgi arrancan `python app.py` (o `--asgi`) en un
+puerto local, y una URL apunta a un servidor ya en marcha.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+import app as app_module
+
+PASSWORD = 'loadtest-password'
+
+WORDS = ('comprar', 'llamar', 'revisar', 'médico', 'reunión', 'informe', 'factura', 'jardín',
+         'cocina', 'correo', 'presupuesto', 'viaje', 'cumpleaños', 'banco', 'coche', 'niños')
+
+# Peso de cada operación en la mezcla: sobre todo lecturas y cambios
+# pequeños, y de vez en cuando las rutas caras (PBKDF2, listado completo).
+MIX = {
+    'list_page': 25,
+    'changes': 15,
+    'session': 8,
+    'create': 12,
+    'toggle': 12,
+    'search': 8,
+    'delete': 5,
+    'batch': 3,
+    'list_all': 3,
+    'index': 3,
+    'stream': 2,
+    'metrics': 1,
+    'login': 1,
+    'register': 1,
+}
+
+
+class ClientDriver:
+    """Peticiones a través del test client de Flask, sin red"""
+
+    def __init__(self):
+        self.client = app_module.app.test_client()
+
+    def request(self, method, path, body=None, first_chunk=False):
+        response = self.client.open(path, method=method, json=body, buffered=not first_chunk)
+        if first_chunk:
+            data = next(iter(response.response), b'')
+            response.close()
+        else:
+            data = response.get_data()
+        return response.status_code, data
+
+
+class HTTPDriver:
+    """Peticiones HTTP/1.1 sobre una conexión persistente, con su propia cookie"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        self.cookie = None
+
+    def request(self, method, path, body=None, first_chunk=False):
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+
+        # El stream SSE no termina: va por su propia conexión y se corta
+        # tras el primer evento.
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30) if first_chunk else self.conn
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            data = response.read1(65536) if first_chunk else response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            raise
+        finally:
+            if first_chunk:
+                conn.close()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';')[0]
+        return response.status, data
+
+
+class LoadSession:
+    """Un usuario con sesión iniciada que ejecuta operaciones de la mezcla"""
+
+    def __init__(self, driver, email, rng):
+        self.driver = driver
+        self.email = email
+        self.rng = rng
+        self.task_ids = []
+        self.version = 0
+        self.samples = []
+
+    def call(self, name, method, path, body=None, first_chunk=False):
+        """Hace la petición y guarda (operación, estado, segundos)"""
+        start = time.perf_counter()
+        try:
+            status, data = self.driver.request(method, path, body, first_chunk)
+        except (http.client.HTTPException, OSError):
+            status, data = 0, b''
+        self.samples.append((name, status, time.perf_counter() - start))
+        return status, data
+
+    def text(self):
+        return ' '.join(self.rng.sample(WORDS, 3)) + f' {self.rng.randrange(10_000)}'
+
+    def login(self):
+        return self.call('login', 'POST', '/api/login', {'email': self.email, 'password': PASSWORD})
+
+    def seed(self, tasks, batch_size):
+        self.call('register', 'POST', '/api/register', {'name': 'Carga', 'email': self.email, 'password': PASSWORD})
+        self.login()
+        for start in range(0, tasks, batch_size):
+            count = min(batch_size, tasks - start)
+            status, data = self.call('batch', 'POST', '/api/tasks/batch',
+                                     {'operations': [{'op': 'create', 'text': self.text()} for _ in range(count)]})
+            if status == 200:
+                self.task_ids.extend(task['id'] for task in json.loads(data)['results'])
+        self.samples.clear()
+
+    def run(self, operation):
+        getattr(self, 'op_' + operation)()
+
+    def op_list_page(self):
+        order = self.rng.choice(('asc', 'desc'))
+        self.call('list_page', 'GET', f'/api/tasks?limit=50&order={order}')
+
+    def op_list_all(self):
+        self.call('list_all', 'GET', '/api/tasks')
+
+    def op_changes(self):
+        status, data = self.call('changes', 'GET', f'/api/tasks/changes?since={self.version}')
+        if status == 200:
+            self.version = json.loads(data)['version']
+
+    def op_search(self):
+        query = self.rng.choice(WORDS)[:self.rng.randint(3, 6)]
+        self.call('search', 'GET', f'/api/tasks/search?q={quote(query)}')
+
+    def op_session(self):
+        self.call('session', 'GET', '/api/session')
+
+    def op_create(self):
+        status, data = self.call('create', 'POST', '/api/tasks', {'text': self.text()})
+        if status == 201:
+            self.task_ids.append(json.loads(data)['id'])
+
+    def op_toggle(self):
+        if self.task_ids:
+            self.call('toggle', 'POST', f'/api/tasks/{self.rng.choice(self.task_ids)}/toggle')
+
+    def op_delete(self):
+        if self.task_ids:
+            index = self.rng.randrange(len(self.task_ids))
+            self.task_ids[index], self.task_ids[-1] = self.task_ids[-1], self.task_ids[index]
+            self.call('delete', 'DELETE', f'/api/tasks/{self.task_ids.pop()}')
+
+    def op_batch(self):
+        operations = [{'op': 'create', 'text': self.text()} for _ in range(5)]
+        operations += [{'op': 'toggle', 'id': task_id} for task_id in self.rng.sample(self.task_ids, min(5, len(self.task_ids)))]
+        status, data = self.call('batch', 'POST', '/api/tasks/batch', {'operations': operations})
+        if status == 200:
+            self.task_ids.extend(result['id'] for result in json.loads(data)['results'][:5])
+
+    def op_index(self):
+        self.call('index', 'GET', '/')
+
+    def op_stream(self):
+        self.call('stream', 'GET', f'/api/tasks/stream?since={self.version}', first_chunk=True)
+
+    def op_metrics(self):
+        self.call('metrics', 'GET', '/metrics')
+
+    def op_login(self):
+        # El logout forma parte de la operación: cuenta como login, que es lo que pesa en MIX
+        self.call('login', 'POST', '/api/logout')
+        self.login()
+
+    def op_register(self):
+        email = f'nuevo-{self.rng.getrandbits(48):x}@loadtest.example'
+        self.call('register', 'POST', '/api/register', {'name': 'Nuevo', 'email': email, 'password': PASSWORD})
+
+
+def percentile(sorted_values, fraction):
+    """Percentil por rango más cercano de una lista ya ordenada"""
+    return sorted_values[max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))]
+
+
+def summarize(samples, elapsed):
+    """Resumen por operación: peticiones, errores (0 o 5xx), req/s y latencias en ms"""
+    by_name = {}
+    for name, status, seconds in samples:
+        by_name.setdefault(name, []).append((status, seconds))
+    by_name['total'] = [(status, seconds) for _, status, seconds in samples]
+
+    summary = {}
+    for name, results in sorted(by_name.items()):
+        latencies = sorted(seconds * 1000 for _, seconds in results)
+        summary[name] = {
+            'requests': len(results),
+            'errors': sum(1 for status, _ in results if status == 0 or status >= 500),
+            'throughput': round(len(results) / elapsed, 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+        }
+    return summary
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f'El servidor no respondió en el puerto {port}')
+
+
+def start_server(mode, port, storage):
+    """Arranca app.py en un subproceso (WSGI de desarrollo o asyncio) con el backend `storage`"""
+    command = [sys.executable, 'app.py'] + (['--asgi'] if mode == 'asgi' else [])
+    # Todas las sesiones salen de la misma IP: sin esto el limitador de login las frenaría
+    env = dict(os.environ, PORT=str(port), LOGIN_RATE_LIMIT='false', STORAGE_BACKEND=storage)
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+def run(args):
+    server = None
+    # De un servidor remoto no sabemos el backend; los locales usan el de esta configuración
+    storage = app_module.app.config['STORAGE_BACKEND']
+    if args.target == 'client':
+        # El test client no envía cookies Secure sobre http://
+        app_module.app.config['SESSION_COOKIE_SECURE'] = False
+        app_module.app.config['LOGIN_RATE_LIMIT'] = False
+        make_driver = ClientDriver
+    else:
+        url = args.target
+        if args.target in ('wsgi', 'asgi'):
+            server = start_server(args.target, args.port, storage)
+            url = f'http://127.0.0.1:{args.port}'
+        else:
+            storage = None
+        make_driver = lambda: HTTPDriver(url)
+
+    try:
+        # Un usuario por hilo como mínimo: cada sesión lleva la cuenta de sus ids
+        users = max(args.users, args.concurrency)
+        sessions = [LoadSession(make_driver(), f'carga{i}-{args.seed}@loadtest.example',
+                                random.Random(args.seed * 1_000_003 + i))
+                    for i in range(users)]
+        batch_size = app_module.app.config['MAX_BATCH_SIZE']
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(lambda session: session.seed(args.tasks, batch_size), sessions))
+
+        operations, weights = zip(*MIX.items())
+
+        def worker(index):
+            mine = sessions[index::args.concurrency]
+            rng = random.Random(args.seed + index)
+            for n in range(args.requests // args.concurrency):
+                mine[n % len(mine)].run(rng.choices(operations, weights)[0])
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(worker, range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    config = {'target': args.target, 'users': users, 'tasks': args.tasks, 'requests': args.requests,
+              'concurrency': args.concurrency, 'seed': args.seed}
+    if storage is not None:
+        config['storage'] = storage
+    result = {
+        'config': config,
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'elapsed_seconds': round(elapsed, 3),
+        'routes': summarize([sample for session in sessions for sample in session.samples], elapsed),
+    }
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+def compare(args):
+    """Compara dos resultados; sale con código 1 si hay regresiones"""
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['routes']
+    with open(args.current, encoding='utf-8') as f:
+        current = json.load(f)['routes']
+
+    regressions = []
+    print(f'{"operación":<12} {"p50 ms":>17} {"p95 ms":>17} {"p99 ms":>17} {"req/s":>19}')
+    for name in sorted(set(baseline) & set(current)):
+        base, new = baseline[name], current[name]
+        flags = [metric for metric in ('p50_ms', 'p95_ms', 'p99_ms')
+                 if new[metric] > base[metric] * (1 + args.threshold)]
+        if new['throughput'] < base['throughput'] * (1 - args.threshold):
+            flags.append('throughput')
+        if new['errors'] > base['errors']:
+            flags.append('errors')
+        cells = [f'{base[m]:>8.2f}→{new[m]:<8.2f}' for m in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput')]
+        print(f'{name:<12} ' + ' '.join(cells) + ('  REGRESIÓN: ' + ', '.join(flags) if flags else ''))
+        if flags:
+            regressions.append(name)
+
+    missing = sorted(set(baseline) - set(current))
+    if missing:
+        print('Sin datos en el resultado actual: ' + ', '.join(missing))
+    if regressions:
+        print(f'{len(regressions)} operaciones empeoran más de un {args.threshold:.0%}')
+        sys.exit(1)
+    print('Sin regresiones')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='lanza la prueba de carga')
+    run_parser.add_argument('--target', default='client', help='client, wsgi, asgi o una URL http://')
+    run_parser.add_argument('--port', type=int, default=5124, help='puerto para los modos wsgi y asgi')
+    run_parser.add_argument('--users', type=int, default=16)
+    run_parser.add_argument('--tasks', type=int, default=1000, help='tareas sembradas por usuario')
+    run_parser.add_argument('--requests', type=int, default=20_000)
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--out', help='fichero donde guardar el resultado JSON')
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='compara un resultado con una línea base')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10,
+                                help='empeoramiento relativo tolerado (0.10 = 10%%)')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
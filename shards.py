@@ -0,0 +1,497 @@
+"""Modo con shards: un router delante de N procesos de la aplicación.
+
+Cada usuario vive en un único shard, elegido por hashing consistente de su
+email. El router recibe todas las peticiones y reenvía cada una al shard
+dueño del usuario por un socket Unix, reutilizando conexiones HTTP/1.1
+persistentes. Las sesiones van en un SQLite compartido (SHARD_DIR/sesiones.db),
+así que al router le basta la cookie para saber de quién es una petición;
+login y registro se enrutan por el email del cuerpo y las peticiones
+anónimas se reparten entre todos los shards.
+
+Al añadir un shard sólo cambian de dueño los usuarios de su tramo del
+anillo: el router los mueve uno a uno (export, import y borrado en el
+origen) mientras sigue atendiendo al resto, y un usuario sólo recibe 503
+durante su propio traslado.
+
+Cada shard guarda sus datos en SHARD_DIR/<shard> con el backend de
+STORAGE_BACKEND. Con uno persistente hay que arrancar al menos con tantos
+shards como había; si hay más, el arranque reparte los usuarios antes de
+aceptar peticiones.
+
+Uso: python app.py --shards 4
+"""
+import hashlib
+import hmac
+import http.client
+import itertools
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from bisect import bisect
+from urllib.parse import quote
+
+from werkzeug.http import parse_cookie
+from werkzeug.serving import make_server
+from werkzeug.wsgi import get_input_stream
+
+import app as core
+
+HOP_BY_HOP = frozenset(('connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te',
+                        'trailers', 'transfer-encoding', 'upgrade'))
+# Además de las anteriores, las que el servidor del router pone por su cuenta
+ROUTER_HEADERS = HOP_BY_HOP | {'server', 'date'}
+# Rutas sin sesión todavía que se enrutan por el email del cuerpo
+EMAIL_ROUTES = ('/api/login', '/api/register')
+READ_METHODS = ('GET', 'HEAD')
+MAX_BUFFERED_BODY = 1024 * 1024  # cuerpos mayores se reenvían en streaming, sin reintento
+RELAY_CHUNK = 64 * 1024
+
+
+class HashRing:
+    """Anillo de hashing consistente con `replicas` puntos por shard"""
+
+    def __init__(self, shards=(), replicas=128):
+        self.shards = tuple(shards)
+        self.replicas = replicas
+        points = sorted((self._hash(f'{shard}#{replica}'), shard)
+                        for shard in self.shards for replica in range(replicas))
+        self._points = [point for point, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+    def with_shard(self, shard):
+        return HashRing(self.shards + (shard,), self.replicas)
+
+    def owner(self, email):
+        """Primer punto del anillo a partir del hash del email"""
+        return self._owners[bisect(self._points, self._hash(email)) % len(self._points)]
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection sobre un socket Unix.
+
+    `unix_sock` sigue apuntando al socket aunque http.client suelte `sock`
+    al pasarle la conexión a una respuesta que la cierra al acabar.
+    """
+
+    def __init__(self, socket_path, timeout=300):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = self.unix_sock = sock
+
+
+class ShardError(Exception):
+    """Un shard respondió algo inesperado a una petición interna"""
+
+
+class ShardClient:
+    """Conexiones persistentes con un shard.
+
+    Las conexiones libres se guardan en una pila (la más reciente es la que
+    menos probablemente haya caducado) de como mucho `pool_size`; si hacen
+    falta más a la vez, se abren y al terminar se cierran.
+    """
+
+    def __init__(self, name, socket_path, pool_size=32):
+        self.name = name
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return UnixHTTPConnection(self.socket_path), False
+
+    def release(self, conn, reusable):
+        """Devuelve al pool una conexión cuya respuesta ya se leyó entera"""
+        if reusable:
+            with self._lock:
+                if len(self._idle) < self.pool_size:
+                    self._idle.append(conn)
+                    return
+        conn.close()
+
+    def send(self, method, target, body=None, headers=None):
+        """Envía la petición; devuelve (conexión, respuesta) y la conexión vuelve con release()"""
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.request(method, target, body, headers or {})
+                return conn, conn.getresponse()
+            except ConnectionError:
+                conn.close()
+                # Una conexión del pool que el shard ya cerró: se repite con una nueva
+                if not reused or not (body is None or isinstance(body, bytes)):
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+
+    def call(self, method, target, payload=None):
+        """Petición interna con cuerpo JSON; devuelve (estado, JSON de la respuesta)"""
+        body = None if payload is None else json.dumps(payload).encode('utf-8')
+        conn, response = self.send(method, target, body, {'Content-Type': 'application/json'})
+        try:
+            data = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        self.release(conn, not response.will_close)
+        return response.status, json.loads(data) if data else None
+
+    def users(self):
+        status, data = self.call('GET', '/internal/users')
+        if status != 200:
+            raise ShardError(f'{self.name}: GET /internal/users devolvió {status}')
+        return data['users']
+
+
+def user_target(email):
+    return '/internal/users/' + quote(email, safe='@')
+
+
+class ShardSupervisor:
+    """Arranca y detiene los procesos shard; cada uno es `python app.py` con SHARD_NAME"""
+
+    def __init__(self, directory, pool_size):
+        self.directory = directory
+        self.pool_size = pool_size
+        self.processes = {}
+
+    def start(self, index, timeout=15):
+        """Lanza el shard número `index` y espera a que su socket acepte conexiones"""
+        name = f'shard-{index}'
+        data = os.path.join(self.directory, name)
+        os.makedirs(data, exist_ok=True)
+        socket_path = os.path.join(self.directory, name + '.sock')
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        env = dict(os.environ,
+                   SHARD_NAME=name, SHARD_SOCKET=socket_path, TASK_ID_WORKER=str(index % 32),
+                   SESSION_BACKEND='sqlite', SESSION_SQLITE_PATH=os.path.join(self.directory, 'sesiones.db'),
+                   SQLITE_PATH=os.path.join(data, 'tareas.db'), JOURNAL_DIR=os.path.join(data, 'diario'))
+        self.processes[name] = subprocess.Popen([sys.executable, os.path.abspath(core.__file__)], env=env)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(socket_path)
+                break
+            except OSError:
+                if time.monotonic() > deadline or self.processes[name].poll() is not None:
+                    raise ShardError(f'El shard {name} no arrancó')
+                time.sleep(0.05)
+        return ShardClient(name, socket_path, self.pool_size)
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.wait()
+
+
+class RelayedBody:
+    """Cuerpo de la respuesta de un shard, reenviado a trozos según llega.
+
+    close() lo llama el servidor WSGI al terminar, incluso si el cliente
+    cortó antes o nunca se empezó a iterar; sólo entonces vuelve la
+    conexión al pool, y sólo si la respuesta se leyó completa.
+    """
+
+    def __init__(self, client, conn, response, on_close):
+        self.client = client
+        self.conn = conn
+        self.response = response
+        self.on_close = on_close
+
+    def __iter__(self):
+        try:
+            while True:
+                chunk = self.response.read1(RELAY_CHUNK)
+                if not chunk:
+                    return
+                yield chunk
+        except (OSError, http.client.HTTPException):
+            # Conexión cortada por el router al mover al usuario (streams SSE)
+            return
+
+    def close(self):
+        self.on_close()
+        self.client.release(self.conn, self.response.isclosed() and not self.response.will_close)
+
+
+def json_response(start_response, status, data, headers=()):
+    body = json.dumps(data).encode('utf-8')
+    start_response(status, [('Content-Type', 'application/json'), ('Content-Length', str(len(body))), *headers])
+    return [body]
+
+
+def forward_headers(environ):
+    """Cabeceras de la petición para el shard, con la IP del cliente en X-Forwarded-For"""
+    headers = {}
+    for key, value in environ.items():
+        if key.startswith('HTTP_'):
+            name = key[5:].replace('_', '-').lower()
+            if name not in HOP_BY_HOP:
+                headers[name] = value
+    for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+        if environ.get(key):
+            headers[key.replace('_', '-').lower()] = environ[key]
+    remote = environ.get('REMOTE_ADDR', '')
+    forwarded = headers.get('x-forwarded-for')
+    headers['x-forwarded-for'] = f'{forwarded}, {remote}' if forwarded else remote
+    return headers
+
+
+def request_body(environ):
+    """Cuerpo para reenviar: bytes si es pequeño (se puede reintentar), si no el stream"""
+    length = environ.get('CONTENT_LENGTH')
+    chunked = 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower()
+    if not chunked and not length:
+        return None
+    stream = get_input_stream(environ)
+    if length and int(length) <= MAX_BUFFERED_BODY:
+        return stream.read()
+    return stream
+
+
+class ShardRouter:
+    """Aplicación WSGI que reenvía cada petición al shard dueño del usuario.
+
+    Durante un reparto (rebalance) conviven dos anillos: los usuarios que
+    no cambian de dueño siguen igual; los que sí, van al shard antiguo hasta
+    que se mueven y al nuevo después. Mientras se mueve uno, sus peticiones
+    reciben 503, y el traslado espera a que acaben las escrituras que ya
+    estaban en curso. Si un traslado falla, el usuario se queda fijado a su
+    shard de origen hasta el siguiente reparto.
+    """
+
+    def __init__(self, ring, clients, sessions, supervisor=None):
+        self.ring = ring
+        self.clients = dict(clients)  # nombre -> ShardClient
+        self.sessions = sessions
+        self.supervisor = supervisor
+        self._next = None
+        self._moving = set()
+        self._moved = set()
+        self._pinned = {}
+        self._writes = {}  # email -> escrituras en curso durante un reparto
+        self._streams = {}  # email -> conexiones SSE abiertas
+        self._cond = threading.Condition()
+        self._rebalance_lock = threading.Lock()
+        self._spread = itertools.count()
+
+    def _owner(self, email):
+        """Shard del usuario, o None mientras se está moviendo; se llama con _cond tomado"""
+        pinned = self._pinned.get(email)
+        if pinned is not None:
+            return pinned
+        current = self.ring.owner(email)
+        if self._next is None:
+            return current
+        target = self._next.owner(email)
+        if target == current or email in self._moved:
+            return target
+        return None if email in self._moving else current
+
+    def owner(self, email):
+        with self._cond:
+            return self._owner(email)
+
+    def _session_email(self, environ):
+        token = parse_cookie(environ).get(core.app.config['SESSION_COOKIE_NAME'])
+        data = self.sessions.load(token) if token else None
+        return data.get('user_email') if data else None
+
+    @staticmethod
+    def _body_email(body):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get('email'), str):
+            return None
+        return core.sanitize_input(data['email']).lower() or None
+
+    def _done(self, email, tracked, stream):
+        with self._cond:
+            if tracked:
+                self._writes[email] -= 1
+                if not self._writes[email]:
+                    del self._writes[email]
+                self._cond.notify_all()
+            if stream is not None:
+                self._streams[email].discard(stream)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith('/internal/'):
+            return self.admin(environ, start_response)
+        method = environ['REQUEST_METHOD']
+        body = request_body(environ)
+        email = self._session_email(environ)
+        if email is None and method == 'POST' and path in EMAIL_ROUTES and body is not None:
+            if not isinstance(body, bytes):
+                body = body.read()
+            email = self._body_email(body)
+
+        with self._cond:
+            if email is None:
+                shards = self.ring.shards
+                shard = shards[next(self._spread) % len(shards)]
+            else:
+                shard = self._owner(email)
+            tracked = shard is not None and self._next is not None and method not in READ_METHODS
+            if tracked:
+                self._writes[email] = self._writes.get(email, 0) + 1
+        if shard is None:
+            return json_response(start_response, '503 Service Unavailable',
+                                 {'error': 'Servidor ocupado, inténtalo de nuevo en unos segundos'},
+                                 [('Retry-After', '1')])
+
+        client = self.clients[shard]
+        target = quote(path.encode('latin-1'), safe="/!$&'()*+,;=:@-._~")
+        if environ.get('QUERY_STRING'):
+            target += '?' + environ['QUERY_STRING']
+        try:
+            conn, response = client.send(method, target, body, forward_headers(environ))
+        except (OSError, http.client.HTTPException):
+            self._done(email, tracked, None)
+            return json_response(start_response, '502 Bad Gateway', {'error': f'El shard {shard} no responde'})
+
+        stream = None
+        if email is not None and (response.getheader('Content-Type') or '').startswith('text/event-stream'):
+            stream = conn
+            with self._cond:
+                self._streams.setdefault(email, set()).add(conn)
+        start_response(f'{response.status} {response.reason}',
+                       [(name, value) for name, value in response.getheaders() if name.lower() not in ROUTER_HEADERS])
+        return RelayedBody(client, conn, response, lambda: self._done(email, tracked, stream))
+
+    def rebalance(self, ring):
+        """Pasa al anillo `ring` moviendo a cada usuario que cambie de shard; devuelve cuántos"""
+        with self._rebalance_lock:
+            with self._cond:
+                self._next = ring
+            moved = 0
+            try:
+                for name, client in list(self.clients.items()):
+                    for email in client.users():
+                        target = ring.owner(email)
+                        if target != name:
+                            moved += self._move(email, client, self.clients[target])
+            finally:
+                with self._cond:
+                    self.ring, self._next = ring, None
+                    self._moved.clear()
+            return moved
+
+    def _move(self, email, source, target):
+        with self._cond:
+            self._moving.add(email)
+            while self._writes.get(email):
+                self._cond.wait()
+        try:
+            status, dump = source.call('GET', user_target(email))
+            if status == 200:
+                status, _ = target.call('PUT', user_target(email), dump)
+                # 409: ya estaba en el destino, de un traslado que se cortó antes de borrar el origen
+                if status not in (201, 409):
+                    raise ShardError(f'{target.name}: importar {email} devolvió {status}')
+        except (OSError, http.client.HTTPException, ShardError) as e:
+            core.app.logger.warning('No se pudo mover %s de %s a %s: %s', email, source.name, target.name, e)
+            with self._cond:
+                self._pinned[email] = source.name
+                self._moving.discard(email)
+            return 0
+
+        with self._cond:
+            self._moved.add(email)
+            self._pinned.pop(email, None)
+            self._moving.discard(email)
+            streams = self._streams.pop(email, ())
+        # Los streams SSE abiertos contra el origen se cortan; el navegador
+        # reconecta solo y el router lo lleva ya al destino
+        for conn in streams:
+            try:
+                conn.unix_sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        try:
+            source.call('DELETE', user_target(email))
+        except (OSError, http.client.HTTPException) as e:
+            # La copia del origen se descarta en el próximo reparto (el destino responde 409)
+            core.app.logger.warning('No se pudo borrar %s de %s: %s', email, source.name, e)
+        return 1
+
+    def add_shard(self):
+        """Arranca un shard nuevo y le pasa su tramo del anillo; devuelve su nombre"""
+        client = self.supervisor.start(len(self.clients))
+        with self._cond:
+            self.clients[client.name] = client
+        threading.Thread(target=self.rebalance, args=(self.ring.with_shard(client.name),),
+                         name='shard-rebalance', daemon=True).start()
+        return client.name
+
+    def admin(self, environ, start_response):
+        """POST /internal/shards añade un shard y GET lo describe; ambos con X-Shard-Token"""
+        token = core.app.config['SHARD_ADMIN_TOKEN']
+        provided = environ.get('HTTP_X_SHARD_TOKEN', '')
+        if not token or environ.get('PATH_INFO') != '/internal/shards' or not hmac.compare_digest(provided, token):
+            return json_response(start_response, '404 Not Found', {'error': 'No encontrado'})
+        if environ['REQUEST_METHOD'] == 'POST':
+            if self.supervisor is None or self._rebalance_lock.locked():
+                return json_response(start_response, '409 Conflict', {'error': 'Ya hay un reparto en curso'})
+            return json_response(start_response, '202 Accepted', {'shard': self.add_shard()})
+        with self._cond:
+            return json_response(start_response, '200 OK', {
+                'shards': list(self.ring.shards),
+                'rebalancing': self._next is not None,
+                'moving': len(self._moving),
+                'pinned': len(self._pinned),
+            })
+
+
+def serve_shard(socket_path):
+    """Atiende la aplicación en un socket Unix, detrás del router"""
+    # Sólo el router llega al socket y añade la IP de su cliente a X-Forwarded-For:
+    # es un proxy más que los que haya delante
+    core.create_app({'TRUSTED_PROXIES': core.app.config['TRUSTED_PROXIES'] + 1})
+    make_server('unix://' + socket_path, 0, core.app, threaded=True).serve_forever()
+
+
+def serve(host, port, count):
+    config = core.app.config
+    directory = config['SHARD_DIR']
+    os.makedirs(directory, exist_ok=True)
+    supervisor = ShardSupervisor(directory, config['SHARD_POOL_SIZE'])
+    # Con SIGTERM también se paran los shards (el finally no corre si el proceso muere por la señal)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        clients = [supervisor.start(index) for index in range(count)]
+        ring = HashRing([client.name for client in clients], config['SHARD_REPLICAS'])
+        sessions = core.create_session_interface(
+            dict(config, SESSION_BACKEND='sqlite', SESSION_SQLITE_PATH=os.path.join(directory, 'sesiones.db')))
+        router = ShardRouter(ring, {client.name: client for client in clients}, sessions, supervisor)
+        # Usuarios de un arranque anterior con menos shards
+        router.rebalance(ring)
+        make_server(host, port, router, threaded=True).serve_forever()
+    finally:
+        supervisor.stop()
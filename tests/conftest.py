@@ -0,0 +1,58 @@
+import itertools
+import os
+import sys
+
+import pytest
+
+# app.py y compañía son módulos sueltos en la raíz del repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture(params=['memory', 'journal', 'sqlite'])
+def storage(request, tmp_path):
+    """Cada backend de almacenamiento, vacío y con un usuario registrado"""
+    if request.param == 'memory':
+        backend = app_module.MemoryStorage()
+    elif request.param == 'journal':
+        backend = app_module.JournaledStorage(str(tmp_path / 'diario'), fsync=False)
+    else:
+        backend = app_module.SQLiteStorage(str(tmp_path / 'tareas.db'))
+    backend.create_user('a@example.com', {'name': 'A', 'password': '00', 'created_at': 0.0})
+    yield backend
+    if request.param != 'memory':
+        backend.close()
+
+
+@pytest.fixture(scope='session')
+def app():
+    """La app con almacenamiento y sesiones en memoria"""
+    return app_module.create_app({'STORAGE_BACKEND': 'memory', 'SESSION_BACKEND': 'memory',
+                                  'SESSION_COOKIE_SECURE': False, 'LOGIN_RATE_LIMIT': False})
+
+
+@pytest.fixture
+def register(app):
+    """Registra un usuario con contraseña 'password123' y devuelve un test client nuevo"""
+    def register(email):
+        client = app.test_client()
+        response = client.post('/api/register', json={'name': 'Test', 'email': email, 'password': 'password123'})
+        assert response.status_code == 201
+        return client
+    return register
+
+
+_emails = itertools.count()
+
+
+@pytest.fixture
+def api(app, storage, register, monkeypatch):
+    """Test client con sesión iniciada, sirviendo desde cada backend de `storage`"""
+    monkeypatch.setattr(app_module, 'storage', storage)
+    # Un correo distinto por test: la caché del listado va por usuario y versión
+    email = f'api{next(_emails)}@example.com'
+    client = register(email)
+    assert client.post('/api/login', json={'email': email, 'password': 'password123'}).status_code == 200
+    client.email = email
+    return client
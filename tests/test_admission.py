@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def queues(monkeypatch):
+    """Colas diminutas: un hueco de lectura y otro de escritura, sin cola de espera"""
+    queues = {'read': app_module.AdmissionQueue('read', 1, 0, 0.05),
+              'write': app_module.AdmissionQueue('write', 1, 0, 0.05)}
+    monkeypatch.setattr(app_module, 'admission_queues', queues)
+    return queues
+
+
+def test_full_class_is_a_503_with_retry_after(app, api, queues):
+    assert queues['read'].acquire() is None
+    response = api.get('/api/tasks')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(app.config['HASH_RETRY_AFTER'])
+
+    # Las escrituras tienen su propia clase y siguen entrando
+    assert api.post('/api/tasks', json={'text': 'entra'}).status_code == 201
+    assert queues['write'].stats()['active'] == 0
+
+    queues['read'].release(0.0)
+    assert api.get('/api/tasks').status_code == 200
+    assert queues['read'].stats()['active'] == 0
+
+
+def test_waiter_times_out_when_no_slot_frees(queues):
+    queue = app_module.AdmissionQueue('read', 1, 1, 0.05)
+    assert queue.acquire() is None
+    assert queue.acquire() == 'timeout'
+    assert queue.stats() == {'active': 1, 'queued': 0, 'service_seconds': 0.0}
+
+
+def test_release_hands_the_slot_to_the_first_waiter():
+    queue = app_module.AdmissionQueue('read', 1, 4, 5.0)
+    assert queue.acquire() is None
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(queue.acquire()))
+    waiter.start()
+    while queue.stats()['queued'] == 0:
+        pass
+    queue.release(0.01)
+    waiter.join()
+    assert results == [None]
+    assert queue.stats()['active'] == 1 and queue.stats()['queued'] == 0
+
+
+def test_streamed_list_holds_its_slot_until_closed(app, api, queues, monkeypatch):
+    api.post('/api/tasks', json={'text': 'una'})
+    monkeypatch.setitem(app.config, 'STREAM_JSON_THRESHOLD', 0)
+    streamed = api.get('/api/tasks', buffered=False)
+    assert streamed.is_streamed
+    assert queues['read'].stats()['active'] == 1
+    assert api.get('/api/tasks').status_code == 503
+
+    assert streamed.get_data().startswith(b'[')
+    streamed.close()
+    assert queues['read'].stats()['active'] == 0
+
+
+def test_asgi_streamed_response_releases_after_sending(app, queues):
+    asgi = pytest.importorskip('asgi')
+
+    async def chunks():
+        yield b'[]'
+
+    async def get_tasks(request):
+        return asgi.Response(stream=chunks())
+
+    scope = {'method': 'GET', 'path': '/api/tasks', 'query_string': b'', 'headers': [], 'client': ('127.0.0.1', 1)}
+    response = asyncio.run(asgi.admit(asgi.Request(scope, b''), get_tasks, False, {}))
+    assert queues['read'].stats()['active'] == 1
+    for callback in response.on_close:
+        callback()
+    assert queues['read'].stats()['active'] == 0
@@ -0,0 +1,39 @@
+import time
+
+import app as app_module
+
+
+def archive_completed(api, count):
+    ids = []
+    for i in range(count):
+        task = api.post('/api/tasks', json={'text': f'hecha {i}'}).get_json()
+        api.post(f"/api/tasks/{task['id']}/toggle")
+        ids.append(task['id'])
+    # Dos segmentos, para que la paginación cruce de uno a otro
+    app_module.storage.archive_tasks(api.email, time.time() + 1, count // 2)
+    app_module.storage.archive_tasks(api.email, time.time() + 1, count)
+    return ids
+
+
+def test_archive_pages_round_trip_the_cursor(api):
+    ids = archive_completed(api, 5)
+    seen, cursor = [], None
+    while True:
+        response = api.get('/api/tasks/archive?limit=2' + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        data = response.get_json()
+        seen += [task['id'] for task in data['tasks']]
+        cursor = data['next_cursor']
+        if cursor is None:
+            break
+        assert len(data['tasks']) == 2
+    assert sorted(seen) == sorted(ids)
+    assert api.get('/api/tasks').get_json() == []
+
+
+def test_archive_rejects_bad_cursors(api):
+    archive_completed(api, 2)
+    # [-1, 0], [0, -1], basura, y un JSON que no es un par
+    for cursor in ('Wy0xLCAwXQ==', 'WzAsIC0xXQ==', '!!!', 'eyJhIjogMX0='):
+        assert api.get(f'/api/tasks/archive?cursor={cursor}').status_code == 400
+    assert api.get('/api/tasks/archive?limit=0').status_code == 400
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+
+import pytest
+
+import app as app_module
+
+
+def test_memory_scans_leave_the_event_loop(app):
+    asgi = pytest.importorskip('asgi')
+    backend = app_module.MemoryStorage()
+    backend.create_user('a@example.com', {'name': 'A', 'password': '00', 'created_at': 0.0})
+    threads = []
+
+    def scan(user_email, *args):
+        threads.append(threading.get_ident())
+        return []
+    backend.list_tasks = backend.search_tasks = backend.due_tasks = backend.page_archive = scan
+    backend.get_user = lambda email: threads.append(threading.get_ident())
+
+    async def main():
+        storage = asgi.AsyncStorage(backend)
+        await storage.get_user('a@example.com')
+        await storage.list_tasks('a@example.com')
+        await storage.search_tasks('a@example.com', 'x', 10)
+        await storage.due_tasks('a@example.com', 0.0, 10)
+        await storage.page_archive('a@example.com', 10)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(main())
+    # Las consultas puntuales siguen en el bucle; los recorridos no
+    assert threads[0] == loop_thread
+    assert loop_thread not in threads[1:]
+
+
+def test_streamed_list_matches_wsgi_bytes(app, storage, monkeypatch):
+    asgi = pytest.importorskip('asgi')
+    for i in range(5):
+        storage.add_task('a@example.com', {'id': i + 1, 'text': f'tarea ñ {i}', 'completed': False,
+                                           'created_at': float(i)})
+    monkeypatch.setattr(asgi, 'storage', asgi.AsyncStorage(storage))
+
+    async def collect():
+        return b''.join([chunk async for chunk in asgi.stream_task_list('a@example.com', 2)])
+
+    streamed = asyncio.run(collect())
+    tasks, _ = storage.page_tasks('a@example.com', 5)
+    # Mismos bytes (y por tanto mismo ETag) que el listado de la app WSGI
+    assert streamed == ''.join(app_module.encode_json_array([tasks[:2], tasks[2:4], tasks[4:]])).encode('utf-8')
+    assert streamed == app_module.encode_json_body(tasks)
@@ -0,0 +1,49 @@
+import pytest
+
+
+def listed(api):
+    return api.get('/api/tasks').get_json()
+
+
+@pytest.mark.parametrize('operation,error', [
+    ({'op': 'create', 'text': 5}, 'El texto de la tarea no puede estar vacío'),
+    ({'op': 'create', 'text': 'x', 'due_at': 'mañana'}, None),
+    ({'op': 'toggle', 'id': '1'}, 'Id de tarea inválido'),
+    ({'op': 'toggle', 'id': True}, 'Id de tarea inválido'),
+    ({'op': 'renombrar', 'id': 1}, 'Operación desconocida'),
+    ('create', 'Operación inválida'),
+])
+def test_invalid_operation_is_a_400_with_its_index(api, operation, error):
+    response = api.post('/api/tasks/batch', json={'operations': [{'op': 'create', 'text': 'válida'}, operation]})
+    assert response.status_code == 400
+    data = response.get_json()
+    assert data['index'] == 1
+    if error:
+        assert data['error'] == error
+    # La operación válida tampoco se aplicó
+    assert listed(api) == []
+
+
+def test_missing_task_rolls_back_the_whole_batch(api):
+    task = api.post('/api/tasks', json={'text': 'existente'}).get_json()
+    response = api.post('/api/tasks/batch', json={'operations': [
+        {'op': 'create', 'text': 'nueva'},
+        {'op': 'toggle', 'id': task['id']},
+        {'op': 'update', 'id': 1, 'text': 'no existe'},
+    ]})
+    assert response.status_code == 409
+    assert response.get_json()['index'] == 2
+    assert listed(api) == [task]
+
+
+def test_batch_applies_every_operation(api):
+    task = api.post('/api/tasks', json={'text': 'existente'}).get_json()
+    response = api.post('/api/tasks/batch', json={'operations': [
+        {'op': 'create', 'text': 'nueva'},
+        {'op': 'toggle', 'id': task['id']},
+        {'op': 'delete', 'id': task['id']},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results[2] == {'id': task['id'], 'deleted': True}
+    assert [t['text'] for t in listed(api)] == ['nueva']
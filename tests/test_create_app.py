@@ -0,0 +1,83 @@
+import os
+import pickle
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def restore_app(app):
+    """Deja la app como la crea el fixture `app` al acabar el test"""
+    saved = dict(app.config)
+    yield app
+    # create_app también suelta la reserva de worker id que hubiera
+    app_module.create_app(saved)
+
+
+def singletons():
+    return (app_module.storage, app_module.app.session_interface, app_module.task_events,
+            app_module.task_list_cache, app_module.password_hasher, app_module.admission_queues,
+            app_module.task_ids)
+
+
+def test_config_overrides_rebuild_the_singletons(restore_app, tmp_path):
+    before = singletons()
+    app = app_module.create_app({
+        'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': str(tmp_path / 'tareas.db'),
+        'SESSION_BACKEND': 'sqlite', 'SESSION_SQLITE_PATH': str(tmp_path / 'sesiones.db'),
+        'ADMISSION_LIMITS': {'read': (3, 5)}, 'TASK_ID_WORKER': 7,
+    })
+    assert app is app_module.app
+    after = singletons()
+    assert all(new is not old for new, old in zip(after, before))
+    assert isinstance(app_module.storage, app_module.SQLiteStorage)
+    assert isinstance(app.session_interface.store, app_module.SQLiteSessionStore)
+    assert list(app_module.admission_queues) == ['read'] and app_module.admission_queues['read'].limit == 3
+    assert app_module.task_ids.worker_id == 7 and app_module.task_id_lease is None
+    # Sin config no vuelve a crear nada
+    assert app_module.create_app() is app and singletons() == after
+
+    client = app.test_client()
+    body = {'name': 'F', 'email': 'fabrica@example.com', 'password': 'password123'}
+    assert client.post('/api/register', json=body).status_code == 201
+    assert app_module.storage.get_user('fabrica@example.com') is not None
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requiere fork')
+def test_fork_child_gets_its_own_connections_and_lease(restore_app, tmp_path):
+    app_module.create_app({'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': str(tmp_path / 'tareas.db'),
+                           'TASK_ID_WORKER': None})
+    storage, lease = app_module.storage, app_module.task_id_lease
+    assert lease is not None and app_module.task_ids.worker_id == lease.worker_id
+    storage.count_tasks('nadie@example.com')  # abre la conexión del hilo en el padre
+    parent_lock = storage._connections_lock
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            child_lease = app_module.task_id_lease
+            result = {
+                'lock_reset': storage._connections_lock is not parent_lock,
+                'connections': len(storage._connections),
+                'lease': child_lease.worker_id,
+                'generator': app_module.task_ids.worker_id,
+                'count': storage.count_tasks('nadie@example.com'),
+            }
+            # Lo que haría el atexit heredado al salir el hijo
+            lease.release()
+            child_lease.release()
+            os.write(write, pickle.dumps(result))
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read, 'rb') as f:
+        result = pickle.loads(f.read())
+    os.waitpid(pid, 0)
+
+    assert result['lock_reset'] and result['connections'] == 1 and result['count'] == 0
+    assert result['lease'] != lease.worker_id and result['generator'] == result['lease']
+    # La reserva del padre sigue siendo suya
+    owners = dict(storage._connection().execute('SELECT worker_id, owner FROM task_id_workers'))
+    assert owners == {lease.worker_id: lease.owner}
@@ -0,0 +1,52 @@
+import time
+
+import pytest
+
+
+def due(api, view='upcoming', limit=50):
+    response = api.get(f'/api/tasks/due?view={view}&limit={limit}')
+    assert response.status_code == 200
+    return [task['text'] for task in response.get_json()['tasks']]
+
+
+@pytest.fixture
+def tasks(api):
+    now = time.time()
+    created = {}
+    for text, offset, priority in [('a', 100, 0), ('b', 100, 3), ('c', 50, 1), ('d', -100, 0),
+                                   ('e', -200, 2), ('sin fecha', None, 3), ('hecha', 10, 0)]:
+        body = {'text': text, 'priority': priority, 'due_at': None if offset is None else now + offset}
+        created[text] = api.post('/api/tasks', json=body).get_json()
+    api.post(f"/api/tasks/{created['hecha']['id']}/toggle")
+    return created
+
+
+def test_due_views_order_by_date_then_priority(api, tasks):
+    # A igual fecha, primero la de más prioridad; sin fecha o completadas no salen
+    assert due(api) == ['c', 'b', 'a']
+    assert due(api, 'overdue') == ['e', 'd']
+    assert due(api, limit=2) == ['c', 'b']
+
+
+def test_due_index_follows_toggle_update_and_delete(api, tasks):
+    assert due(api) == ['c', 'b', 'a'] and due(api, 'overdue') == ['e', 'd']
+
+    api.post(f"/api/tasks/{tasks['c']['id']}/toggle")
+    assert due(api) == ['b', 'a']
+    api.patch(f"/api/tasks/{tasks['a']['id']}", json={'due_at': time.time() - 150})
+    assert due(api) == ['b'] and due(api, 'overdue') == ['e', 'a', 'd']
+    api.patch(f"/api/tasks/{tasks['d']['id']}", json={'priority': 3, 'due_at': tasks['e']['due_at']})
+    assert due(api, 'overdue') == ['d', 'e', 'a']
+    api.patch(f"/api/tasks/{tasks['sin fecha']['id']}", json={'due_at': tasks['b']['due_at']})
+    # Misma fecha y prioridad: desempata el id, la más antigua primero
+    assert due(api) == ['b', 'sin fecha']
+    api.delete(f"/api/tasks/{tasks['b']['id']}")
+    api.post(f"/api/tasks/{tasks['c']['id']}/toggle")
+    assert due(api) == ['c', 'sin fecha']
+    api.patch(f"/api/tasks/{tasks['c']['id']}", json={'due_at': None})
+    assert due(api) == ['sin fecha']
+
+
+@pytest.mark.parametrize('query', ['view=pasado', 'limit=0', 'limit=x'])
+def test_bad_due_parameters_are_400(api, query):
+    assert api.get(f'/api/tasks/due?{query}').status_code == 400
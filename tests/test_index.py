@@ -0,0 +1,39 @@
+import gzip
+
+import app as app_module
+
+
+def test_index_revalidates_with_etag(app):
+    client = app.test_client()
+    first = client.get('/')
+    assert first.status_code == 200 and first.headers['Cache-Control'] == 'no-cache'
+    etag = first.headers['ETag']
+
+    again = client.get('/', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.get_data() == b''
+    assert again.headers['ETag'] == etag
+
+
+def test_index_serves_the_precompressed_variant(app):
+    client = app.test_client()
+    plain = client.get('/')
+    zipped = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in zipped.headers['Vary']
+    assert zipped.get_data() == app_module.INDEX_PAGE.variants['gzip']
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    # Cada codificación tiene su propio ETag
+    assert zipped.headers['ETag'] != plain.headers['ETag']
+    assert client.get('/', headers={'Accept-Encoding': 'gzip',
+                                     'If-None-Match': zipped.headers['ETag']}).status_code == 304
+
+
+def test_fingerprinted_assets_are_immutable(app):
+    client = app.test_client()
+    page = client.get('/').get_data(as_text=True)
+    for name in app_module.INDEX_ASSETS:
+        assert f'/assets/{name}' in page
+        response = client.get(f'/assets/{name}')
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+    assert client.get('/assets/app.000000000000.js').status_code == 404
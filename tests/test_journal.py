@@ -0,0 +1,113 @@
+import os
+import time
+
+from app import Journal, JournaledStorage, TaskIdGenerator
+
+ids = TaskIdGenerator(0)
+USER = 'a@example.com'
+
+
+def open_storage(directory, **kwargs):
+    storage = JournaledStorage(str(directory), fsync=False, **kwargs)
+    storage.create_user(USER, {'name': 'A', 'password': '00', 'created_at': 0.0})
+    return storage
+
+
+def reopen(storage):
+    storage.close()
+    return JournaledStorage(storage.directory, fsync=False)
+
+
+def add(storage, text, **fields):
+    task = {'id': ids.next_id(), 'text': text, 'completed': False, 'created_at': time.time(),
+            'due_at': None, 'priority': 0, 'completed_at': None, **fields}
+    return storage.add_task(USER, task)
+
+
+def journal_path(storage):
+    return storage._path('journal', storage.generation)
+
+
+def test_writes_survive_reopening(tmp_path):
+    storage = open_storage(tmp_path)
+    tasks = [add(storage, f't{i}') for i in range(3)]
+    storage = reopen(storage)
+    assert storage.get_user(USER)['name'] == 'A'
+    assert storage.list_tasks(USER) == tasks
+    storage.close()
+
+
+def test_toggle_update_and_delete_replay(tmp_path):
+    storage = open_storage(tmp_path)
+    tasks = [add(storage, f't{i}') for i in range(3)]
+    storage.toggle_task(USER, tasks[0]['id'])
+    storage.update_task(USER, tasks[1]['id'], {'text': 'cambiada', 'priority': 2})
+    storage.delete_task(USER, tasks[2]['id'])
+    storage.apply_batch(USER, [{'op': 'toggle', 'id': tasks[1]['id']}])
+    before, version = storage.list_tasks(USER), storage.task_version(USER)
+
+    storage = reopen(storage)
+    # completed_at sale del diario, no de la hora a la que se reproduce
+    assert storage.list_tasks(USER) == before
+    assert storage.task_version(USER) == version
+    assert [task['completed'] for task in before] == [True, True]
+    storage.close()
+
+
+def test_recovers_from_snapshot_and_journal_tail(tmp_path):
+    storage = open_storage(tmp_path)
+    first = add(storage, 'antes')
+    storage.snapshot()
+    second = add(storage, 'después')
+    storage.toggle_task(USER, first['id'])
+    generation = storage.generation
+
+    storage = reopen(storage)
+    assert storage.generation == generation
+    assert [(task['id'], task['completed']) for task in storage.list_tasks(USER)] == \
+        [(first['id'], True), (second['id'], False)]
+    # Los diarios anteriores al snapshot ya no hacen falta
+    assert storage._generations('journal') == [generation]
+    storage.close()
+
+
+def test_torn_tail_is_truncated_and_appended_over(tmp_path):
+    storage = open_storage(tmp_path)
+    kept = add(storage, 'entera')
+    storage.close()
+    path = journal_path(storage)
+    size = os.path.getsize(path)
+    with open(path, 'ab') as f:
+        f.write(b'\x40\x00\x00\x00\x00\x00\x00\x00{"a medias')
+
+    storage = JournaledStorage(str(tmp_path), fsync=False)
+    assert os.path.getsize(path) == size
+    assert storage.list_tasks(USER) == [kept]
+    after = add(storage, 'detrás')
+    storage = reopen(storage)
+    assert storage.list_tasks(USER) == [kept, after]
+    storage.close()
+
+
+def test_uncommitted_archive_segment_is_truncated(tmp_path):
+    storage = open_storage(tmp_path)
+    archived = add(storage, 'vieja', completed=True, completed_at=100.0)
+    kept = add(storage, 'pendiente')
+    assert storage.archive_tasks(USER, 200.0, 10)[0] == 1
+    storage.close()
+    assert storage.page_archive(USER, 10) == ([archived], None)
+
+    # El segmento llegó al disco pero el registro del diario que lo confirma no
+    path = journal_path(storage)
+    with open(path, 'rb') as f:
+        last = f.read().rfind(b'["archive"')
+    with open(path, 'r+b') as f:
+        f.truncate(last - Journal.FRAME.size)
+    archive_file = storage.archive._path(USER)
+    assert os.path.getsize(archive_file) > 0
+
+    storage = JournaledStorage(str(tmp_path), fsync=False)
+    assert os.path.getsize(archive_file) == 0
+    assert storage.page_archive(USER, 10) == ([], None)
+    assert [task['id'] for task in storage.list_tasks(USER)] == [archived['id'], kept['id']]
+    storage.close()
@@ -0,0 +1,41 @@
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def limited(app, monkeypatch):
+    """Limitación de login activa con buckets nuevos"""
+    monkeypatch.setitem(app.config, 'LOGIN_RATE_LIMIT', True)
+    max_keys = app.config['LOGIN_RATE_MAX_KEYS']
+    monkeypatch.setattr(app_module, 'login_ip_limiter',
+                        app_module.TokenBucketLimiter(*app.config['LOGIN_RATE_PER_IP'], max_keys))
+    monkeypatch.setattr(app_module, 'login_email_limiter',
+                        app_module.TokenBucketLimiter(*app.config['LOGIN_RATE_PER_EMAIL'], max_keys))
+
+
+def login(client, email, password='password123'):
+    return client.post('/api/login', json={'email': email, 'password': password},
+                       environ_base={'REMOTE_ADDR': '10.0.0.1'})
+
+
+def test_successful_logins_behind_one_address_are_not_limited(register, limited):
+    burst = app_module.app.config['LOGIN_RATE_PER_IP'][1]
+    clients = [(register(f'proxy{i}@example.com'), f'proxy{i}@example.com') for i in range(burst + 5)]
+    assert [login(client, email).status_code for client, email in clients] == [200] * len(clients)
+
+
+def test_failed_logins_spend_the_address_bucket(app, limited):
+    burst = app.config['LOGIN_RATE_PER_IP'][1]
+    client = app.test_client()
+    statuses = [login(client, f'nadie{i}@example.com').status_code for i in range(burst + 1)]
+    assert statuses == [401] * burst + [429]
+
+
+def test_asgi_client_address_follows_trusted_proxies(app, monkeypatch):
+    asgi = pytest.importorskip('asgi')
+    scope = {'client': ('10.0.0.1', 5000)}
+    headers = {'x-forwarded-for': '203.0.113.7, 10.0.0.2'}
+    assert asgi.client_address(scope, headers) == '10.0.0.1'
+    monkeypatch.setitem(app.config, 'TRUSTED_PROXIES', 2)
+    assert asgi.client_address(scope, headers) == '203.0.113.7'
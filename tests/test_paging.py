@@ -0,0 +1,51 @@
+import base64
+import json
+
+import pytest
+
+
+@pytest.fixture
+def tasks(api):
+    """Diez tareas con created_at 1000..1009; las impares completadas"""
+    body = ''.join(json.dumps({'text': f't{i}', 'created_at': 1000 + i, 'completed': i % 2 == 1,
+                               'completed_at': 2000}) + '\n' for i in range(10))
+    response = api.post('/api/tasks/import', data=body, content_type='application/x-ndjson')
+    assert response.get_json()['imported'] == 10
+    return api.get('/api/tasks').get_json()
+
+
+def walk(api, query):
+    """Todas las páginas siguiendo next_cursor; devuelve los textos y el número de páginas"""
+    texts, pages, cursor = [], 0, None
+    while True:
+        data = api.get(f'/api/tasks?{query}' + (f'&cursor={cursor}' if cursor else '')).get_json()
+        texts += [task['text'] for task in data['tasks']]
+        pages += 1
+        cursor = data['next_cursor']
+        if cursor is None:
+            return texts, pages
+
+
+def test_cursor_round_trips_in_both_orders(api, tasks):
+    texts = [task['text'] for task in tasks]
+    assert walk(api, 'limit=3') == (texts, 4)
+    assert walk(api, 'limit=3&order=desc') == (texts[::-1], 4)
+    assert walk(api, 'limit=10') == (texts, 1)
+
+
+def test_completed_and_created_filters(api, tasks):
+    assert walk(api, 'limit=2&completed=true')[0] == ['t1', 't3', 't5', 't7', 't9']
+    assert walk(api, 'limit=2&completed=0')[0] == ['t0', 't2', 't4', 't6', 't8']
+    # created_from incluido, created_to excluido
+    assert walk(api, 'limit=2&created_from=1003&created_to=1006')[0] == ['t3', 't4', 't5']
+    assert walk(api, 'limit=2&completed=false&created_from=1003&order=desc')[0] == ['t8', 't6', 't4']
+
+
+@pytest.mark.parametrize('query', [
+    'limit=0', 'limit=-1', 'limit=abc', 'order=sideways', 'completed=quizá',
+    'created_from=nan', 'created_to=inf', 'created_from=-inf', 'created_to=abc',
+    'cursor=!!!', 'cursor=' + base64.urlsafe_b64encode(b'[1000]').decode(),
+    'cursor=' + base64.urlsafe_b64encode(b'[NaN, 1]').decode(),
+])
+def test_invalid_page_parameters_are_400(api, query):
+    assert api.get(f'/api/tasks?{query}').status_code == 400
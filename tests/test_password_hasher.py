@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def occupy(monkeypatch):
+    """Instala un pool de un hilo sin cola y lo deja ocupado hasta el final del test"""
+    done = threading.Event()
+    workers = []
+
+    def occupy():
+        hasher = app_module.PasswordHasher(1, 0)
+        monkeypatch.setattr(app_module, 'password_hasher', hasher)
+        workers.append(threading.Thread(target=hasher.submit, args=(done.wait,)))
+        workers[-1].start()
+        while hasher._slots._value:
+            pass
+        return hasher
+    yield occupy
+    done.set()
+    for worker in workers:
+        worker.join()
+
+
+def test_full_pool_rejects_immediately():
+    hasher = app_module.PasswordHasher(1, 1)
+    done = threading.Event()
+    futures = [hasher._submit(done.wait) for _ in range(2)]
+    with pytest.raises(app_module.HashPoolBusy):
+        hasher.submit(done.wait)
+    done.set()
+    assert [future.result() for future in futures] == [True, True]
+    assert hasher.stats()['rejected'] == 1 and hasher.stats()['jobs'] == 2
+    # Con los huecos libres vuelve a aceptar
+    assert hasher.submit(lambda: 'ok') == 'ok'
+
+
+def test_busy_pool_answers_login_and_register_with_503(app, register, occupy):
+    client = register('ocupado@example.com')
+    busy_hasher = occupy()
+    for path, body in [('/api/login', {'email': 'ocupado@example.com', 'password': 'password123'}),
+                       ('/api/register', {'name': 'Otro', 'email': 'otro@example.com', 'password': 'password123'})]:
+        response = client.post(path, json=body)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(app.config['HASH_RETRY_AFTER'])
+    assert busy_hasher.stats()['rejected'] == 2
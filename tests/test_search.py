@@ -0,0 +1,11 @@
+def test_search_reports_truncated_results(register):
+    client = register('buscador@example.com')
+    client.post('/api/login', json={'email': 'buscador@example.com', 'password': 'password123'})
+    for i in range(3):
+        assert client.post('/api/tasks', json={'text': f'comprar leche {i}'}).status_code == 201
+
+    data = client.get('/api/tasks/search?q=leche&limit=2').get_json()
+    assert len(data['tasks']) == 2 and data['truncated']
+
+    data = client.get('/api/tasks/search?q=leche&limit=3').get_json()
+    assert len(data['tasks']) == 3 and not data['truncated']
@@ -0,0 +1,44 @@
+import app as app_module
+
+
+def session_token(client, app):
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    return cookie.value if cookie else None
+
+
+def login(client, email):
+    return client.post('/api/login', json={'email': email, 'password': 'password123'})
+
+
+def test_login_issues_a_new_token(app, register):
+    attacker = register('atacante@example.com')
+    assert login(attacker, 'atacante@example.com').status_code == 200
+    planted = session_token(attacker, app)
+
+    # La víctima inicia sesión con la cookie que le ha plantado el atacante
+    victim = register('victima@example.com')
+    victim.set_cookie(app.config['SESSION_COOKIE_NAME'], planted)
+    assert login(victim, 'victima@example.com').status_code == 200
+    token = session_token(victim, app)
+
+    assert token and token != planted
+    assert app_module.app.session_interface.load(planted) is None
+    assert attacker.get('/api/session').status_code == 401
+    assert victim.get('/api/session').get_json()['user']['email'] == 'victima@example.com'
+
+
+def test_login_again_as_same_user_rotates_token(app, register):
+    client = register('repite@example.com')
+    login(client, 'repite@example.com')
+    first = session_token(client, app)
+    login(client, 'repite@example.com')
+    assert session_token(client, app) != first
+    assert client.get('/api/session').status_code == 200
+
+
+def test_logout_invalidates_token(app, register):
+    client = register('salir@example.com')
+    login(client, 'salir@example.com')
+    token = session_token(client, app)
+    client.post('/api/logout')
+    assert app_module.app.session_interface.load(token) is None
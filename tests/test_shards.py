@@ -0,0 +1,64 @@
+import pytest
+from werkzeug.test import Client
+
+import app as app_module
+from shards import HashRing, ShardRouter
+
+EMAILS = [f'usuario{i}@example.com' for i in range(4000)]
+SHARDS = ('shard0', 'shard1', 'shard2', 'shard3')
+
+
+def owners(ring):
+    return {email: ring.owner(email) for email in EMAILS}
+
+
+def test_owner_is_stable_and_balanced():
+    ring = HashRing(SHARDS)
+    # Sólo depende de los nombres: otro proceso con el mismo anillo coincide
+    assert owners(ring) == owners(HashRing(reversed(SHARDS)))
+    counts = {shard: 0 for shard in SHARDS}
+    for shard in owners(ring).values():
+        counts[shard] += 1
+    assert min(counts.values()) > len(EMAILS) / len(SHARDS) / 2
+
+
+def test_adding_a_shard_only_moves_keys_to_it():
+    before = owners(HashRing(SHARDS))
+    after = owners(HashRing(SHARDS).with_shard('shard4'))
+    moved = [email for email in EMAILS if before[email] != after[email]]
+    assert all(after[email] == 'shard4' for email in moved)
+    # ~1/5 de los usuarios; rehashear con módulo movería ~4/5
+    assert 0.1 < len(moved) / len(EMAILS) < 0.3
+
+
+def test_removing_a_shard_only_moves_its_keys():
+    before = owners(HashRing(SHARDS))
+    after = owners(HashRing(SHARDS[:-1]))
+    for email in EMAILS:
+        if before[email] != 'shard3':
+            assert after[email] == before[email]
+        else:
+            assert after[email] != 'shard3'
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setitem(app_module.app.config, 'SHARD_ADMIN_TOKEN', 'secreto')
+    return Client(ShardRouter(HashRing(SHARDS), {}, sessions=None))
+
+
+def test_internal_routes_require_the_admin_token(admin, monkeypatch):
+    assert admin.get('/internal/shards').status_code == 404
+    assert admin.get('/internal/shards', headers={'X-Shard-Token': 'otro'}).status_code == 404
+    assert admin.post('/internal/shards', headers={'X-Shard-Token': 'secret'}).status_code == 404
+    assert admin.get('/internal/otra', headers={'X-Shard-Token': 'secreto'}).status_code == 404
+
+    response = admin.get('/internal/shards', headers={'X-Shard-Token': 'secreto'})
+    assert response.status_code == 200
+    assert response.get_json() == {'shards': list(SHARDS), 'rebalancing': False, 'moving': 0, 'pinned': 0}
+    # Sin supervisor no se pueden arrancar shards nuevos
+    assert admin.post('/internal/shards', headers={'X-Shard-Token': 'secreto'}).status_code == 409
+
+    # Sin token configurado la ruta no existe, ni siquiera con una cabecera vacía
+    monkeypatch.setitem(app_module.app.config, 'SHARD_ADMIN_TOKEN', '')
+    assert admin.get('/internal/shards', headers={'X-Shard-Token': ''}).status_code == 404
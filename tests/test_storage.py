@@ -0,0 +1,97 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import MemoryStorage, SQLiteStorage, TaskIdGenerator
+
+ids = TaskIdGenerator(0)
+
+
+def make_task(text='x', created_at=None):
+    return {'id': ids.next_id(), 'text': text, 'completed': False,
+            'created_at': time.time() if created_at is None else created_at}
+
+
+def test_add_toggle_delete_keep_creation_order(storage):
+    tasks = [storage.add_task('a@example.com', make_task(f't{i}')) for i in range(5)]
+    assert storage.toggle_task('a@example.com', tasks[1]['id'])['completed'] is True
+    assert storage.delete_task('a@example.com', tasks[2]['id']) is True
+    assert storage.delete_task('a@example.com', tasks[2]['id']) is False
+    assert storage.toggle_task('a@example.com', tasks[2]['id']) is None
+    listed = storage.list_tasks('a@example.com')
+    assert [task['text'] for task in listed] == ['t0', 't1', 't3', 't4']
+    assert [task['completed'] for task in listed] == [False, True, False, False]
+
+
+def test_batch_of_historical_tasks_is_sorted(storage):
+    storage.add_task('a@example.com', make_task('nueva', created_at=2000.0))
+    batch = [{'op': 'create', 'task': make_task(f'h{i}', created_at=float(1000 - i))} for i in range(50)]
+    storage.apply_batch('a@example.com', batch)
+    page, cursor = storage.page_tasks('a@example.com', 100)
+    assert cursor is None and len(page) == 51
+    assert [task['created_at'] for task in page] == sorted(task['created_at'] for task in page)
+    assert page[-1]['text'] == 'nueva'
+
+
+def mutate(storage, user_email, count):
+    """Crea `count` tareas, las alterna tres veces y borra una de cada tres"""
+    created = [storage.add_task(user_email, make_task())['id'] for _ in range(count)]
+    for _ in range(3):
+        for task_id in created:
+            storage.toggle_task(user_email, task_id)
+    for task_id in created[::3]:
+        storage.delete_task(user_email, task_id)
+    return created
+
+
+@pytest.mark.parametrize('threads,per_thread,users', [(16, 100, 4)])
+def test_concurrent_mutations_keep_every_change(storage, threads, per_thread, users):
+    emails = [f'user{i}@example.com' for i in range(users)]
+    for email in emails:
+        storage.create_user(email, {'name': 'U', 'password': '00', 'created_at': 0.0})
+    start = threading.Barrier(threads)
+
+    def run(n):
+        start.wait()
+        return emails[n % users], mutate(storage, emails[n % users], per_thread)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(run, range(threads)))
+
+    for email in emails:
+        expected = set()
+        mutations = 0
+        for owner, created in results:
+            if owner == email:
+                expected |= set(created) - set(created[::3])
+                mutations += len(created) * 4 + len(created[::3])
+        tasks = storage.list_tasks(email)
+        assert len(tasks) == len(expected)
+        assert {task['id'] for task in tasks} == expected
+        assert all(task['completed'] for task in tasks)
+        assert storage.task_version(email) == mutations
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_old_change_cursors_get_a_reset(backend, tmp_path):
+    if backend == 'memory':
+        store = MemoryStorage(max_changes=10)
+    else:
+        store = SQLiteStorage(str(tmp_path / 'tareas.db'), max_changes=10)
+    store.create_user('a@example.com', {'name': 'A', 'password': '00', 'created_at': 0.0})
+    tasks = [store.add_task('a@example.com', make_task(f't{i}')) for i in range(40)]
+    for task in tasks[:30]:
+        store.delete_task('a@example.com', task['id'])
+    version = store.task_version('a@example.com')
+
+    # Un cursor reciente sigue recibiendo sólo las lápidas nuevas
+    _, changed, deleted, reset = store.task_changes('a@example.com', version - 2)
+    assert (changed, sorted(deleted), reset) == ([], sorted(t['id'] for t in tasks[28:30]), False)
+    # Uno anterior a lo que se recuerda recibe el listado completo
+    _, changed, deleted, reset = store.task_changes('a@example.com', 5)
+    assert reset and deleted == [] and [t['id'] for t in changed] == [t['id'] for t in tasks[30:]]
+    if backend == 'sqlite':
+        count = store._connection().execute('SELECT COUNT(*) FROM task_tombstones').fetchone()[0]
+        assert count <= 10 + 10 // 10
@@ -0,0 +1,42 @@
+import json
+
+
+def open_stream(api, query='', **headers):
+    response = api.get('/api/tasks/stream' + query, headers=headers, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    chunks = response.iter_encoded()
+    assert next(chunks) == b'retry: 3000\n\n'
+    return response, chunks
+
+
+def parse_event(chunk):
+    fields = dict(line.split(': ', 1) for line in chunk.decode('utf-8').strip().split('\n'))
+    return int(fields['id']), fields['event'], json.loads(fields['data'])
+
+
+def test_last_event_id_resumes_after_that_version(api):
+    api.post('/api/tasks', json={'text': 'vista'})
+    version = api.get('/api/tasks/changes?since=0').get_json()['version']
+    new = api.post('/api/tasks', json={'text': 'nueva'}).get_json()
+
+    # Last-Event-ID tiene prioridad sobre ?since
+    response, chunks = open_stream(api, '?since=0', **{'Last-Event-ID': str(version)})
+    event_id, event, data = parse_event(next(chunks))
+    response.close()
+    assert event == 'tasks' and event_id == data['version'] > version
+    assert data['reset'] is False and data['changed'] == [new] and data['deleted'] == []
+
+
+def test_idle_stream_sends_heartbeats_then_changes(app, api, monkeypatch):
+    monkeypatch.setitem(app.config, 'SSE_HEARTBEAT', 0.01)
+    api.post('/api/tasks', json={'text': 'vista'})
+    version = api.get('/api/tasks/changes?since=0').get_json()['version']
+
+    response, chunks = open_stream(api, **{'Last-Event-ID': str(version)})
+    assert next(chunks) == b': heartbeat\n\n'
+    assert next(chunks) == b': heartbeat\n\n'
+    task = api.post('/api/tasks', json={'text': 'nueva'}).get_json()
+    _, _, data = parse_event(next(chunks))
+    response.close()
+    assert data['changed'] == [task]
@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
+
+from app import MemoryStorage, SQLiteStorage, TaskIdGenerator, TaskIdLease, create_task_ids
+
+
+def generate(worker_id, threads, per_thread):
+    generator = TaskIdGenerator(worker_id)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(lambda _: [generator.next_id() for _ in range(per_thread)], range(threads)))
+
+
+def test_ids_are_unique_and_increasing_across_threads():
+    chunks = generate(0, 8, 20_000)
+    for chunk in chunks:
+        assert all(a < b for a, b in zip(chunk, chunk[1:]))
+    ids = [task_id for chunk in chunks for task_id in chunk]
+    assert len(set(ids)) == len(ids)
+    assert max(ids) < 2 ** 53
+
+
+def test_ids_are_unique_across_processes():
+    with get_context('spawn').Pool(4) as pool:
+        results = pool.starmap(generate, [(worker, 4, 5_000) for worker in range(4)])
+    ids = [task_id for chunks in results for chunk in chunks for task_id in chunk]
+    assert len(set(ids)) == len(ids)
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+        self.slept = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+
+def test_clock_going_back_waits_instead_of_repeating_ids():
+    clock = FakeClock(1_800_000_000.0)
+    generator = TaskIdGenerator(3, clock=clock.time, sleep=clock.sleep)
+    first = [generator.next_id() for _ in range(100)]
+    clock.now -= 5
+    second = [generator.next_id() for _ in range(100)]
+    assert len(set(first + second)) == 200
+    assert min(second) > max(first)
+    assert clock.slept >= 5
+
+
+def test_ids_never_run_ahead_of_the_clock():
+    clock = FakeClock(1_800_000_000.0)
+    generator = TaskIdGenerator(3, clock=clock.time, sleep=clock.sleep)
+    shift = TaskIdGenerator.WORKER_BITS + TaskIdGenerator.STRIPE_BITS + TaskIdGenerator.SEQUENCE_BITS
+    for _ in range(1000):
+        task_id = generator.next_id()
+        assert (task_id >> shift) + TaskIdGenerator.EPOCH_MS <= clock.now * 1000
+    # Un generador nuevo con el mismo worker id (un reinicio rápido) no repite
+    again = TaskIdGenerator(3, clock=clock.time, sleep=clock.sleep)
+    assert again.next_id() > task_id
+
+
+def test_processes_sharing_sqlite_claim_different_workers(tmp_path):
+    path = str(tmp_path / 'tareas.db')
+    stores = [SQLiteStorage(path) for _ in range(3)]
+    leases = [TaskIdLease(store, ttl=60) for store in stores]
+    assert len({lease.worker_id for lease in leases}) == 3
+
+    leases[0].release()
+    assert TaskIdLease(stores[0], ttl=60).worker_id == leases[0].worker_id
+
+
+def test_expired_lease_is_reclaimed_and_renewal_notices(tmp_path):
+    store = SQLiteStorage(str(tmp_path / 'tareas.db'))
+    stale = TaskIdLease(store, ttl=-1)
+    fresh = TaskIdLease(store, ttl=60)
+    assert fresh.worker_id == stale.worker_id
+    assert not store.renew_worker_id(stale.worker_id, stale.owner, 60)
+    assert store.renew_worker_id(fresh.worker_id, fresh.owner, 60)
+
+
+def test_single_process_backends_use_worker_zero():
+    generator, lease = create_task_ids({'TASK_ID_WORKER': None}, MemoryStorage())
+    assert generator.worker_id == 0 and lease is None
+    generator, lease = create_task_ids({'TASK_ID_WORKER': 7}, MemoryStorage())
+    assert generator.worker_id == 7 and lease is None
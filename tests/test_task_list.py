@@ -0,0 +1,53 @@
+import json
+
+from flask import jsonify
+
+import app as app_module
+
+
+def import_ndjson(client, tasks):
+    body = ''.join(json.dumps(task) + '\n' for task in tasks)
+    response = client.post('/api/tasks/import', data=body, content_type='application/x-ndjson')
+    assert response.get_json()['imported'] == len(tasks)
+
+
+def test_buffered_and_streamed_lists_agree(app, api, monkeypatch):
+    import_ndjson(api, [{'text': 'nueva', 'created_at': 2000}, {'text': 'vieja', 'created_at': 1000},
+                        {'text': 'media', 'created_at': 1500}])
+
+    buffered = api.get('/api/tasks')
+    assert 'ETag' in buffered.headers
+    monkeypatch.setitem(app.config, 'STREAM_JSON_THRESHOLD', 1)
+    monkeypatch.setitem(app.config, 'STREAM_JSON_CHUNK', 2)
+    app_module.task_list_cache.invalidate(api.email)
+    streamed = api.get('/api/tasks')
+    assert 'ETag' not in streamed.headers
+
+    assert streamed.get_data() == buffered.get_data()
+    assert [task['text'] for task in buffered.get_json()] == ['vieja', 'media', 'nueva']
+
+
+def test_task_list_etag_and_304(app, api):
+    api.post('/api/tasks', json={'text': 'primera'})
+    first = api.get('/api/tasks')
+    etag = first.headers['ETag']
+    with app.app_context():
+        # El cuerpo cacheado son exactamente los bytes de jsonify
+        assert first.get_data() == jsonify(app_module.storage.list_tasks(api.email)).get_data()
+
+    again = api.get('/api/tasks', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.get_data() == b''
+
+    api.post('/api/tasks', json={'text': 'segunda'})
+    changed = api.get('/api/tasks', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+    assert [task['text'] for task in changed.get_json()] == ['primera', 'segunda']
+
+
+def test_changes_etag_follows_the_version(api):
+    api.post('/api/tasks', json={'text': 'primera'})
+    first = api.get('/api/tasks/changes?since=0')
+    etag = first.headers['ETag']
+    assert api.get('/api/tasks/changes?since=0', headers={'If-None-Match': etag}).status_code == 304
+    api.post('/api/tasks', json={'text': 'segunda'})
+    assert api.get('/api/tasks/changes?since=0', headers={'If-None-Match': etag}).status_code == 200